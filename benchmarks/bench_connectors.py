@@ -0,0 +1,291 @@
+"""
+Benchmark of the build throughput of the connectors in bmtool.connectors.
+
+Node pools are synthesized with a given number of cells and spatial layout,
+so no BMTK network needs to be built. Each connector is driven through its
+edge_params() connection rule the same way the BMTK iterators call it. For
+every combination of connector, population size and probability function,
+the wall time, cell pairs per second and peak memory of building the
+connections are recorded. Results are written in JSON and can be compared
+with a previous run to detect regressions.
+
+Usage:
+    python benchmarks/bench_connectors.py --sizes 1000 4000 \\
+        --output bench.json
+    python benchmarks/bench_connectors.py --sizes 1000 4000 \\
+        --compare bench.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bmtool import connectors as conn  # noqa: E402
+
+CONNECTORS = ('reciprocal', 'unidirection', 'gap', 'correlated_gap',
+              'fixed_degree', 'one_to_one')
+PROBABILITIES = ('uniform', 'gaussian', 'nrr')
+LAYOUTS = ('cube', 'column')
+
+
+class Node(dict):
+    """Node object with node_id attribute and properties like BMTK nodes"""
+
+    def __init__(self, node_id, **properties):
+        super().__init__(node_id=node_id, **properties)
+        self.node_id = node_id
+
+
+class NodePool(object):
+    """Minimal stand-in of BMTK NodePool used by the connectors"""
+
+    def __init__(self, nodes, name):
+        self.nodes = nodes
+        self.network_name = 'bench'
+        self.filter_str = "pop_name=='%s'" % name
+        self._NodePool__properties = {'pop_name': name}
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+def make_positions(n, layout, density, rng):
+    """Random positions of n cells with density in cells per cubic um"""
+    volume = n / density
+    if layout == 'column':
+        # Cylinder with height twice its radius
+        radius = (volume / (2 * np.pi)) ** (1 / 3)
+        r = radius * np.sqrt(rng.random(n))
+        theta = 2 * np.pi * rng.random(n)
+        z = 2 * radius * rng.random(n)
+        return np.column_stack((r * np.cos(theta), r * np.sin(theta), z))
+    return volume ** (1 / 3) * rng.random((n, 3))
+
+
+def make_pool(n, layout, density, name, first_id, rng):
+    positions = make_positions(n, layout, density, rng)
+    nodes = [Node(first_id + i, positions=positions[i], pop_name=name)
+             for i in range(n)]
+    return NodePool(nodes, name)
+
+
+def probability_params(prob):
+    """Keyword arguments of the connectors for a probability function"""
+    if prob == 'gaussian':
+        p = conn.GaussianDropoff(stdev=150., max_dist=400., pmax=0.2)
+    else:
+        p = conn.UniformInRange(p=0.1, max_dist=300.)
+    params = {'p': p, 'p_arg': conn.spherical_dist}
+    if prob == 'nrr':
+        params['pr'] = conn.NormalizedReciprocalRate(NRR=2.)
+    else:
+        params['pr'] = 0.01
+    return params
+
+
+def run_rule(params):
+    """Call the connection rule for all nodes like the BMTK iterators"""
+    rule = params['connection_rule']
+    if params['iterator'] == 'one_to_all':
+        targets = list(params['target'])
+        for source in params['source']:
+            rule(source, targets)
+    else:
+        sources = list(params['source'])
+        for target in params['target']:
+            rule(sources, target)
+
+
+def build(name, pools, prob, options, reference=None):
+    """Create a connector and build its connections. Return the connector.
+    reference: Connector of the chemical synapses for CorrelatedGapJunction.
+    """
+    kwargs = {'verbose': False, 'seed': options.seed,
+              'n_workers': options.n_workers}
+    params = probability_params(prob)
+    pool_a, pool_b = pools
+    if name == 'reciprocal':
+        connector = conn.ReciprocalConnector(
+            p0=params['p'], p0_arg=params['p_arg'], p1=params['p'],
+            p1_arg=params['p_arg'], pr=params['pr'], pr_arg='p0_arg',
+            save_report=False, **kwargs)
+        connector.setup_nodes(pool_a, pool_b)
+        run_rule(connector.edge_params())
+        connector.setup_nodes(pool_b, pool_a)
+        run_rule(connector.edge_params())
+    elif name == 'one_to_one':
+        connector = conn.OneToOneSequentialConnector(verbose=False)
+        connector.setup_nodes(pool_a, pool_b)
+        run_rule(connector.edge_params())
+    else:
+        if name == 'unidirection':
+            connector = conn.UnidirectionConnector(
+                p=params['p'], p_arg=params['p_arg'], save_report=False,
+                **kwargs)
+        elif name == 'gap':
+            connector = conn.GapJunction(
+                p=params['p'], p_arg=params['p_arg'], save_report=False,
+                **kwargs)
+        elif name == 'correlated_gap':
+            connector = conn.CorrelatedGapJunction(
+                p_non=params['p'], p_uni=0.3, p_rec=0.6,
+                p_arg=params['p_arg'], connector=reference,
+                save_report=False, **kwargs)
+        else:
+            connector = conn.FixedDegreeConnector(
+                k=options.k, p=params['p'], p_arg=params['p_arg'],
+                save_report=False, **kwargs)
+        connector.setup_nodes(pool_a, pool_a)
+        run_rule(connector.edge_params())
+    return connector
+
+
+def make_pools(n, options):
+    """Source and target node pools of n cells each"""
+    rng = np.random.default_rng(options.seed)
+    return (make_pool(n, options.layout, options.density, 'A', 0, rng),
+            make_pool(n, options.layout, options.density, 'B', n, rng))
+
+
+def reference_connector(pools, prob, options):
+    """Recurrent chemical synapses used by CorrelatedGapJunction"""
+    params = probability_params(prob)
+    reference = conn.ReciprocalConnector(
+        p0=params['p'], p0_arg=params['p_arg'], pr=params['pr'],
+        pr_arg='p0_arg', verbose=False, save_report=False, seed=options.seed)
+    reference.setup_nodes(pools[0], pools[0])
+    run_rule(reference.edge_params())
+    return reference
+
+
+def pair_count(name, connector, n):
+    if name == 'one_to_one':
+        return n
+    if name == 'fixed_degree':
+        return connector.stats.counters.get('pairs_evaluated', 0)
+    return connector.pair_count()
+
+
+def benchmark_case(name, n, prob, options):
+    """Time a case and measure its peak memory. Return a result record."""
+    pools = make_pools(n, options)
+    reference = None
+    if name == 'correlated_gap':
+        reference = reference_connector(pools, prob, options)
+    times = []
+    for _ in range(options.repeat):
+        conn.distance_cache.clear()
+        start = time.perf_counter()
+        connector = build(name, pools, prob, options, reference)
+        times.append(time.perf_counter() - start)
+    best = min(times)
+    n_pair = pair_count(name, connector, n)
+    record = {
+        'connector': name, 'n_cells': n, 'probability': prob,
+        'layout': options.layout, 'n_pair': int(n_pair),
+        'n_conn': int(connector.stats.counters.get('connections', 0)),
+        'time': best, 'times': times,
+        'pairs_per_sec': n_pair / best if best > 0 else float('nan'),
+        'stages': connector.stats.to_dict()['stages']
+    }
+    if options.memory:
+        conn.distance_cache.clear()
+        tracemalloc.start()
+        build(name, pools, prob, options, reference)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        record['peak_memory'] = peak
+    return record
+
+
+def case_key(record):
+    return (record['connector'], record['n_cells'], record['probability'],
+            record['layout'])
+
+
+def compare(results, path):
+    """Print the ratio of time and peak memory to a previous run"""
+    with open(path) as f:
+        baseline = {case_key(r): r for r in json.load(f)['results']}
+    print("\n%-16s %8s %-10s %10s %10s" % ('connector', 'n_cells',
+                                           'prob', 'time', 'memory'))
+    for record in results:
+        base = baseline.get(case_key(record))
+        if base is None:
+            continue
+        mem = record.get('peak_memory', np.nan) / base.get('peak_memory', np.nan)
+        print("%-16s %8d %-10s %9.2fx %9.2fx" % (
+            record['connector'], record['n_cells'], record['probability'],
+            record['time'] / base['time'], mem))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the build throughput of bmtool connectors.")
+    parser.add_argument('--connectors', nargs='+', default=CONNECTORS,
+                        choices=CONNECTORS)
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 4000],
+                        help="Numbers of cells in each population.")
+    parser.add_argument('--probabilities', nargs='+', default=PROBABILITIES,
+                        choices=PROBABILITIES,
+                        help="Probability functions. 'nrr' uses "
+                        "UniformInRange with NormalizedReciprocalRate pr.")
+    parser.add_argument('--layout', default='cube', choices=LAYOUTS)
+    parser.add_argument('--density', type=float, default=1e-4,
+                        help="Cell density in cells per cubic um.")
+    parser.add_argument('--k', type=int, default=50,
+                        help="In-degree of the fixed degree connector.")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--n-workers', type=int, default=1)
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help="Skip the separate run measuring peak memory.")
+    parser.add_argument('--output', help="Path of the JSON result file.")
+    parser.add_argument('--compare', help="JSON result file of a previous "
+                        "run to compare with.")
+    options = parser.parse_args(argv)
+
+    results = []
+    for name in options.connectors:
+        # Probability functions do not apply to one-to-one connections
+        probs = ['uniform'] if name == 'one_to_one' else options.probabilities
+        for n in options.sizes:
+            for prob in probs:
+                if prob == 'nrr' and name != 'reciprocal':
+                    continue
+                record = benchmark_case(name, n, prob, options)
+                results.append(record)
+                print("%-16s %8d %-10s %9.3f s %12.3g pairs/s %10s" % (
+                    name, n, prob, record['time'], record['pairs_per_sec'],
+                    '%.1f MB' % (record['peak_memory'] / 2 ** 20)
+                    if 'peak_memory' in record else ''), flush=True)
+
+    out = {
+        'meta': {
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__, 'platform': platform.platform(),
+            'options': vars(options)
+        },
+        'results': results
+    }
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(out, f, indent=2)
+    if options.compare:
+        compare(results, options.compare)
+    return out
+
+
+if __name__ == '__main__':
+    main()
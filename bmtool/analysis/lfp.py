@@ -10,19 +10,35 @@ from fooof.sim.gen import gen_model
 import matplotlib.pyplot as plt
 from scipy import signal 
 import pywt
+from typing import Union
 from bmtool.bmplot import is_notebook
+from bmtool.util.util import expand_files, map_files
 
 
-def load_ecp_to_xarray(ecp_file: str, demean: bool = False) -> xr.DataArray:
+def _read_ecp(ecp_file: str) -> tuple:
+    """ECP data, channel ids and time (start, stop, step) of a file"""
+    with h5py.File(ecp_file, 'r') as f:
+        return f['ecp']['data'][()], f['ecp']['channel_id'][()], f['ecp']['time'][()]
+
+
+def load_ecp_to_xarray(ecp_file: Union[str, list], demean: bool = False, combine: str = 'sum',
+                       n_workers: int = 1) -> xr.DataArray:
     """
     Load ECP data from an HDF5 file (BMTK sim) into an xarray DataArray.
 
     Parameters:
     ----------
-    ecp_file : str
-        Path to the HDF5 file containing ECP data.
+    ecp_file : str or list
+        Path to the HDF5 file containing ECP data, or a glob pattern or list
+        of partial ECP files (e.g., one per MPI rank) to merge.
     demean : bool, optional
         If True, the mean of the data will be subtracted (default is False).
+    combine : str, optional
+        How partial files are merged. 'sum' adds the contributions of the cells
+        of each file to the same channels (default). 'channel' joins files
+        recording different channels.
+    n_workers : int, optional
+        Number of processes reading partial files in parallel (default is 1).
 
     Returns:
     -------
@@ -30,17 +46,31 @@ def load_ecp_to_xarray(ecp_file: str, demean: bool = False) -> xr.DataArray:
         An xarray DataArray containing the ECP data, with time as one dimension
         and channel_id as another.
     """
-    with h5py.File(ecp_file, 'r') as f:
-        ecp = xr.DataArray(
-            f['ecp']['data'][()].T,
-            coords=dict(
-                channel_id=f['ecp']['channel_id'][()],
-                time=np.arange(*f['ecp']['time'])  # ms
-            ),
-            attrs=dict(
-                fs=1000 / f['ecp']['time'][2]  # Hz
-            )
+    files = expand_files(ecp_file)
+    parts = map_files(_read_ecp, files, n_workers)
+    data, channel_id, time = parts[0]
+    if any(not np.array_equal(p[2], time) for p in parts):
+        raise ValueError('Time of the ECP files {} do not match.'.format(files))
+    if combine == 'sum':
+        if any(not np.array_equal(p[1], channel_id) for p in parts):
+            raise ValueError('Channels of the ECP files {} do not match.'.format(files))
+        for p in parts[1:]:
+            data = data + p[0]
+    elif combine == 'channel':
+        data = np.concatenate([p[0] for p in parts], axis=1)
+        channel_id = np.concatenate([p[1] for p in parts])
+    else:
+        raise ValueError("combine must be 'sum' or 'channel'.")
+    ecp = xr.DataArray(
+        data.T,
+        coords=dict(
+            channel_id=channel_id,
+            time=np.arange(*time)  # ms
+        ),
+        attrs=dict(
+            fs=1000 / time[2]  # Hz
         )
+    )
     if demean:
         ecp -= ecp.mean(dim='time')
     return ecp
@@ -0,0 +1,384 @@
+"""
+Module for processing BMTK cell and synapse reports.
+"""
+
+import threading
+
+import h5py
+import numpy as np
+import pandas as pd
+import xarray as xr
+from xarray.backends import BackendArray
+from xarray.core import indexing
+from typing import Iterator, Optional, Tuple, Union
+
+from bmtool.util.util import CellVarsFile, EdgeVarsFile, expand_files, load_nodes_from_config
+
+
+class ReportBackendArray(BackendArray):
+    """
+    Lazily indexed data table (time x element) of a report variable.
+    Only the selected time steps and elements are read, with the coalesced
+    column reads and the chunk cache of CellVarsFile.
+    """
+
+    def __init__(self, var_report: CellVarsFile, var_name: str):
+        self.var_report = var_report
+        self.var_name = var_name
+        ds = var_report.h5_dataset(var_name)
+        self.shape = ds.shape
+        self.dtype = ds.dtype
+        # h5py handles and the chunk cache are shared by dask threads
+        self.lock = threading.Lock()
+
+    def __deepcopy__(self, memo):
+        # Read-only view of an open file, shared by copies of the DataArray
+        return self
+
+    def __getitem__(self, key):
+        return indexing.explicit_indexing_adapter(
+            key, self.shape, indexing.IndexingSupport.OUTER, self._getitem)
+
+    def _getitem(self, key):
+        time_key, column_key = key
+        columns = np.atleast_1d(np.arange(self.shape[1])[column_key])
+        with self.lock:
+            if isinstance(time_key, slice) and (time_key.step or 1) > 0:
+                data = self.var_report.read_columns(self.var_name, time_key, columns)
+            else:
+                data = self._read_steps(np.atleast_1d(np.arange(self.shape[0])[time_key]), columns)
+        return data[tuple(0 if isinstance(k, (int, np.integer)) else slice(None) for k in key)]
+
+    def _read_steps(self, steps, columns):
+        """
+        Read time steps in any order. The sorted unique steps are coalesced
+        into runs, where consecutive steps are adjacent or in the same chunk
+        of the dataset, and only the range of each run is read.
+        """
+        steps, inverse = np.unique(steps, return_inverse=True)
+        data = np.empty((steps.size, columns.size), dtype=self.dtype)
+        if steps.size:
+            chunks = self.var_report.h5_dataset(self.var_name).chunks
+            chunk = chunks[0] if chunks else 1
+            split = np.flatnonzero((np.diff(steps) > 1) &
+                                   (steps[1:] // chunk != steps[:-1] // chunk)) + 1
+            starts = np.concatenate(([0], split))
+            stops = np.concatenate((split, [steps.size]))
+            for i, j in zip(starts, stops):
+                t0 = steps[i]
+                run = self.var_report.read_columns(
+                    self.var_name, slice(t0, steps[j - 1] + 1), columns)
+                data[i:j] = run[steps[i:j] - t0]
+        return data[inverse.ravel()]
+
+
+def open_report(report_file: Union[str, list], network_name: Optional[str] = None, **params) -> CellVarsFile:
+    """
+    Open a cell or synapse report file, or a glob pattern or list of partial
+    report files. Synapse reports (with src_ids in their mapping) are opened
+    as EdgeVarsFile. The report of the population network_name is used when
+    the file is organized by populations.
+    """
+    with h5py.File(expand_files(report_file)[0], 'r') as f:
+        if 'h5_root' not in params and network_name and 'report/' + network_name in f:
+            params['h5_root'] = 'report/' + network_name
+        mapping = f[params.get('h5_root', '/')].get('mapping', {})
+        is_edge = 'src_ids' in mapping
+    return (EdgeVarsFile if is_edge else CellVarsFile)(report_file, **params)
+
+
+def load_report_to_xarray(report_file: Union[str, CellVarsFile], var_name: Optional[str] = None,
+                          network_name: Optional[str] = None, config: Optional[str] = None,
+                          chunks: Optional[Union[bool, dict, str]] = None, **params) -> xr.DataArray:
+    """
+    Load a variable of a cell or synapse report (BMTK sim) into a lazy xarray DataArray.
+    Nothing is read until values are accessed, and selections read only the
+    selected time steps and elements.
+
+    Parameters:
+    ----------
+    report_file : str, list or CellVarsFile
+        Path to the HDF5 report file, a glob pattern or list of partial report
+        files (e.g., one per MPI rank), or an opened report.
+    var_name : str, optional
+        Variable to load. Defaults to the first variable of the report.
+    network_name : str, optional
+        Population of the report, used to find the report and the node properties.
+    config : str, optional
+        Simulation config used to label each element with the pop_name of its cell.
+    chunks : bool, dict or str, optional
+        If given, the DataArray is backed by a dask array with these chunks
+        (True for the chunks of the HDF5 dataset), so reductions are computed
+        chunk by chunk with bounded memory. Requires dask.
+    params :
+        Options of CellVarsFile, e.g., cache_mb or n_workers.
+
+    Returns:
+    -------
+    xr.DataArray
+        A DataArray with time and element dimensions. Elements have coordinates
+        gid, element_id, and source_id for synapse reports and pop_name if config is given.
+    """
+    if isinstance(report_file, CellVarsFile):
+        var_report = report_file
+    else:
+        var_report = open_report(report_file, network_name, **params)
+    if var_name is None:
+        var_name = var_report.variables[0]
+    if var_name not in var_report.variables:
+        raise ValueError('Unknown variable {}'.format(var_name))
+
+    backend = ReportBackendArray(var_report, var_name)
+    n_steps, n_elements = backend.shape
+    table = var_report.gid_table
+    coords = dict(
+        time=var_report.t_start + var_report.dt * np.arange(n_steps),  # ms
+        gid=('element', np.repeat(table.gids, table.ends - table.begins)[:n_elements]),
+        element_id=('element', var_report.element_ids)
+    )
+    if isinstance(var_report, EdgeVarsFile):
+        coords['source_id'] = ('element', np.asarray(var_report.sources()))
+    if config:
+        nodes = load_nodes_from_config(config)
+        nodes = nodes[network_name] if network_name else next(iter(nodes.values()))
+        coords['pop_name'] = ('element', nodes['pop_name'].reindex(coords['gid'][1]).values)
+
+    data = xr.DataArray(
+        xr.Variable(('time', 'element'), indexing.LazilyIndexedArray(backend)),
+        coords=coords,
+        name=var_name,
+        attrs=dict(
+            units=var_report.units(var_name),
+            fs=1000 / var_report.dt  # Hz
+        )
+    )
+    if chunks is not None:
+        if chunks is True:
+            chunks = var_report.h5_dataset(var_name).chunks or 'auto'
+            if chunks != 'auto':
+                chunks = dict(zip(data.dims, chunks))
+        data = data.chunk(chunks)
+    return data
+
+
+def iter_time_blocks(data: xr.DataArray, block_steps: Optional[int] = None) -> Iterator[xr.DataArray]:
+    """
+    Iterate over consecutive blocks of time steps of a lazy report DataArray,
+    loading one block at a time to stream computations with bounded memory.
+
+    Parameters:
+    ----------
+    data : xr.DataArray
+        DataArray from load_report_to_xarray, possibly with elements selected.
+    block_steps : int, optional
+        Number of time steps per block. Defaults to a multiple of the
+        chunk size along time of the HDF5 dataset of about 64 MB per block.
+
+    Yields:
+    -------
+    xr.DataArray
+        Loaded blocks of data over consecutive time windows.
+    """
+    n_steps = data.sizes['time']
+    if block_steps is None:
+        step_bytes = max(data.sizes['element'] * data.dtype.itemsize, 1)
+        block_steps = max(int(2 ** 26 // step_bytes), 1)
+        chunk = _time_chunk(data)
+        if chunk:
+            block_steps = max(block_steps // chunk, 1) * chunk
+    for t0 in range(0, n_steps, block_steps):
+        yield data.isel(time=slice(t0, t0 + block_steps)).load()
+
+
+def _time_chunk(data: xr.DataArray) -> Optional[int]:
+    """Chunk size along time of the HDF5 dataset backing a DataArray"""
+    array = data.variable._data
+    while hasattr(array, 'array'):
+        array = array.array
+    if isinstance(array, ReportBackendArray):
+        chunks = array.var_report.h5_dataset(array.var_name).chunks
+        return chunks[0] if chunks else None
+    return None
+
+
+def _group_labels(nodes, ids: np.ndarray, attributes: list) -> np.ndarray:
+    """Labels of node ids joining the values of node attributes with '_'"""
+    values = nodes.reindex(ids)[attributes].astype(str).values
+    return np.array(['_'.join(row) for row in values]) if values.size else np.empty(0, dtype=str)
+
+
+def _sample_quantiles(var_report: CellVarsFile, var_name: str, time_slice: slice, n_steps: int,
+                      codes: np.ndarray, n_groups: int, quantiles: list, quantile_sample: int,
+                      block_mb: float, seed: Optional[int]) -> np.ndarray:
+    """
+    Quantiles of a uniform random sample of at most quantile_sample columns
+    of each group, reading the sampled columns by blocks of time steps.
+    Returns array of shape (quantiles, groups, time steps).
+    """
+    rng = np.random.default_rng(seed)
+    sample = []
+    for g in range(n_groups):
+        columns = np.flatnonzero(codes == g)
+        if columns.size > quantile_sample:
+            columns = np.sort(rng.choice(columns, quantile_sample, replace=False))
+        sample.append(columns)
+    sizes = [columns.size for columns in sample]
+    bounds = np.concatenate(([0], np.cumsum(sizes)))
+    sample = np.concatenate(sample)
+    itemsize = var_report.h5_dataset(var_name).dtype.itemsize
+    block = max(int(block_mb * 2 ** 20 // max(sample.size * itemsize, 1)), 1)
+    result = np.full((len(quantiles), n_groups, n_steps), np.nan)
+    for t0 in range(0, n_steps, block):
+        t1 = min(t0 + block, n_steps)
+        window = slice(time_slice.start + t0, time_slice.start + t1)
+        data = var_report.read_columns(var_name, window, sample).astype(float)
+        for g in range(n_groups):
+            if sizes[g]:
+                result[:, g, t0:t1] = np.quantile(data[:, bounds[g]:bounds[g + 1]], quantiles, axis=1)
+    return result
+
+
+def population_stats(report_file: Union[str, CellVarsFile], var_name: Optional[str] = None,
+                     group_by: Union[str, list] = 'pop_name', source_group_by: Optional[Union[str, list]] = None,
+                     config: Optional[str] = None, network_name: Optional[str] = None, nodes=None,
+                     source_nodes=None, time_window: Optional[Tuple[float, float]] = None,
+                     quantiles: Optional[list] = None, quantile_sample: int = 256,
+                     block_mb: float = 64, seed: Optional[int] = None, **params) -> xr.Dataset:
+    """
+    Statistics of a report variable over the elements of each group of cells,
+    e.g., population-averaged membrane potential, or the mean and percentile
+    trajectories of a synaptic variable over the synapses of each projection.
+    The report is read in one pass over blocks of adjacent columns of about
+    block_mb MB, and the statistics are accumulated per group and time step.
+
+    Parameters:
+    ----------
+    report_file : str, list or CellVarsFile
+        Path to the HDF5 report file, a glob pattern or list of partial report
+        files (e.g., one per MPI rank), or an opened report.
+    var_name : str, optional
+        Variable of the report. Defaults to the first variable of the report.
+    group_by : str or list
+        Node attributes grouping the elements by their cell (the target cell
+        of synapse reports). Values of multiple attributes are joined with '_'.
+    source_group_by : str or list, optional
+        For synapse reports, node attributes of the source cells also grouping
+        the synapses. Groups are then labeled 'source->target'.
+    config : str, optional
+        Simulation config to load the node tables from.
+    network_name : str, optional
+        Population of the report. Defaults to the first population of the config.
+    nodes, source_nodes : pd.DataFrame, optional
+        Node tables indexed by node id, instead of loading them from config.
+        source_nodes defaults to nodes.
+    time_window : tuple, optional
+        Time window [begin, end] in ms. Defaults to the whole simulation.
+    quantiles : list, optional
+        Quantiles (in [0, 1]) to estimate per group and time step. They are
+        computed from a uniform random sample of at most quantile_sample
+        elements of each group, which is exact for smaller groups. The sampled
+        columns are read in a second pass over blocks of time steps of about
+        block_mb MB, so memory does not grow with the simulation length
+        beyond the result itself.
+    seed : int, optional
+        Seed of the random sample for quantiles.
+    params :
+        Options of CellVarsFile, e.g., cache_mb or n_workers.
+
+    Returns:
+    -------
+    xr.Dataset
+        Variables mean, std, min and max with dimensions group and time,
+        quantiles with dimensions quantile, group and time if quantiles are
+        given, and the number of elements count of each group.
+    """
+    if isinstance(report_file, CellVarsFile):
+        var_report = report_file
+    else:
+        var_report = open_report(report_file, network_name, **params)
+    if var_name is None:
+        var_name = var_report.variables[0]
+    if var_name not in var_report.variables:
+        raise ValueError('Unknown variable {}'.format(var_name))
+    if nodes is None:
+        if config is None:
+            raise ValueError('Either config or nodes must be given.')
+        networks = load_nodes_from_config(config)
+        nodes = networks[network_name] if network_name else next(iter(networks.values()))
+        if source_group_by is not None and source_nodes is None:
+            source_nodes = pd.concat(networks.values())
+    if source_nodes is None:
+        source_nodes = nodes
+
+    # Group of each column of the data table
+    table = var_report.gid_table
+    ds = var_report.h5_dataset(var_name)
+    n_columns = ds.shape[1]
+    gids = np.repeat(table.gids, table.ends - table.begins)[:n_columns]
+    labels = _group_labels(nodes, gids, list(np.atleast_1d(group_by)))
+    if source_group_by is not None:
+        if not isinstance(var_report, EdgeVarsFile):
+            raise ValueError('source_group_by requires a synapse report.')
+        sources = np.asarray(var_report.sources())[:n_columns]
+        source_labels = _group_labels(source_nodes, sources, list(np.atleast_1d(source_group_by)))
+        labels = np.char.add(np.char.add(source_labels, '->'), labels)
+    groups, codes = np.unique(labels, return_inverse=True)
+    codes = codes.ravel()
+
+    time_slice = var_report._time_slice(time_window)
+    n_steps = len(range(*time_slice.indices(ds.shape[0])))
+    n_groups = groups.size
+    count = np.zeros(n_groups, dtype=int)
+    mean = np.zeros((n_groups, n_steps))
+    m2 = np.zeros((n_groups, n_steps))
+    vmin = np.full((n_groups, n_steps), np.inf)
+    vmax = np.full((n_groups, n_steps), -np.inf)
+
+    # Blocks of whole chunks of columns
+    chunk = ds.chunks[1] if ds.chunks else 1
+    block = int(block_mb * 2 ** 20 // max(n_steps * ds.dtype.itemsize, 1))
+    block = max(block // chunk, 1) * chunk
+    for c0 in range(0, n_columns, block):
+        columns = np.arange(c0, min(c0 + block, n_columns))
+        data = var_report.read_columns(var_name, time_slice, columns).T.astype(float)
+        # Sort the columns of the block by group to reduce each group at once
+        order = np.argsort(codes[columns], kind='stable')
+        data = data[order]
+        block_codes = codes[columns][order]
+        present, starts, n = np.unique(block_codes, return_index=True, return_counts=True)
+        block_mean = np.add.reduceat(data, starts, axis=0) / n[:, None]
+        block_m2 = np.add.reduceat((data - np.repeat(block_mean, n, axis=0)) ** 2, starts, axis=0)
+        # Merge with the accumulated statistics (Chan et al.)
+        n_old = count[present][:, None]
+        total = n_old + n[:, None]
+        delta = block_mean - mean[present]
+        mean[present] += delta * n[:, None] / total
+        m2[present] += block_m2 + delta ** 2 * n_old * n[:, None] / total
+        count[present] += n
+        vmin[present] = np.minimum(vmin[present], np.minimum.reduceat(data, starts, axis=0))
+        vmax[present] = np.maximum(vmax[present], np.maximum.reduceat(data, starts, axis=0))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        std = np.sqrt(m2 / count[:, None])
+    time = var_report.t_start + var_report.dt * np.arange(time_slice.start, time_slice.start + n_steps)
+    stats = xr.Dataset(
+        data_vars=dict(
+            mean=(('group', 'time'), mean),
+            std=(('group', 'time'), std),
+            min=(('group', 'time'), vmin),
+            max=(('group', 'time'), vmax),
+            count=('group', count)
+        ),
+        coords=dict(group=groups, time=time),  # ms
+        attrs=dict(
+            variable=var_name,
+            units=var_report.units(var_name),
+            fs=1000 / var_report.dt  # Hz
+        )
+    )
+    if quantiles is not None:
+        stats = stats.assign_coords(quantile=np.asarray(quantiles))
+        stats['quantiles'] = (('quantile', 'group', 'time'), _sample_quantiles(
+            var_report, var_name, time_slice, n_steps, codes, n_groups,
+            quantiles, quantile_sample, block_mb, seed))
+    return stats
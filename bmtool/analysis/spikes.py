@@ -4,38 +4,151 @@ Module for processing BMTK spikes output.
 
 import h5py
 import pandas as pd
-from bmtool.util.util import load_nodes_from_config
+from bmtool.util.util import (SORTED_SPIKES_SUFFIX, expand_files, load_nodes_from_config, map_files,
+                              spikes_in_window)
 from typing import Dict, Optional,Tuple, Union
 import numpy as np
 import os
+from functools import partial
 
-def load_spikes_to_df(spike_file: str, network_name: str, sort: bool = True,config: str = None) -> pd.DataFrame:
+def _is_sorted_by_time(spikes: h5py.Group) -> bool:
+    """Whether the spikes of a population group are sorted by time, from the
+    SONATA 'sorting' attribute (a string or the enum written by BMTK) of the
+    group or of its node_ids dataset"""
+    for obj in (spikes, spikes.get('node_ids')):
+        if obj is None or 'sorting' not in obj.attrs:
+            continue
+        sorting = obj.attrs['sorting']
+        names = h5py.check_enum_dtype(obj.attrs.get_id('sorting').dtype)
+        if names:
+            sorting = {value: name for name, value in names.items()}.get(int(sorting))
+        elif isinstance(sorting, bytes):
+            sorting = sorting.decode()
+        return sorting in ('by_time', 'time')
+    return False
+
+
+def _h5_searchsorted(ds: h5py.Dataset, value: float, side: str = 'left', block: int = 4096) -> int:
+    """Index where value would be inserted in a sorted 1D dataset, reading
+    O(log n) elements and one final block instead of the whole dataset"""
+    lo, hi = 0, ds.shape[0]
+    while hi - lo > block:
+        mid = (lo + hi) // 2
+        x = ds[mid]
+        if x < value or (side == 'right' and x == value):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo + int(np.searchsorted(ds[lo:hi], value, side))
+
+
+def _sorted_spikes_file(spike_file: str, network_name: str) -> Optional[str]:
+    """
+    Path of a copy of the spikes of a population sorted by time, written next
+    to the spike file with SORTED_SPIKES_SUFFIX appended on first use, which
+    expand_files() skips, and rewritten when the spike file changes.
+    Returns None if the copy cannot be written.
+    """
+    sorted_file = spike_file + SORTED_SPIKES_SUFFIX
+    mtime = os.path.getmtime(spike_file)
+    try:
+        with h5py.File(sorted_file, 'a') as f:
+            spikes = f.get('spikes/' + network_name)
+            if spikes is not None and spikes.attrs.get('source_mtime') == mtime:
+                return sorted_file
+            with h5py.File(spike_file, 'r') as src:
+                node_ids = src['spikes'][network_name]['node_ids'][()]
+                timestamps = src['spikes'][network_name]['timestamps'][()]
+            order = np.argsort(timestamps, kind='stable')
+            if spikes is not None:
+                del f['spikes'][network_name]
+            spikes = f.require_group('spikes').create_group(network_name)
+            spikes.create_dataset('node_ids', data=node_ids[order], chunks=True)
+            spikes.create_dataset('timestamps', data=timestamps[order], chunks=True)
+            spikes.attrs['sorting'] = 'by_time'
+            spikes.attrs['source_mtime'] = mtime
+        return sorted_file
+    except OSError as e:
+        print("Warning: Could not cache spikes sorted by time in {}: {}".format(sorted_file, e))
+        return None
+
+
+def _read_spikes(spike_file: str, network_name: str, t_start: Optional[float] = None,
+                 t_stop: Optional[float] = None, cache_sorted: bool = False) -> Optional[Tuple[np.ndarray, np.ndarray, bool]]:
+    """
+    Node ids and timestamps of the spikes of a population in a file within the
+    time window [t_start, t_stop), and whether they are sorted by time. Spikes
+    sorted by time are located with a binary search and only the window is
+    read. Returns None if the file has no spikes of the population.
+    """
+    with h5py.File(spike_file, 'r') as f:
+        if network_name not in f['spikes']:
+            return None
+        spikes = f['spikes'][network_name]
+        by_time = _is_sorted_by_time(spikes)
+        if by_time or (t_start is None and t_stop is None) or not cache_sorted:
+            node_ids, timestamps = spikes['node_ids'], spikes['timestamps']
+            if by_time:
+                begin = 0 if t_start is None else _h5_searchsorted(timestamps, t_start)
+                end = timestamps.shape[0] if t_stop is None else _h5_searchsorted(timestamps, t_stop)
+                return node_ids[begin:end], timestamps[begin:end], True
+            node_ids, timestamps = node_ids[()], timestamps[()]
+            mask = np.ones(timestamps.size, dtype=bool)
+            if t_start is not None:
+                mask &= timestamps >= t_start
+            if t_stop is not None:
+                mask &= timestamps < t_stop
+            return node_ids[mask], timestamps[mask], False
+    sorted_file = _sorted_spikes_file(spike_file, network_name)
+    return _read_spikes(sorted_file or spike_file, network_name, t_start, t_stop)
+
+
+def load_spikes_to_df(spike_file: Union[str, list], network_name: str, sort: bool = True, config: str = None,
+                      n_workers: int = 1, t_start: Optional[float] = None, t_stop: Optional[float] = None,
+                      cache_sorted: bool = False) -> pd.DataFrame:
     """
     Load spike data from an HDF5 file into a pandas DataFrame.
 
     Args:
-        spike_file (str): Path to the HDF5 file containing spike data.
+        spike_file (Union[str, list]): Path to the HDF5 file containing spike data, or a glob pattern
+            or list of partial spike files (e.g., one per MPI rank) to merge.
         network_name (str): The name of the network within the HDF5 file from which to load spike data.
         sort (bool, optional): Whether to sort the DataFrame by 'timestamps'. Defaults to True.
         config(str, optional): Will label the cell type of each spike 
+        n_workers (int, optional): Number of processes reading partial files in parallel. Defaults to 1.
+        t_start (float, optional): Load only spikes at or after this time (ms). Defaults to None.
+        t_stop (float, optional): Load only spikes before this time (ms). Defaults to None.
+        cache_sorted (bool, optional): For files not sorted by time, write a copy sorted by time next to
+            the spike file on first use, so that time windows are read without loading all spikes. Defaults to False.
 
     Returns:
         pd.DataFrame: A pandas DataFrame containing 'node_ids' and 'timestamps' columns from the spike data.
+
+    Notes:
+        - Files sorted by time (SONATA 'sorting' attribute 'by_time') are searched with a binary
+          search, so only the spikes in the time window are read, and are not sorted again.
     
     Example:
         df = load_spikes_to_df("spikes.h5", "cortex")
+        df = load_spikes_to_df("output/spikes_rank*.h5", "cortex", n_workers=4)
+        df = load_spikes_to_df("spikes.h5", "cortex", t_start=1000, t_stop=2000)
     """
-    with h5py.File(spike_file) as f:
-        spikes_df = pd.DataFrame({
-            'node_ids': f['spikes'][network_name]['node_ids'],
-            'timestamps': f['spikes'][network_name]['timestamps']
-        })
-        if sort:
-            spikes_df.sort_values(by='timestamps', inplace=True, ignore_index=True)
-        if config:
-            nodes = load_nodes_from_config(config)
-            nodes = nodes[network_name]
-            spikes_df = spikes_df.merge(nodes['pop_name'], left_on='node_ids', right_index=True, how='left')
+    files = expand_files(spike_file)
+    read = partial(_read_spikes, network_name=network_name, t_start=t_start, t_stop=t_stop,
+                   cache_sorted=cache_sorted)
+    parts = [p for p in map_files(read, files, n_workers) if p is not None]
+    if not parts:
+        raise KeyError('No spikes of network {} in {}'.format(network_name, files))
+    spikes_df = pd.DataFrame({
+        'node_ids': np.concatenate([p[0] for p in parts]),
+        'timestamps': np.concatenate([p[1] for p in parts])
+    })
+    if sort and not (len(parts) == 1 and parts[0][2]):
+        spikes_df.sort_values(by='timestamps', inplace=True, ignore_index=True)
+    if config:
+        nodes = load_nodes_from_config(config)
+        nodes = nodes[network_name]
+        spikes_df = spikes_df.merge(nodes['pop_name'], left_on='node_ids', right_index=True, how='left')
 
     return spikes_df
 
@@ -116,6 +229,11 @@ def get_population_spike_rate(spikes: pd.DataFrame, fs: float = 400.0, t_start:
         print("Note: Node number is obtained by counting unique node spikes in the network.\nIf the network did not run for a sufficient duration, and not all cells fired, this count might be incorrect.")
         print("You can provide a config to calculate the correct amount of nodes!")
 
+    if t_stop is None:
+        t_stop = spikes['timestamps'].max()
+    # Spikes of all populations in the time window, found once
+    window = spikes_in_window(spikes, t_start, t_stop, include_start=False)
+
     for pop_name in spikes['pop_name'].unique():
         ps = spikes[spikes['pop_name'] == pop_name]
         
@@ -127,15 +245,7 @@ def get_population_spike_rate(spikes: pd.DataFrame, fs: float = 400.0, t_start:
         else:
             node_number[pop_name] = ps['node_ids'].nunique()
 
-        if t_stop is None:
-            t_stop = spikes['timestamps'].max()
-
-        filtered_spikes = spikes[
-            (spikes['pop_name'] == pop_name) & 
-            (spikes['timestamps'] > t_start) & 
-            (spikes['timestamps'] < t_stop)
-        ]
-        pop_spikes[pop_name] = filtered_spikes
+        pop_spikes[pop_name] = window[window['pop_name'] == pop_name]
 
     time = np.array([t_start, t_stop, 1000 / fs])
     pop_rspk = {p: pop_spike_rate(spk['timestamps'], time) for p, spk in pop_spikes.items()}
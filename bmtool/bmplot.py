@@ -22,7 +22,8 @@ import sys
 import re
 from typing import Optional, Dict
 
-from .util.util import CellVarsFile,load_nodes_from_config #, missing_units
+from .util.util import CellVarsFile,load_nodes_from_config,spikes_in_window #, missing_units
+from .connectors import read_connection_report, report_percentages
 from bmtk.analyzer.utils import listify
 
 use_description = """
@@ -614,7 +615,7 @@ def plot_connection_info(text, num, source_labels, target_labels, title, syn_inf
 
 def connector_percent_matrix(csv_path: str = None, exclude_strings=None, assemb_key=None, title: str = 'Percent connection matrix', pop_order=None) -> None:
     """
-    Generates and plots a connection matrix based on connection probabilities from a CSV file produced by bmtool.connector.
+    Generates and plots a connection matrix based on connection probabilities from a report file produced by bmtool.connector.
 
     This function is useful for visualizing percent connectivity while factoring in population distance and other parameters. 
     It processes the connection data by filtering the 'Source' and 'Target' columns in the CSV, and displays the percentage of 
@@ -623,8 +624,9 @@ def connector_percent_matrix(csv_path: str = None, exclude_strings=None, assemb_
     Parameters:
     -----------
     csv_path : str
-        Path to the CSV file containing the connection data. The CSV should be an output from the bmtool.connector 
-        classes, specifically generated by the `save_connection_report()` function.
+        Path to the report file containing the connection data. The file should be an output from the bmtool.connector 
+        classes, specifically generated by the `save_connection_report()` function. It is a CSV report by default
+        (report_name 'conn.csv'), or an HDF5 report if the report_name of the connector does not end in '.csv'.
     exclude_strings : list of str, optional
         List of strings to exclude rows where 'Source' or 'Target' contain these strings.
     title : str, optional, default='Percent connection matrix'
@@ -637,12 +639,29 @@ def connector_percent_matrix(csv_path: str = None, exclude_strings=None, assemb_
     None
         Displays a heatmap plot of the connection matrix, showing the percentage of connected pairs between populations.
     """
-    # Read the CSV data
-    df = pd.read_csv(csv_path)
-
     # Choose the column to display
     selected_column = "Percent connectionivity within possible connections"
 
+    # Read the report data
+    if csv_path.endswith('.csv'):
+        df = pd.read_csv(csv_path)
+    else:
+        # Structured report has typed columns. Convert to the same layout
+        report = read_connection_report(csv_path)
+        gap = np.where(report['connection_type'] == 'gap', 'Gap', '')
+        df = pd.DataFrame({
+            'Source': report['source'] + gap,
+            'Target': report['target'] + gap,
+            selected_column: report_percentages(report, 'percent_possible'),
+            'Percent connectionivity within all connections': report_percentages(report, 'percent_all')
+        })
+
+    def percent_list(value):
+        # Legacy CSV stores multiple percentages as a string of an array
+        if isinstance(value, str):
+            return [float(p) for p in value.strip('[]').split()]
+        return value
+
     # Filter the DataFrame based on exclude_strings
     def filter_dataframe(df, column_name, exclude_strings):
         def process_string(string):
@@ -683,8 +702,7 @@ def connector_percent_matrix(csv_path: str = None, exclude_strings=None, assemb_
             # find the prob of a conn
             forward_probs = []
             for _,row in unique_assems.iterrows():
-                selected_percentage = row[selected_column]
-                selected_percentage = [float(p) for p in selected_percentage.strip('[]').split()]
+                selected_percentage = np.atleast_1d(percent_list(row[selected_column])).tolist()
                 if len(selected_percentage) == 1 or len(selected_percentage) == 2:
                     forward_probs.append(selected_percentage[0])
                 if len(selected_percentage) == 3:
@@ -707,9 +725,7 @@ def connector_percent_matrix(csv_path: str = None, exclude_strings=None, assemb_
     connection_data = {}
     for _, row in df.iterrows():
         source, target, selected_percentage = row['Source'], row['Target'], row[selected_column]
-        if isinstance(selected_percentage, str):
-            selected_percentage = [float(p) for p in selected_percentage.strip('[]').split()]
-        connection_data[(source, target)] = selected_percentage
+        connection_data[(source, target)] = percent_list(selected_percentage)
 
     # Determine population order
     populations = sorted(list(set(df['Source'].unique()) | set(df['Target'].unique())))
@@ -801,10 +817,7 @@ def raster(spikes_df: Optional[pd.DataFrame] = None, config: Optional[str] = Non
         _, ax = plt.subplots(1, 1)
 
     # Filter spikes by time range if specified
-    if tstart is not None:
-        spikes_df = spikes_df[spikes_df['timestamps'] > tstart]
-    if tstop is not None:
-        spikes_df = spikes_df[spikes_df['timestamps'] < tstop]
+    spikes_df = spikes_in_window(spikes_df, tstart, tstop, include_start=False)
 
     # Load and merge node population data if config is provided
     if config:
@@ -1098,14 +1111,22 @@ def plot_network_graph(config=None,nodes=None,edges=None,title=None,sources=None
 
     return
 
-def plot_report(config_file=None, report_file=None, report_name=None, variables=None, gids=None):
+def plot_report(config_file=None, report_file=None, report_name=None, variables=None, gids=None,
+                time_window=None, max_points=None, pyramid_file=None):
+    """
+    Plot traces of report variables of cells.
+    time_window: [begin, end] in ms to plot. Defaults to the whole simulation.
+    max_points: Number of time points to draw per trace. Defaults to twice the
+        width in pixels of the axes. Longer windows are drawn from the min/max
+        envelope of the matching level of the decimation pyramid.
+    pyramid_file: Sidecar file of the decimation pyramid (see CellVarsFile.pyramid).
+    """
     if report_file is None:
         report_name, report_file = _get_cell_report(config_file, report_name)
 
     var_report = CellVarsFile(report_file)
     variables = listify(variables) if variables is not None else var_report.variables
     gids = listify(gids) if gids is not None else var_report.gids
-    time_steps = var_report.time_trace
 
     def __units_str(var):
         units = var_report.units(var)
@@ -1113,13 +1134,27 @@ def plot_report(config_file=None, report_file=None, report_name=None, variables=
             units = missing_units.get(var, '')
         return '({})'.format(units) if units else ''
 
+    def __plot_traces(ax, var):
+        n_points = max_points or 2 * max(int(ax.bbox.width), 1)
+        time, mins, maxs, index = var_report.envelope(
+            gids, var_name=var, time_window=time_window, max_points=n_points, pyramid_file=pyramid_file)
+        if mins is not maxs:
+            # Alternate minimum and maximum of each bin to draw the envelope
+            time = np.repeat(time, 2)
+            data = np.empty((time.size, mins.shape[1]), dtype=mins.dtype)
+            data[0::2] = mins
+            data[1::2] = maxs
+        else:
+            data = mins
+        for j, gid in enumerate(gids):
+            ax.plot(time, data[:, index[j]:index[j + 1]], label='gid {}'.format(gid))
+
     n_plots = len(variables)
     if n_plots > 1:
         # If more than one variale to plot do so in different subplots
         f, axarr = plt.subplots(n_plots, 1)
         for i, var in enumerate(variables):
-            for gid in gids:
-                axarr[i].plot(time_steps, var_report.data(gid=gid, var_name=var), label='gid {}'.format(gid))
+            __plot_traces(axarr[i], var)
 
             axarr[i].legend()
             axarr[i].set_ylabel('{} {}'.format(var, __units_str(var)))
@@ -1131,8 +1166,7 @@ def plot_report(config_file=None, report_file=None, report_name=None, variables=
     elif n_plots == 1:
         # For plotting a single variable
         plt.figure()
-        for gid in gids:
-            plt.plot(time_steps, var_report.data(gid=gid, var_name=variables[0]), label='gid {}'.format(gid))
+        __plot_traces(plt.gca(), variables[0])
         plt.ylabel('{} {}'.format(variables[0], __units_str(variables[0])))
         plt.xlabel('time (ms)')
         plt.legend()
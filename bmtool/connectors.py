@@ -2,9 +2,20 @@ from abc import ABC, abstractmethod
 import numpy as np
 from scipy.special import erf
 from scipy.optimize import minimize_scalar
+from scipy.spatial import cKDTree
 from functools import partial
-import time
+from collections import OrderedDict
+from contextlib import contextmanager
+import hashlib
+import json
 import types
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import tempfile
+import weakref
+import time
+import os
+import h5py
 import pandas as pd
 import re
 
@@ -23,6 +34,86 @@ def num_prop(ratio, N):
     return np.diff(np.round(N / p[-1] * p).astype(int)).reshape(ratio.shape)
 
 
+BLOCK_PAIRS = 2 ** 20  # number of cell pairs processed at once
+
+
+def triu_block(start, stop, n, k=1):
+    """
+    Row and column indices of the upper triangle of an n x n matrix, i.e.,
+    pairs (i, j) with j >= i + k, within rows i in range [start, stop).
+    """
+    i = np.arange(start, stop)
+    counts = np.fmax(n - i - k, 0)
+    rows = np.repeat(i, counts)
+    offset = np.arange(rows.size) - np.repeat(np.cumsum(counts) - counts, counts)
+    return rows, rows + k + offset
+
+
+def rect_block(start, stop, n_col):
+    """Row and column indices of all pairs within rows in range [start, stop)
+    of a matrix with n_col columns"""
+    rows = np.repeat(np.arange(start, stop), n_col)
+    cols = np.tile(np.arange(n_col), stop - start)
+    return rows, cols
+
+
+def triu_index_pairs(start, stop, n, idx, k=1):
+    """Row and column indices of pairs given their flat indices in the order
+    of triu_block(start, stop, n, k)"""
+    i = np.arange(start, stop)
+    counts = np.fmax(n - i - k, 0)
+    ends = np.cumsum(counts)
+    r = np.searchsorted(ends, idx, side='right')
+    rows = start + r
+    return rows, rows + k + idx - (ends - counts)[r]
+
+
+SPARSE_P_MAX = 0.25  # use geometric skipping for probabilities below this
+
+
+def bernoulli_indices(p, n, rng):
+    """
+    Indices in range(n) each selected independently with probability p.
+    For small p, gaps between selected indices are drawn from a geometric
+    distribution, so that the cost scales with the number selected instead
+    of n. Return sorted int64 array.
+    """
+    if p <= 0 or n <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if p >= 1:
+        return np.arange(n, dtype=np.int64)
+    if p > SPARSE_P_MAX:
+        return np.flatnonzero(rng.random(n) < p)
+    size = int(n * p + 4 * (n * p * (1 - p)) ** .5) + 16
+    idx = []
+    last = -1
+    while last < n:
+        steps = last + np.cumsum(rng.geometric(p, size=size))
+        idx.append(steps[steps < n])
+        last = steps[-1]
+    return np.concatenate(idx).astype(np.int64)
+
+
+def bernoulli_mask(p, rng):
+    """
+    Make independent random decisions given an array of probabilities p.
+    Only pairs with non-zero probability are drawn. If their probabilities
+    are all the same, e.g., UniformInRange, they are drawn by geometric
+    skipping with bernoulli_indices(). Return bool array of the same shape.
+    """
+    p = np.asarray(p)
+    mask = np.zeros(p.shape, dtype=bool)
+    cand = np.flatnonzero(p > 0)
+    if cand.size == 0:
+        return mask
+    p_cand = p.ravel()[cand]
+    if p_cand.min() == p_cand.max():
+        mask.flat[cand[bernoulli_indices(p_cand[0], cand.size, rng)]] = True
+    else:
+        mask.flat[cand] = rng.random(cand.size) < p_cand
+    return mask
+
+
 def decision(prob, size=None):
     """
     Make single random decision based on input probability.
@@ -32,14 +123,17 @@ def decision(prob, size=None):
     return rng.random(size) < prob
 
 
-def decisions(prob):
+def decisions(prob, generator=None):
     """
     Make multiple random decisions based on input probabilities.
     prob: iterable
+    generator: Random number generator. Use the module generator if not
+        specified.
     Return bool array of the same shape
     """
+    generator = rng if generator is None else generator
     prob = np.asarray(prob)
-    return rng.random(prob.shape) < prob
+    return generator.random(prob.shape) < prob
 
 
 def euclid_dist(p1, p2):
@@ -61,9 +155,216 @@ def cylindrical_dist_z(node1, node2):
     return euclid_dist(node1['positions'][:2], node2['positions'][:2]).item()
 
 
+# Distance functions that can be evaluated from position arrays directly,
+# mapped to the axes of the positions they use.
+DIST_FUNC_AXES = {spherical_dist: slice(None), cylindrical_dist_z: slice(2)}
+
+
+def node_positions(nodes):
+    """Stack the positions of a list of node objects into an (n, 3) array"""
+    return np.array([node['positions'] for node in nodes], dtype=float)
+
+
+def positions_key(positions):
+    """Key that identifies a population by its position array"""
+    return positions.shape, hashlib.sha1(positions.tobytes()).hexdigest()
+
+
+DIST_CACHE_BYTES = 2 ** 28  # default memory limit of the distance cache
+
+
+class DistanceCache(object):
+    """
+    Cache of blocks of pairwise distances shared across connectors.
+
+    Connectors on the same population pair, e.g., the chemical synapses and
+    the correlated gap junctions within a population, evaluate the same
+    distance function over the same blocks of cell pairs. Blocks are keyed by
+    the distance function, the position arrays of the source and target
+    populations and the layout of the pairs in the block. The least recently
+    used blocks are discarded when the memory limit is exceeded. Blocks that
+    are computed in forked worker processes are only cached in the worker.
+
+    Parameters:
+        max_bytes: Memory limit of the cached arrays. 0 disables the cache.
+    """
+
+    def __init__(self, max_bytes=DIST_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.clear()
+
+    def clear(self):
+        self._blocks = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Get cached array or None if not cached"""
+        if key is None:
+            return None
+        dist = self._blocks.get(key)
+        if dist is None:
+            self.misses += 1
+        else:
+            self._blocks.move_to_end(key)
+            self.hits += 1
+        return dist
+
+    def put(self, key, dist):
+        """Cache a read-only array if it fits in the memory limit"""
+        if key is None or dist.nbytes > self.max_bytes:
+            return
+        dist.flags.writeable = False
+        self._blocks[key] = dist
+        self.nbytes += dist.nbytes
+        while self.nbytes > self.max_bytes:
+            _, old = self._blocks.popitem(last=False)
+            self.nbytes -= old.nbytes
+
+
+distance_cache = DistanceCache()
+
+
+def pair_values(func, source_list, target_list, rows, cols, positions=None,
+                cache_key=None):
+    """
+    Evaluate a function of two node objects, func(source, target), for pairs
+    of nodes given by arrays of indices into the source and target lists.
+    Known distance functions (see DIST_FUNC_AXES) are computed vectorized
+    from node positions. Other functions are called once per pair, and a
+    non-callable func is treated as a constant value.
+    positions: Optional tuple of (source, target) position arrays, to avoid
+        stacking the positions again on every call.
+    cache_key: Optional key identifying the populations and the layout of
+        rows and cols, under which distances are kept in distance_cache.
+        Cached arrays are read-only.
+    Return array of values with the same shape as rows.
+    """
+    rows, cols = np.asarray(rows), np.asarray(cols)
+    if not callable(func):
+        return np.full(rows.shape, func)
+    axes = DIST_FUNC_AXES.get(func)
+    if axes is not None:
+        key = None if cache_key is None else (func, ) + tuple(cache_key)
+        dist = distance_cache.get(key)
+        if dist is None:
+            if positions is None:
+                positions = (node_positions(source_list),
+                             node_positions(target_list))
+            dvec = positions[0][rows, axes] - positions[1][cols, axes]
+            dist = np.sqrt(np.einsum('...i,...i', dvec, dvec))
+            distance_cache.put(key, dist)
+        return dist
+    values = [func(source_list[i], target_list[j])
+              for i, j in zip(rows.ravel(), cols.ravel())]
+    return np.array(values).reshape(rows.shape)
+
+
+def probability_values(func, args):
+    """
+    Evaluate a probability function for an array of its input arguments.
+    ProbabilityFunction objects are evaluated vectorized through their
+    batched probability() method, distance dependent ones within their
+    distance range. Other callables, e.g., lambda functions, are called once
+    per element, and a non-callable func is treated as a constant
+    probability.
+    Return float array of probabilities with the same shape as args.
+    """
+    args = np.asarray(args)
+    if not callable(func):
+        return np.full(args.shape, func, dtype=float)
+    if isinstance(func, DistantDependentProbability):
+        return func.masked_probability(args)
+    if isinstance(func, ProbabilityFunction):
+        # Batched protocol
+        prob = np.empty(args.shape)
+        prob[...] = func.probability(args)
+        return prob
+    return np.array([func(arg) for arg in args.ravel()],
+                    dtype=float).reshape(args.shape)
+
+
+CONN_CACHE_VERSION = 1  # version of the format of connection cache files
+
+
+def param_token(obj, _depth=0):
+    """
+    Stable string representation of a connector parameter for hashing.
+    Functions are represented by their name, bytecode, constants, default
+    arguments and closure values, and other objects by their class and
+    attributes. So the representation does not depend on memory addresses
+    and changes when the definition of a function changes. Global variables
+    used in a function are not included.
+    """
+    if _depth > 8:
+        return '...'
+    token = partial(param_token, _depth=_depth + 1)
+    if obj is None or isinstance(obj, (bool, int, float, complex, str, bytes,
+                                       np.generic)):
+        return repr(obj)
+    if isinstance(obj, np.ndarray):
+        if obj.dtype == object:
+            return 'array(%s)' % token(obj.tolist())
+        data = hashlib.sha1(np.ascontiguousarray(obj).tobytes()).hexdigest()
+        return 'array(%s,%s,%s)' % (obj.dtype, obj.shape, data)
+    if isinstance(obj, (list, tuple)):
+        return type(obj).__name__ + '(' + ','.join(map(token, obj)) + ')'
+    if isinstance(obj, dict):
+        items = sorted((token(k), token(v)) for k, v in obj.items())
+        return 'dict(' + ','.join(k + ':' + v for k, v in items) + ')'
+    if isinstance(obj, partial):
+        return 'partial(%s,%s,%s)' % (token(obj.func), token(obj.args),
+                                      token(obj.keywords))
+    if isinstance(obj, types.MethodType):
+        return 'method(%s,%s)' % (token(obj.__func__), token(obj.__self__))
+    if isinstance(obj, types.FunctionType):
+        closure = []
+        for cell in obj.__closure__ or ():
+            try:
+                closure.append(cell.cell_contents)
+            except ValueError:
+                closure.append(None)  # empty cell
+        return 'function(%s.%s,%s,%s,%s)' % (
+            obj.__module__, obj.__qualname__, token(obj.__code__),
+            token(obj.__defaults__), token(closure))
+    if isinstance(obj, types.CodeType):
+        return 'code(%s,%s,%s)' % (hashlib.sha1(obj.co_code).hexdigest(),
+                                   token(obj.co_consts), token(obj.co_names))
+    if hasattr(obj, '__dict__') and not isinstance(obj, type):
+        cls = type(obj)
+        return '%s.%s(%s)' % (cls.__module__, cls.__qualname__,
+                              token(vars(obj)))
+    return repr(obj)
+
+
+def conditional_backward_probability(cond, p0, p1, pr):
+    """
+    Conditional probability of backward connection given the outcome of
+    forward connection, for arrays of forward, backward and reciprocal
+    probabilities p0, p1, pr. pr is clipped to its valid range given p0, p1.
+    cond: bool array of whether forward connection exists.
+    """
+    pr = np.clip(pr, p0 + p1 - 1, np.fmin(p0, p1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        prob = np.where(cond, pr / p0, (p1 - pr) / (1 - p0))
+    return np.where(p0 > 0, prob, p1)
+
+
 # Probability Classes
 class ProbabilityFunction(ABC):
-    """Abstract base class for connection probability function"""
+    """
+    Abstract base class for connection probability function.
+
+    Probability functions follow a batched protocol, so that connectors
+    evaluate them for all cell pairs of a block at once. probability() and
+    decisions() accept numpy arrays of the input arguments and return arrays.
+    Reciprocal probability functions used as `pr` in ReciprocalConnector take
+    arguments (pr_arg, p0, p1) and also implement conditional_probability().
+    Connectors detect subclasses of this class and use the batched methods.
+    Other callables, e.g., lambda functions, are called with scalar inputs
+    once per cell pair.
+    """
 
     @abstractmethod
     def probability(self, *arg, **kwargs):
@@ -95,16 +396,18 @@ class DistantDependentProbability(ProbabilityFunction):
         else:
             return 0.
 
-    def decisions(self, dist):
-        """Return bool array of decisions given distance array"""
+    def masked_probability(self, dist):
+        """Return probability array given distance array, which is zero
+        outside the distance range"""
         dist = np.asarray(dist)
-        dec = np.zeros(dist.shape, dtype=bool)
+        prob = np.zeros(dist.shape)
         mask = (dist >= self.min_dist) & (dist <= self.max_dist)
-        dist = dist[mask]
-        prob = np.empty(dist.shape)
-        prob[:] = self.probability(dist)
-        dec[mask] = decisions(prob)
-        return dec
+        prob[mask] = self.probability(dist[mask])
+        return prob
+
+    def decisions(self, dist, generator=None):
+        """Return bool array of decisions given distance array"""
+        return decisions(self.masked_probability(dist), generator)
 
 
 class UniformInRange(DistantDependentProbability):
@@ -255,7 +558,16 @@ class NormalizedReciprocalRate(ProbabilityFunction):
         """Return probability for single distance input"""
         return self.probability(dist, p0, p1)
 
-    def decisions(self, dist, p0, p1, cond=None):
+    def conditional_probability(self, dist, p0, p1, cond):
+        """Return conditional probability array of backward connection
+        dist: distance (scalar or array). Will be ignored if NRR is constant.
+        p0, p1: forward and backward probability (scalar or array)
+        cond: bool array of whether forward connection exists.
+        """
+        return conditional_backward_probability(
+            cond, p0, p1, self.probability(dist, p0, p1))
+
+    def decisions(self, dist, p0, p1, cond=None, generator=None):
         """Return bool array of decisions
         dist: distance (scalar or array). Will be ignored if NRR is constant.
         p0, p1: forward and backward probability (scalar or array)
@@ -263,16 +575,19 @@ class NormalizedReciprocalRate(ProbabilityFunction):
             Conditional probability will be returned if specified. The condition
             event is determined by connection direction (0 for forward, or 1 for
             backward) and outcomes (bool array of whether connection exists).
+        generator: Random number generator. Use the module generator if not
+            specified.
         """
         dist, p0, p1 = map(np.asarray, (dist, p0, p1))
-        pr = np.empty(dist.shape)
-        pr[:] = self.probability(dist, p0, p1)
+        shape = np.broadcast(dist, p0, p1).shape
+        pr = np.empty(shape)
+        pr[...] = self.probability(dist, p0, p1)
         pr = np.clip(pr, a_min=np.fmax(p0 + p1 - 1., 0.), a_max=np.fmin(p0, p1))
         if cond is not None:
-            mask = np.asarray(cond[1])
-            pr[mask] /= p1 if cond[0] else p0
-            pr[~mask] = 0.
-        return decisions(pr)
+            mask = np.broadcast_to(cond[1], shape)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                pr = np.where(mask, pr / (p1 if cond[0] else p0), 0.)
+        return decisions(pr, generator)
 
 
 # Connector Classes
@@ -298,6 +613,396 @@ class AbstractConnector(ABC):
             return val
         return constant
 
+    def get_row_blocks(self):
+        """Split source rows into blocks of `block_size` rows. If not
+        specified, the block size is set such that each block has about
+        BLOCK_PAIRS pairs. The blocks do not depend on the number of workers,
+        and are the same for connectors on the same population pair."""
+        k = self.triangle_offset()
+        n_col = self.n_target if k is None else self.n_source // 2
+        size = self.block_size or max(BLOCK_PAIRS // max(n_col, 1), 1)
+        return [(i, min(i + size, self.n_source))
+                for i in range(0, self.n_source, size)]
+
+    def block_pair_count(self, start, stop):
+        """Number of pairs in a block of source rows"""
+        k = self.triangle_offset()
+        if k is None:
+            return (stop - start) * self.n_target
+        return int(np.sum(np.fmax(self.n_source - np.arange(start, stop) - k, 0)))
+
+    def index_pairs(self, start, stop, idx):
+        """Indices of source and target for pairs given their flat indices in
+        a block of source rows, in the order of block_pairs()"""
+        k = self.triangle_offset()
+        if k is None:
+            return start + idx // self.n_target, idx % self.n_target
+        return triu_index_pairs(start, stop, self.n_source, idx, k=k)
+
+    def setup_positions(self, funcs):
+        """Stack node positions if any of funcs is a distance function that
+        can be vectorized, and set up the key for the distance cache"""
+        self.positions = None
+        self.positions_key = None
+        if any(func in DIST_FUNC_AXES for func in funcs):
+            self.positions = (node_positions(self.source_list),
+                              node_positions(self.target_list))
+            self.positions_key = tuple(map(positions_key, self.positions))
+
+    def distance_key(self, block):
+        """Key of distance_cache for pairs in a block (start, stop) of
+        source rows, or None if not cacheable"""
+        if block is None or self.positions_key is None:
+            return None
+        k = self.triangle_offset()
+        layout = ('rect', ) if k is None else ('triu', k)
+        return self.positions_key + layout + tuple(block)
+
+    def run_blocks(self, method, blocks):
+        """
+        Run method(start, stop, rng) for each block of rows and yield the
+        outputs in order of the blocks. Each block gets its own random number
+        generator from streams spawned from the connector seed, so the result
+        does not depend on how the blocks are distributed. Blocks run in a
+        pool of `n_workers` forked processes if n_workers > 1.
+        """
+        global _block_connector
+        seeds = np.random.SeedSequence(self.seed).spawn(len(blocks))
+        tasks = [(method, start, stop, seed)
+                 for (start, stop), seed in zip(blocks, seeds)]
+        n_workers = min(self.n_workers or 1, len(tasks))
+        if n_workers > 1:
+            if 'fork' in multiprocessing.get_all_start_methods():
+                _block_connector = self
+                ctx = multiprocessing.get_context('fork')
+                try:
+                    with ProcessPoolExecutor(n_workers, mp_context=ctx) as pool:
+                        yield from pool.map(_run_block, tasks)
+                finally:
+                    _block_connector = None
+                return
+            print("\nWarning: Process fork is not supported on this platform. "
+                  "Running blocks in a single process.\n", flush=True)
+        for method, start, stop, seed in tasks:
+            yield getattr(self, method)(start, stop,
+                                        np.random.default_rng(seed))
+
+    # *** Instrumentation ***
+    @property
+    def stats(self):
+        """ConnectorStats of building the connections of this connector"""
+        if '_stats' not in self.__dict__:
+            self._stats = ConnectorStats()
+        return self._stats
+
+    def count_block(self, start, stop):
+        """Count the pairs in a block of source rows whose probabilities are
+        evaluated at once"""
+        n = self.block_pair_count(start, stop)
+        self.stats.count('pairs_evaluated', n)
+        self.stats.peak('block_pairs', n)
+
+    def build_connections(self):
+        """Load the connections from the cache, or generate and cache them,
+        and record the stats"""
+        stats = self.stats
+        with stats.stage('load_cache'):
+            loaded = self.load_cache()
+        stats.count('loaded_from_cache', loaded)
+        if not loaded:
+            hits, misses = distance_cache.hits, distance_cache.misses
+            self.generate_connections()
+            stats.count('distance_cache_hits', distance_cache.hits - hits)
+            stats.count('distance_cache_misses',
+                        distance_cache.misses - misses)
+            with stats.stage('save_cache'):
+                self.save_cache()
+        stores = self.conn_stores()
+        stats.count('connections', sum(len(store) for store in stores))
+        stats.peak('store_bytes', sum(store.nbytes for store in stores))
+
+    # *** Persistent cache of generated connections ***
+    CACHE_ATTRS = ()  # attributes of connection numbers saved in the cache
+
+    def setup_cache(self, cache_dir, seed):
+        """Set the cache directory. Caching requires a specified seed, since
+        connections generated with a random seed are not reproducible."""
+        if cache_dir is not None and seed is None:
+            print("\nWarning: Connection cache is disabled since seed is not "
+                  "specified.\n", flush=True)
+            cache_dir = None
+        self.cache_dir = cache_dir
+        self.cache_path = None
+
+    def cache_params(self):
+        """Parameters that determine the generated connections"""
+        return {'class': type(self).__name__, 'vars': self.vars,
+                'seed': self.seed, 'block_size': self.block_size,
+                'block_pairs': BLOCK_PAIRS}
+
+    def conn_stores(self):
+        """List of the connection stores of the connector"""
+        if isinstance(self.conn_store, list):
+            return self.conn_store
+        return [self.conn_store]
+
+    def cache_file(self):
+        """Path of the cache file of the generated connections, named by a
+        hash of the connector parameters, seed, and the node ids and
+        positions of the source and target populations. Return None if
+        caching is disabled."""
+        if self.cache_dir is None:
+            return None
+        sha = hashlib.sha1(str(CONN_CACHE_VERSION).encode())
+        sha.update(param_token(self.cache_params()).encode())
+        for nodes in (self.source_list, self.target_list):
+            sha.update(np.array([n.node_id for n in nodes]).tobytes())
+            try:
+                sha.update(node_positions(nodes).tobytes())
+            except (KeyError, ValueError):
+                pass  # nodes without positions
+        return os.path.join(self.cache_dir, 'conn_%s.npz' % sha.hexdigest())
+
+    def load_cache(self):
+        """Restore the connection stores and CACHE_ATTRS from the cache file
+        if it exists. Return whether the connections are loaded."""
+        self.cache_path = self.cache_file()
+        if self.cache_path is None or not os.path.isfile(self.cache_path):
+            return False
+        # Property values may be saved as object arrays, e.g., None p_arg
+        with np.load(self.cache_path, allow_pickle=True) as data:
+            for i, store in enumerate(self.conn_stores()):
+                store.restore(data, prefix='store%d_' % i)
+            for attr in self.CACHE_ATTRS:
+                value = data[attr]
+                setattr(self, attr, value.item() if value.ndim == 0 else value)
+        if self.verbose:
+            print("Loaded connections from cache " + self.cache_path,
+                  flush=True)
+        return True
+
+    def save_cache(self):
+        """Save the finalized connection stores and CACHE_ATTRS to the cache
+        file if caching is enabled"""
+        if self.cache_path is None:
+            return
+        arrays = {}
+        for i, store in enumerate(self.conn_stores()):
+            store.save(arrays, prefix='store%d_' % i)
+        for attr in self.CACHE_ATTRS:
+            arrays[attr] = np.asarray(getattr(self, attr))
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Write to a temporary file first so that a partial file is never read
+        fd, tmp_path = tempfile.mkstemp(suffix='.npz', dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, self.cache_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    # *** Dry run estimation ***
+    def register(self):
+        """Add this connector to the registry for estimate_connectors()"""
+        if all(ref() is not self for ref in _connector_registry):
+            _connector_registry.append(weakref.ref(self))
+
+    def triangle_offset(self):
+        """Offset k if pairs are the upper triangle j >= i + k of a recurrent
+        population, or None if pairs are all source and target combinations"""
+        return None
+
+    def pair_count(self):
+        """Number of cell pairs considered by the connector"""
+        k = self.triangle_offset()
+        if k is None:
+            return self.n_source * self.n_target
+        n = max(self.n_source - k, 0)
+        return n * (n + 1) // 2
+
+    def is_built(self):
+        """Whether connections have been generated by the connector"""
+        stores = getattr(self, 'conn_store', None)
+        stores = stores if isinstance(stores, list) else [stores]
+        return any(store is not None and store.finalized for store in stores)
+
+    @contextmanager
+    def dry_run(self):
+        """
+        Context for estimating connections without changing the state of the
+        connector. Attributes set while initializing for the estimation are
+        discarded on exit, and the parameters and statistics are copied.
+        Raise ValueError if nodes are not set up or connections are built.
+        """
+        if getattr(self, 'source', None) is None:
+            raise ValueError("Nodes must be set up before estimation.")
+        if self.is_built():
+            raise ValueError("Connections are already built. Use the "
+                             "connector statistics instead of estimation.")
+        state = self.__dict__.copy()
+        self.vars = dict(self.vars)
+        self._stats = ConnectorStats()
+        try:
+            yield
+        finally:
+            self.__dict__.clear()
+            self.__dict__.update(state)
+
+    def sample_pairs(self, n_sample, rng):
+        """Indices of source and target of pairs drawn uniformly at random
+        from all pairs. Use all pairs if there are no more than n_sample."""
+        if self.pair_count() <= n_sample:
+            return self.block_pairs(0, self.n_source)
+        k = self.triangle_offset()
+        if k is None:
+            return (rng.integers(self.n_source, size=n_sample),
+                    rng.integers(self.n_target, size=n_sample))
+        rows, cols = np.zeros((2, 0), dtype=int)
+        while rows.size < n_sample:
+            i, j = rng.integers(self.n_source, size=(2, 2 * n_sample))
+            valid = j >= i + k
+            rows = np.concatenate((rows, i[valid]))
+            cols = np.concatenate((cols, j[valid]))
+        return rows[:n_sample], cols[:n_sample]
+
+    def estimate_summary(self, n_pair, n_sample, n_conn, n_conn_std, n_syn,
+                         p, time_per_pair, n_recp=np.nan):
+        """Scale up expected numbers from sampled pairs and project memory
+        usage and build time. Return a dictionary of the estimates."""
+        n_conn = float(n_conn)
+        return {
+            'n_pair': n_pair, 'n_sample': n_sample, 'n_conn': n_conn,
+            'n_conn_std': float(n_conn_std), 'n_syn': float(n_syn),
+            'n_recp': float(n_recp),
+            'recp_fraction': float(n_recp / (n_conn - n_recp))
+                if n_conn > n_recp else np.nan,
+            'p_max': float(np.max(p, initial=0.)),
+            'n_p_invalid': int(np.count_nonzero((p < 0) | (p > 1))),
+            'conn_store_bytes': int(n_conn * CONN_STORE_BYTES),
+            'conn_prop_bytes': int(n_conn * CONN_PROP_BYTES),
+            'bmtk_table_bytes': int(self.n_source * self.n_target
+                                    * BMTK_TABLE_BYTES),
+            'build_time': time_per_pair * n_pair
+        }
+
+
+# Rough memory usage per connection of array ConnectionStore, conn_prop
+# dictionaries, and per cell pair of the dense number of synapses table in BMTK
+CONN_STORE_BYTES = 33
+CONN_PROP_BYTES = 120
+BMTK_TABLE_BYTES = 4
+
+# Weak references to connectors that have set up nodes, in order
+_connector_registry = []
+
+
+def registered_connectors():
+    """List of registered connectors that still exist"""
+    return [c for c in (ref() for ref in _connector_registry) if c is not None]
+
+
+def connector_name(connector):
+    """Name of a connector with its source and target populations"""
+    src_str, trg_str = connector.get_nodes_info()
+    return type(connector).__name__ + '(' + src_str + ' -> ' + trg_str + ')'
+
+
+def connector_stats(connectors=None, path=None):
+    """
+    Collect the stats of building connections of multiple connectors into a
+    machine-readable record, e.g., after BMTK network.build(), to find the
+    slow projections.
+    connectors: List of connectors. If not specified, use all connectors that
+        have set up nodes, i.e., registered_connectors().
+    path: Path of a JSON file to write the record to. Not written if not
+        specified.
+    Return a dictionary with a list of records of the connectors, each with
+    the connector name, wall time of stages in seconds (see ConnectorStats),
+    total time, counters and peak values, and the totals over all connectors,
+    including the time for writing connection reports.
+    """
+    if connectors is None:
+        connectors = registered_connectors()
+    records = []
+    total = ConnectorStats()
+    for connector in connectors:
+        stats = connector.stats
+        record = {'name': connector_name(connector)}
+        record.update(stats.to_dict())
+        records.append(record)
+        for stage, seconds in stats.stages.items():
+            total.add_time(stage, seconds)
+        for name, n in stats.counters.items():
+            total.count(name, n)
+        for name, value in stats.peaks.items():
+            total.peak(name, value)
+    total.add_time('write_reports', _report_write_time[0])
+    out = {'connectors': records, 'total': total.to_dict()}
+    if path is not None:
+        with open(path, 'w') as f:
+            json.dump(out, f, indent=2)
+    return out
+
+
+def estimate_connectors(connectors=None, n_sample=10000, seed=None,
+                        verbose=True):
+    """
+    Dry run estimation of connections for multiple connectors before building
+    the network. Random pairs are sampled through the same probability
+    functions used for building, and the expected numbers are extrapolated.
+    connectors: List of connectors. If not specified, use all connectors that
+        have set up nodes, i.e., registered_connectors().
+    n_sample: Number of cell pairs sampled for each connector.
+    seed: Seed for sampling pairs.
+    verbose: Whether print the summary table.
+    Return a DataFrame with a row of estimates for each connector, see
+    estimate() method of the connectors, and a total row.
+    """
+    if connectors is None:
+        connectors = [c for c in registered_connectors()
+                      if hasattr(c, 'estimate')]
+    rng_seeds = np.random.SeedSequence(seed).spawn(len(connectors))
+    rows = []
+    index = []
+    for connector, rng_seed in zip(connectors, rng_seeds):
+        name = connector_name(connector)
+        try:
+            est = connector.estimate(n_sample=n_sample, seed=rng_seed)
+        except (ValueError, AttributeError) as e:
+            print("Warning: Unable to estimate %s: %s" % (name, e), flush=True)
+            continue
+        rows.append(est)
+        index.append(name)
+    df = pd.DataFrame(rows, index=index)
+    if len(df):
+        total = df.sum(numeric_only=True, min_count=1)
+        total['n_conn_std'] = np.sqrt(np.sum(df['n_conn_std'] ** 2))
+        total['recp_fraction'] = total['n_recp'] / (
+            total['n_conn'] - total['n_recp'])
+        total['p_max'] = df['p_max'].max()
+        df.loc['Total'] = total
+    if verbose:
+        with pd.option_context('display.max_columns', None,
+                               'display.width', 200):
+            print(df, flush=True)
+        for name in df.index[df['n_p_invalid'] > 0]:
+            print("Warning: Probability outside [0, 1] found in " + name,
+                  flush=True)
+    return df
+
+
+# Connector whose blocks are being run in forked worker processes. Workers
+# inherit it on fork so the connector does not need to be pickled.
+_block_connector = None
+
+
+def _run_block(task):
+    """Run a block of a connector in a worker process"""
+    method, start, stop, seed = task
+    return getattr(_block_connector, method)(start, stop,
+                                             np.random.default_rng(seed))
+
 
 # Helper functions
 def is_same_pop(source, target, quick=False):
@@ -340,6 +1045,388 @@ class Timer(object):
         print((msg + ": %.3f " + self.unit) % self.end(),flush=True)
 
 
+class ConnectorStats(object):
+    """
+    Machine-readable record of building the connections of a connector.
+
+    Important attributes:
+        stages: Dictionary of the wall time in seconds spent in each stage,
+            in order of the stages. Time of a stage that runs multiple times
+            is accumulated.
+        counters: Dictionary of counts of the work done, e.g., the number of
+            cell pairs whose probabilities are evaluated.
+        peaks: Dictionary of maximum values, e.g., the largest number of
+            cell pairs evaluated at once in a block.
+    """
+
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.counters = OrderedDict()
+        self.peaks = OrderedDict()
+        self._start = {}
+
+    def start(self, stage):
+        self._start[stage] = time.perf_counter()
+
+    def stop(self, stage):
+        """Add the time since start(stage) to the stage"""
+        start = self._start.pop(stage, None)
+        if start is not None:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def add_time(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.) + seconds
+
+    @contextmanager
+    def stage(self, stage):
+        """Context manager that times a stage"""
+        self.start(stage)
+        try:
+            yield
+        finally:
+            self.stop(stage)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def peak(self, name, value):
+        self.peaks[name] = max(self.peaks.get(name, 0), int(value))
+
+    def to_dict(self):
+        """Return the record as a dictionary of built-in types"""
+        return {'stages': dict(self.stages),
+                'total_time': sum(self.stages.values()),
+                'counters': dict(self.counters), 'peaks': dict(self.peaks)}
+
+
+class ConnectionStore(object):
+    """
+    Array-backed store of the connections generated by a connector.
+
+    Connected pairs are kept as arrays of row (source) and column (target)
+    indices into the node lists of the connector, together with the number
+    of synapses and the property value (usually p_arg) of each pair. Blocks
+    of pairs can be appended in any order. They are sorted by row and then
+    column when finalized, which is the order BMTK creates edges in.
+
+    Parameters:
+        source_ids, target_ids: Node ids corresponding to the row and column
+            indices respectively.
+        out_of_core: Whether to spill appended blocks to a temporary directory
+            on disk instead of keeping them in memory. The finalized arrays
+            are then memory-mapped, so that memory usage does not grow with
+            the number of connections. Property values must be numeric.
+        tmp_dir: Directory in which the temporary directory is created. If
+            not specified, use the system default.
+
+    Important attributes:
+        rows, cols, nsyns, props: Arrays of the connected pairs after the
+            store is finalized.
+        indptr: Index pointer of the rows, such that connections of row i
+            are in range indptr[i]:indptr[i + 1] of the arrays above.
+    """
+
+    FIELDS = ('rows', 'cols', 'nsyns', 'props')
+
+    def __init__(self, source_ids, target_ids, out_of_core=False, tmp_dir=None):
+        self.source_ids = np.asarray(source_ids)
+        self.target_ids = np.asarray(target_ids)
+        self.n_row = self.source_ids.size
+        self.n_col = self.target_ids.size
+        self._source_order = np.argsort(self.source_ids)
+        self._target_order = np.argsort(self.target_ids)
+        self.out_of_core = out_of_core
+        self.tmp_dir = tmp_dir
+        self._tmp = None
+        self._n_spilled = 0
+        self._n_files = 0
+        self._blocks = []
+        self.finalized = False
+
+    def append(self, rows, cols, nsyns, props):
+        """Add a block of connected pairs"""
+        block = (np.asarray(rows, dtype=np.int64),
+                 np.asarray(cols, dtype=np.int64),
+                 np.asarray(nsyns, dtype=np.uint8), np.asarray(props))
+        if self.out_of_core:
+            self._spill(block)
+        else:
+            self._blocks.append(block)
+        self.finalized = False
+
+    def _spill(self, block):
+        """Write a block of pairs to the end of the buffer files on disk"""
+        if self._tmp is None:
+            self._tmp = tempfile.TemporaryDirectory(prefix='conn_store_',
+                                                    dir=self.tmp_dir)
+        block = block[:3] + (block[3].astype(float),)
+        for name, x in zip(self.FIELDS, block):
+            with open(os.path.join(self._tmp.name, name + '.bin'), 'ab') as f:
+                x.tofile(f)
+        self._n_spilled += block[0].size
+
+    def _load_spill(self):
+        """Memory-map the buffer files of the spilled blocks"""
+        n = self._n_spilled
+        dtypes = (np.int64, np.int64, np.uint8, float)
+        if n == 0:
+            return [np.zeros(0, dtype=dtype) for dtype in dtypes]
+        return [np.memmap(os.path.join(self._tmp.name, name + '.bin'),
+                          dtype=dtype, mode='r', shape=(n,))
+                for name, dtype in zip(self.FIELDS, dtypes)]
+
+    def _new_array(self, dtype, n):
+        """Allocate an array in memory, or memory-mapped if out of core"""
+        if self._tmp is None or n == 0:
+            return np.empty(n, dtype=dtype)
+        self._n_files += 1
+        path = os.path.join(self._tmp.name, 'array%d.bin' % self._n_files)
+        return np.memmap(path, dtype=dtype, mode='w+', shape=(n,))
+
+    def finalize(self):
+        """Concatenate appended blocks and sort the pairs"""
+        if self.out_of_core:
+            rows, cols, nsyns, props = self._load_spill()
+        elif self._blocks:
+            rows, cols, nsyns, props = map(np.concatenate, zip(*self._blocks))
+        else:
+            rows, cols = np.zeros((2, 0), dtype=np.int64)
+            nsyns, props = np.zeros(0, dtype=np.uint8), np.zeros(0)
+        # Compute and check keys in chunks to bound memory when out of core
+        n = rows.size
+        keys = self._new_array(np.int64, n)
+        is_sorted = True
+        for i in range(0, n, BLOCK_PAIRS):
+            idx = slice(i, i + BLOCK_PAIRS)
+            keys[idx] = rows[idx] * self.n_col + cols[idx]
+            chunk = keys[max(i - 1, 0):i + BLOCK_PAIRS]
+            is_sorted = is_sorted and not np.any(chunk[1:] < chunk[:-1])
+        if not is_sorted:
+            order = np.argsort(keys, kind='stable')
+            sorted_arrays = []
+            for x in (rows, cols, nsyns, props, keys):
+                y = self._new_array(x.dtype, n)
+                for i in range(0, n, BLOCK_PAIRS):
+                    y[i:i + BLOCK_PAIRS] = x[order[i:i + BLOCK_PAIRS]]
+                sorted_arrays.append(y)
+            del order
+            rows, cols, nsyns, props, keys = sorted_arrays
+        self.rows, self.cols, self.nsyns, self.props = rows, cols, nsyns, props
+        self.keys = keys
+        self.indptr = np.searchsorted(rows, np.arange(self.n_row + 1))
+        if not self.out_of_core:
+            self._blocks = [(rows, cols, nsyns, props)]
+        self.finalized = True
+
+    def __len__(self):
+        if not self.finalized:
+            self.finalize()
+        return self.rows.size
+
+    @property
+    def nbytes(self):
+        """Bytes of the arrays of stored pairs"""
+        if not self.finalized:
+            self.finalize()
+        return sum(getattr(self, name).nbytes
+                   for name in self.FIELDS + ('keys', 'indptr'))
+
+    def row(self, i):
+        """Number of synapses from row i to all columns as a dense array"""
+        if not self.finalized:
+            self.finalize()
+        nsyns = np.zeros(self.n_col, dtype=np.uint8)
+        idx = slice(self.indptr[i], self.indptr[i + 1])
+        nsyns[self.cols[idx]] = self.nsyns[idx]
+        return nsyns
+
+    def save(self, arrays, prefix=''):
+        """Add the arrays of stored pairs to a dictionary for np.savez"""
+        if not self.finalized:
+            self.finalize()
+        for name in self.FIELDS:
+            arrays[prefix + name] = getattr(self, name)
+
+    def restore(self, arrays, prefix=''):
+        """Replace the stored pairs with the arrays added by save()"""
+        self._blocks = []
+        self.append(*(arrays[prefix + name] for name in self.FIELDS))
+        self.finalize()
+
+    def update_conn_prop(self, conn_dict, reverse=False):
+        """Add stored pairs to a conn_prop dictionary {sid: {tid: prop}}.
+        If reverse is True, add them from target to source instead."""
+        if not self.finalized:
+            self.finalize()
+        sids = self.source_ids[self.rows].tolist()
+        tids = self.target_ids[self.cols].tolist()
+        if reverse:
+            sids, tids = tids, sids
+        for sid, tid, prop in zip(sids, tids, self.props.tolist()):
+            conn_dict.setdefault(sid, {})[tid] = prop
+
+    @staticmethod
+    def _ids_2_idx(ids, node_ids, order):
+        """Convert node ids to indices given the order that sorts node_ids.
+        Return -1 for ids not found."""
+        ids = np.asarray(ids)
+        if node_ids.size == 0:
+            return np.full(ids.shape, -1, dtype=np.int64)
+        pos = np.searchsorted(node_ids, ids, sorter=order)
+        idx = order[np.fmin(pos, node_ids.size - 1)]
+        return np.where(node_ids[idx] == ids, idx, -1)
+
+    def lookup(self, sids, tids):
+        """Look up connections given arrays of source and target node ids.
+        Return a bool array of whether each pair is connected and an array
+        of the property values, which are invalid where not connected."""
+        if not self.finalized:
+            self.finalize()
+        rows = self._ids_2_idx(sids, self.source_ids, self._source_order)
+        cols = self._ids_2_idx(tids, self.target_ids, self._target_order)
+        keys = rows * self.n_col + cols
+        if self.keys.size == 0:
+            return np.zeros(keys.shape, dtype=bool), np.zeros(keys.shape)
+        pos = np.fmin(np.searchsorted(self.keys, keys), self.keys.size - 1)
+        found = (rows >= 0) & (cols >= 0) & (self.keys[pos] == keys)
+        return found, np.asarray(self.props[pos])
+
+    def get_prop(self, sid, tid):
+        """Property value of a connected pair. Raise KeyError if the pair is
+        not connected, like a conn_prop dictionary."""
+        found, prop = self.lookup([sid], [tid])
+        if not found[0]:
+            raise KeyError((sid, tid))
+        return prop[0].item()
+
+
+# Connection report
+REPORT_DIRECTIONS = ('forward', 'backward', 'reciprocal')
+REPORT_GROUP = 'connections'
+_pending_reports = {}  # rows of connection report waiting to be written
+_report_write_time = [0.]  # total time for writing connection reports
+
+
+def add_connection_report(report_name, source, target, connection_type,
+                          n_pair, directions, n_conn, n_poss, fraction,
+                          write=True):
+    """
+    Add a row of connection numbers of a connector to the report.
+    report_name: Path of the report file.
+    source, target: Strings of source and target population information.
+    connection_type: 'reciprocal', 'unidirection', 'gap' or 'fixed_degree'.
+    n_pair: Number of cell pairs.
+    directions: Subset of REPORT_DIRECTIONS the numbers are given for.
+    n_conn, n_poss: Numbers of connected pairs and possible connections of
+        each direction. n_poss can be a scalar shared by all directions.
+    fraction: Fractions of connected pairs in possible ones and in all pairs,
+        array of shape (2, number of directions).
+    write: Whether to write the row to file immediately. Otherwise it is kept
+        pending until the next write_connection_reports() call.
+    """
+    row = {'source': source, 'target': target,
+           'connection_type': connection_type, 'n_pair': int(n_pair)}
+    n_poss = np.broadcast_to(n_poss, (len(directions), ))
+    fraction = np.reshape(fraction, (2, len(directions)))
+    for d in REPORT_DIRECTIONS:
+        i = directions.index(d) if d in directions else None
+        row['n_conn_' + d] = -1 if i is None else int(n_conn[i])
+        row['n_poss_' + d] = -1 if i is None else int(n_poss[i])
+        row['percent_possible_' + d] = np.nan if i is None \
+            else 100. * fraction[0, i]
+        row['percent_all_' + d] = np.nan if i is None \
+            else 100. * fraction[1, i]
+    _pending_reports.setdefault(report_name, []).append(row)
+    if write:
+        write_connection_reports()
+
+
+def report_percentages(df, column='percent_possible'):
+    """Get list of percentages of available directions for each row of a
+    structured report, in order of REPORT_DIRECTIONS"""
+    values = df[[column + '_' + d for d in REPORT_DIRECTIONS]].to_numpy()
+    return [v[~np.isnan(v)].tolist() for v in values]
+
+
+def _write_csv_report(path, df):
+    """Append rows to a report in the legacy CSV format"""
+    def fmt(values):
+        return values[0] if len(values) == 1 else str(np.array(values))
+    gap = np.where(df['connection_type'] == 'gap', 'Gap', '')
+    legacy = pd.DataFrame({
+        "Source": df['source'] + gap,
+        "Target": df['target'] + gap,
+        "Percent connectionivity within possible connections":
+            list(map(fmt, report_percentages(df, 'percent_possible'))),
+        "Percent connectionivity within all connections":
+            list(map(fmt, report_percentages(df, 'percent_all')))
+    })
+    header = not os.path.exists(path)
+    legacy.to_csv(path, mode='a' if not header else 'w',
+                  header=header, index=False)
+
+
+def _write_h5_report(path, df):
+    """Append rows to the datasets of a report in HDF5 format"""
+    with h5py.File(path, 'a') as f:
+        grp = f.require_group(REPORT_GROUP)
+        for col in df.columns:
+            data = df[col].to_numpy()
+            dtype = h5py.string_dtype() if data.dtype == object else data.dtype
+            if col in grp:
+                dset = grp[col]
+                n = dset.shape[0]
+                dset.resize(n + data.size, axis=0)
+                dset[n:] = data
+            else:
+                grp.create_dataset(col, data=data, dtype=dtype,
+                                   maxshape=(None, ), chunks=True)
+
+
+def write_connection_reports():
+    """
+    Write all pending rows of connection reports to their files in one batch.
+    Files ending with '.csv' are written in the legacy CSV format. Otherwise
+    the report is written to an HDF5 file, with one dataset per column in
+    group REPORT_GROUP. Connectors call this when they finish building.
+    """
+    start = time.perf_counter()
+    while _pending_reports:
+        path, rows = _pending_reports.popitem()
+        df = pd.DataFrame(rows)
+        if path.endswith('.csv'):
+            _write_csv_report(path, df)
+        else:
+            _write_h5_report(path, df)
+    _report_write_time[0] += time.perf_counter() - start
+
+
+def read_connection_report(path):
+    """
+    Read a connection report file written by write_connection_reports() into
+    a DataFrame. Pending rows for the file are written first. HDF5 reports
+    have typed columns, see add_connection_report(). CSV reports are returned
+    as is in the legacy format.
+    """
+    if path in _pending_reports:
+        write_connection_reports()
+    if path.endswith('.csv'):
+        return pd.read_csv(path)
+    with h5py.File(path, 'r') as f:
+        grp = f[REPORT_GROUP]
+        data = {}
+        for col in grp:
+            dset = grp[col]
+            data[col] = dset.asstr()[()] if h5py.check_string_dtype(
+                dset.dtype) else dset[()]
+    columns = ['source', 'target', 'connection_type', 'n_pair']
+    columns += [q + '_' + d for q in ('n_conn', 'n_poss', 'percent_possible',
+                                      'percent_all') for d in REPORT_DIRECTIONS]
+    columns = [c for c in columns if c in data]
+    columns += [c for c in data if c not in columns]
+    return pd.DataFrame(data)[columns]
+
+
 def pr_2_rho(p0, p1, pr):
     """Calculate correlation coefficient rho given reciprocal probability pr"""
     for p in (p0, p1):
@@ -417,12 +1504,12 @@ class ReciprocalConnector(AbstractConnector):
         4. When executing net.build(), BMTK uses built-in `one_to_all` iterator
         that calls the make_forward_connection() method to build connections
         from source to target. If the two are different populations,
-        `all_to_one` iterator that calls the make_backward_connection() method
+        `one_to_all` iterator that calls the make_backward_connection() method
         is then used to build connections from target to source.
         During the initial iteration when make_forward_connection() is called,
-        the algorithm is run to generate a connection matrix for both forward
-        and backward connections. In the iterations afterward, it's only
-        assigning the generated connections in BMTK.
+        the algorithm is run to generate connections for both forward and
+        backward directions, in blocks of source cells. In the iterations
+        afterward, it's only assigning the generated connections in BMTK.
 
     Parameters:
         p0, p1: Probability of forward and backward connection. It can be a
@@ -467,9 +1554,7 @@ class ReciprocalConnector(AbstractConnector):
             connections with the given pr. Note that pr is not over all pairs
             of source and target cells but only those has a chance to connect,
             e.g., for only pair of cells within some distance range. The
-            estimation is done before generating random connections. The values
-            of p0, p0_arg, p1, p1_arg can be cached during estimation of rho
-            and retrieved when generating random connections for performance.
+            estimation is done before generating random connections.
         dist_range_forward: If specified, when estimating rho, consider only
             cell pairs whose distance (p0_arg) is within the specified range.
         dist_range_backward: Similar to dist_range_forward but consider
@@ -489,20 +1574,43 @@ class ReciprocalConnector(AbstractConnector):
             BMTK like p0_arg, p1_arg. n_syn1 is force to be the same as n_syn0
             when the population is recurrent. Warning: The number must not be
             greater than 255 since it will be converted to uint8 when written
-            into the connection matrix to reduce memory consumption.
+            into the connection store to reduce memory consumption.
         autapses: Whether to allow connecting a cell to itself. Default: False.
             This is ignored when the population is not recurrent.
         quick_pop_check: Whether to use quick method to check if source and
             target populations are the same. Default: False.
             Quick method checks only whether filter conditions match.
             Strict method checks whether all node id's match considering order.
-        cache_data: Whether to cache the values of p0, p0_arg, p1, p1_arg
-            during estimation of rho. This improves performance when
-            estimate_rho is True while not creating a significant overhead in
-            the opposite case. However, it requires large memory allocation
-            as the population size grows. Set it to False if there is a memory
-            issue.
+        cache_data: Whether to keep the arrays of p0_arg, p1_arg, p0, p1
+            computed for estimating rho and reuse them when generating random
+            connections, instead of computing them again. This takes memory in
+            proportion to the number of cell pairs. Ignored when rho is not
+            estimated or out_of_core is True.
         verbose: Whether show verbose information in console.
+        seed: Seed for the random number generator of this connector. If not
+            specified, a random seed is drawn and stored in attribute `seed`,
+            which can be used to reproduce the connections.
+        n_workers: Number of processes to generate connections in parallel.
+            Blocks of source cells are distributed to forked worker processes.
+            The result is identical regardless of the number of workers, given
+            the same seed, as long as p0, p1, pr and their arguments are
+            deterministic functions. Random n_syn0, n_syn1 functions use their
+            own random number generators and are not controlled by the seed.
+        block_size: Number of source cells in each block. If not specified,
+            set such that each block has about BLOCK_PAIRS cell pairs.
+        out_of_core: Whether to spill generated connections to memory-mapped
+            files on disk block by block instead of keeping them in memory,
+            for very large projections. The conn_prop dictionaries are not
+            filled in this case. get_conn_prop() reads from conn_store instead.
+        tmp_dir: Directory for the files when out_of_core is True. If not
+            specified, use the system default temporary directory.
+        cache_dir: Directory for caching the generated connections. If
+            specified, connections are saved to a file named by a hash of the
+            connector parameters, seed and the node ids and positions. A
+            later build with the same key loads the connections from the file
+            instead of generating them. Requires seed to be specified.
+            Functions in the parameters are identified by their code and
+            closure values, not by the global variables they use.
 
     Returns:
         An object that works with BMTK to build edges in a network.
@@ -512,8 +1620,6 @@ class ReciprocalConnector(AbstractConnector):
         source, target: NodePool objects for the source and target populations.
         recurrent: Whether the source and target populations are the same.
         callable_set: Set of arguments that are functions but not constants.
-        cache: ConnectorCache object for caching data.
-        conn_mat: Connection matrix
         stage: Indicator of stage. 0 for forward and 1 for backward connection.
         conn_prop: List of two dictionaries that stores properties of connected
             pairs, for forward and backward connections respectively. In each
@@ -529,6 +1635,10 @@ class ReciprocalConnector(AbstractConnector):
             not need to be calculated repeatedly. The connector can be passed
             as an argument for the functions that generates additional edge
             properties, so that they can access the information here.
+        conn_store: List of ConnectionStore objects for forward and backward
+            (if not recurrent) connections, an array-backed version of
+            conn_prop including the number of synapses. In the backward
+            store, rows are the target population and columns the source.
     """
 
     def __init__(self, p0=1., p1=1., symmetric_p1=False,
@@ -536,7 +1646,9 @@ class ReciprocalConnector(AbstractConnector):
                  pr=0., pr_arg=None, estimate_rho=True, rho=None,
                  dist_range_forward=None, dist_range_backward=None,
                  n_syn0=1, n_syn1=1, autapses=False,
-                 quick_pop_check=False, cache_data=True, verbose=True,save_report=True,report_name=None):
+                 quick_pop_check=False, cache_data=True, verbose=True,save_report=True,report_name=None,
+                 seed=None, n_workers=1, block_size=None, out_of_core=False,
+                 tmp_dir=None, cache_dir=None):
         args = locals()
         var_set = ('p0', 'p0_arg', 'p1', 'p1_arg',
                    'pr', 'pr_arg', 'n_syn0', 'n_syn1')
@@ -552,21 +1664,29 @@ class ReciprocalConnector(AbstractConnector):
 
         self.autapses = autapses
         self.quick = quick_pop_check
-        self.cache = self.ConnectorCache(cache_data and self.estimate_rho)
+        self.cache_data = cache_data
         self.verbose = verbose
         self.save_report = save_report
+        self.seed = np.random.SeedSequence(seed).entropy
+        self.n_workers = n_workers
+        self.block_size = block_size
+        self.out_of_core = out_of_core
+        self.tmp_dir = tmp_dir
+        self.setup_cache(cache_dir, seed)
 
         if report_name is None:
             report_name = globals().get('report_name', 'default_report.csv')
         self.report_name = report_name
 
         self.conn_prop = [{}, {}]
+        self.conn_store = []
         self.stage = 0
         self.iter_count = 0
 
     # *** Two methods executed during bmtk edge creation net.add_edges() ***
     def setup_nodes(self, source=None, target=None):
         """Must run this before building connections"""
+        self.stats.start('setup_nodes')
         if self.stage:
             # check whether the correct populations
             if (source is None or target is None or
@@ -574,6 +1694,7 @@ class ReciprocalConnector(AbstractConnector):
                     not is_same_pop(target, self.source, quick=self.quick)):
                 raise ValueError("Source or target population not consistent.")
             # Skip adding nodes for the backward stage.
+            self.stats.stop('setup_nodes')
             return
 
         # Update node pools
@@ -600,6 +1721,8 @@ class ReciprocalConnector(AbstractConnector):
             self.n_target = len(self.target_ids)
             self.target_list = list(self.target)
 
+        self.register()
+
         # Setup for recurrent connection
         if self.recurrent:
             self.symmetric_p1_arg = True
@@ -609,6 +1732,7 @@ class ReciprocalConnector(AbstractConnector):
             self.vars['p1_arg'] = self.vars['p0_arg']
         if self.symmetric_p1:
             self.vars['p1'] = self.vars['p0']
+        self.stats.stop('setup_nodes')
 
     def edge_params(self):
         """Create the arguments for BMTK add_edges() method"""
@@ -618,146 +1742,22 @@ class ReciprocalConnector(AbstractConnector):
                       'connection_rule': self.make_forward_connection}
         else:
             params = {'source': self.target, 'target': self.source,
-                      'iterator': 'all_to_one',
+                      'iterator': 'one_to_all',
                       'connection_rule': self.make_backward_connection}
         self.stage += 1
         return params
 
     # *** Methods executed during bmtk network.build() ***
     # *** Helper functions ***
-    class ConnectorCache(object):
-        def __init__(self, enable=True):
-            self.enable = enable
-            self._output = {}
-            self.cache_dict = {}
-            self.set_next_it()
-            self.write_mode()
-
-        def cache_output(self, func, func_name, cache=True):
-            if self.enable and cache:
-                self.cache_dict[func_name] = func
-                self._output[func_name] = []
-                output = self._output[func_name]
-
-                def writer(*args):
-                    val = func(*args)
-                    output.append(val)
-                    return val
-                setattr(self, func_name, writer)
-            else:
-                setattr(self, func_name, func)
-
-        def write_mode(self):
-            for val in self._output.values():
-                val.clear()
-            self.mode = 'write'
-            self.iter_count = 0
-
-        def fetch_output(self, func_name, fetch=True):
-            output = self._output[func_name]
-
-            if fetch:
-                def reader(*args):
-                    return output[self.iter_count]
-                setattr(self, func_name, reader)
-            else:
-                setattr(self, func_name, self.cache_dict[func_name])
-
-        def read_mode(self):
-            if self.enable and len(self.cache_dict):
-                # check whether outputs were written correctly
-                output_len = [len(val) for val in self._output.values()]
-                # whether any stored and have the same length
-                valid = [n for n in output_len if n]
-                flag = len(valid) > 0 and all(n == valid[0] for n in valid[1:])
-                if flag:
-                    for func_name, out_len in zip(self._output, output_len):
-                        fetch = out_len > 0
-                        if not fetch:
-                            print("\nWarning: Cache did not work properly for "
-                                  + func_name + '\n',flush=True)
-                        self.fetch_output(func_name, fetch)
-                    self.iter_count = 0
-                else:
-                    # if output not correct, disable and use original function
-                    print("\nWarning: Cache did not work properly.\n",flush=True)
-                    for func_name in self.cache_dict:
-                        self.fetch_output(func_name, False)
-                    self.enable = False
-            self.mode = 'read'
-
-        def set_next_it(self):
-            if self.enable:
-                def next_it():
-                    self.iter_count += 1
-            else:
-                def next_it():
-                    pass
-            self.next_it = next_it
-
-    def node_2_idx_input(self, var_func, reverse=False):
-        """Convert a function that accept nodes as input
-        to accept indices as input"""
-        if reverse:
-            def idx_2_var(j, i):
-                return var_func(self.target_list[j], self.source_list[i])
-        else:
-            def idx_2_var(i, j):
-                return var_func(self.source_list[i], self.target_list[j])
-        return idx_2_var
-
-    def iterate_pairs(self):
-        """Generate indices of source and target for each case"""
-        if self.recurrent:
-            if self.autapses:
-                for i in range(self.n_source):
-                    for j in range(i, self.n_target):
-                        yield i, j
-            else:
-                for i in range(self.n_source - 1):
-                    for j in range(i + 1, self.n_target):
-                        yield i, j
-        else:
-            for i in range(self.n_source):
-                for j in range(self.n_target):
-                    yield i, j
-
-    def calc_pair(self, i, j):
-        """Calculate intermediate data that can be cached"""
-        cache = self.cache
-        # cache = self  # test performance for not using cache
-        p0_arg = cache.p0_arg(i, j)
-        p1_arg = p0_arg if self.symmetric_p1_arg else cache.p1_arg(j, i)
-        p0 = cache.p0(p0_arg)
-        p1 = p0 if self.symmetric_p1 else cache.p1(p1_arg)
-        return p0_arg, p1_arg, p0, p1
-
     def setup_conditional_backward_probability(self):
         """Create a function that calculates the conditional probability of
-        backward connection given the forward connection outcome 'cond'"""
+        backward connection given the forward connection outcome 'cond'.
+        The function accepts arrays of outcomes and probabilities."""
         # For all cases, assume p0, p1, pr are all within [0, 1] already.
         self.wrong_pr = False
         if self.rho is None:
             # Determine by pr for each pair
-            if self.verbose:
-                def cond_backward(cond, p0, p1, pr):
-                    if p0 > 0:
-                        pr_bound = (p0 + p1 - 1, min(p0, p1))
-                        # check whether pr within bounds
-                        if pr < pr_bound[0] or pr > pr_bound[1]:
-                            self.wrong_pr = True
-                            pr = min(max(pr, pr_bound[0]), pr_bound[1])
-                        return pr / p0 if cond else (p1 - pr) / (1 - p0)
-                    else:
-                        return p1
-            else:
-                def cond_backward(cond, p0, p1, pr):
-                    if p0 > 0:
-                        pr_bound = (p0 + p1 - 1, min(p0, p1))
-                        pr = min(max(pr, pr_bound[0]), pr_bound[1])
-                        return pr / p0 if cond else (p1 - pr) / (1 - p0)
-                    else:
-                        return p1
+            cond_backward = conditional_backward_probability
         elif self.rho == 0:
             # Independent case
             def cond_backward(cond, p0, p1, pr):
@@ -768,24 +1768,228 @@ class ReciprocalConnector(AbstractConnector):
                 # Standard deviation of r.v. for p1
                 sd = ((1 - p1) * p1) ** .5
                 # Z-score of random variable for p0
-                zs = ((1 - p0) / p0) ** .5 if cond else - (p0 / (1 - p0)) ** .5
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    zs = np.where(cond, ((1 - p0) / p0) ** .5,
+                                  - (p0 / (1 - p0)) ** .5)
                 return p1 + self.rho * sd * zs
         self.cond_backward = cond_backward
 
-    def add_conn_prop(self, src, trg, prop, stage=0):
-        """Store p0_arg and p1_arg for a connected pair"""
-        sid = self.source_ids[src]
-        tid = self.target_ids[trg]
-        conn_dict = self.conn_prop[stage]
-        if stage:
-            sid, tid = tid, sid  # during backward, from target to source
-        trg_dict = conn_dict.setdefault(sid, {})
-        trg_dict[tid] = prop
-
     def get_conn_prop(self, sid, tid):
         """Get stored value given node ids in a connection"""
+        if self.out_of_core:
+            return self.conn_store[self.stage].get_prop(sid, tid)
         return self.conn_prop[self.stage][sid][tid]
 
+    def triangle_offset(self):
+        if self.recurrent:
+            return 0 if self.autapses else 1
+        return None
+
+    CACHE_ATTRS = ('rho', 'possible_count', 'n_recp', 'wrong_pr')
+
+    def cache_params(self):
+        params = super().cache_params()
+        for key in ('symmetric_p1', 'symmetric_p1_arg', 'estimate_rho', 'rho',
+                    'dist_range_forward', 'dist_range_backward', 'autapses'):
+            params[key] = getattr(self, key)
+        return params
+
+    def estimate(self, n_sample=10000, seed=None):
+        """
+        Dry run estimation of the connections before building the network.
+        Sample n_sample random pairs, evaluate their probabilities, and
+        extrapolate to all pairs. Return a dictionary of expected numbers of
+        connections (n_conn, counting both directions, with standard error
+        n_conn_std), synapses (n_syn), reciprocal pairs (n_recp) and their
+        fraction in connected pairs, maximum probability, number of sampled
+        probabilities outside [0, 1], memory of connection store, conn_prop
+        and BMTK synapse table in bytes, and projected build time in seconds.
+        """
+        rng = np.random.default_rng(seed)
+        with self.dry_run():
+            self.initialize()
+            timer = Timer()
+            rows, cols = self.sample_pairs(n_sample, rng)
+            p0_arg, p1_arg, p0, p1 = self.calc_pairs(rows, cols)
+            # Probability of reciprocal connection of each pair
+            rho = self.rho
+            if self.estimate_rho:
+                valid = self.rho_valid(p0_arg, p1_arg, p0, p1)
+                p0v, p1v = p0[valid], p1[valid]
+                norm_fac = np.sum((p0v * (1 - p0v) * p1v * (1 - p1v)) ** .5)
+                rho = 0. if norm_fac <= 0 else np.clip(
+                    (self.vars['pr'] * p0v.size - np.sum(p0v * p1v)) / norm_fac,
+                    -1, 1)
+            if rho is None:
+                pr = self.calc_pr(rows, cols, p0_arg, p1_arg, p0, p1)
+            else:
+                pr = p0 * p1 + rho * np.abs(p0 * (1 - p0) * p1 * (1 - p1)) ** .5
+            pr = np.clip(pr, np.fmax(p0 + p1 - 1, 0), np.fmin(p0, p1))
+            src, trg = self.source_list, self.target_list
+            n_syn0 = pair_values(self.vars['n_syn0'], src, trg, rows, cols)
+            n_syn1 = pair_values(self.vars['n_syn1'], trg, src, cols, rows)
+            if self.recurrent:
+                # Pairs of a cell with itself connect only once
+                p1 = np.where(rows == cols, 0., p1)
+                pr = np.where(rows == cols, 0., pr)
+            time_per_pair = timer.end() / timer.scale / rows.size
+            n_pair = self.pair_count()
+            scale = n_pair / rows.size
+            p = p0 + p1
+            std = 0. if scale == 1 else n_pair * np.std(p) / rows.size ** .5
+            return self.estimate_summary(
+                n_pair, rows.size, np.sum(p) * scale, std,
+                np.sum(p0 * n_syn0 + p1 * n_syn1) * scale,
+                np.concatenate((p0, p1)), time_per_pair,
+                n_recp=np.sum(pr) * scale)
+
+    def block_pairs(self, start, stop):
+        """Indices of source and target for pairs in a block of source rows"""
+        if self.recurrent:
+            return triu_block(start, stop, self.n_source,
+                              k=0 if self.autapses else 1)
+        return rect_block(start, stop, self.n_target)
+
+    def calc_pairs(self, rows, cols, block=None):
+        """Calculate p0_arg, p1_arg, p0, p1 for arrays of pair indices.
+        block: (start, stop) of source rows if the pairs are a whole block
+        from block_pairs(), for caching distances."""
+        positions = self.positions
+        p0_arg = pair_values(self.vars['p0_arg'], self.source_list,
+                             self.target_list, rows, cols, positions,
+                             self.distance_key(block))
+        if self.symmetric_p1_arg or (self.vars['p1_arg'] is self.vars['p0_arg']
+                                     and self.vars['p0_arg'] in DIST_FUNC_AXES):
+            # Distance functions are symmetric
+            p1_arg = p0_arg
+        else:
+            p1_arg = pair_values(self.vars['p1_arg'], self.target_list,
+                                 self.source_list, cols, rows,
+                                 positions and positions[::-1])
+        p0 = probability_values(self.vars['p0'], p0_arg)
+        p1 = p0 if self.symmetric_p1 else probability_values(self.vars['p1'], p1_arg)
+        return p0_arg, p1_arg, p0, p1
+
+    def calc_pr(self, rows, cols, p0_arg, p1_arg, p0, p1, block=None):
+        """Calculate pr for arrays of pair indices"""
+        pr = np.empty(p0.shape)
+        if not callable(self.vars['pr']):
+            pr[:] = self.vars['pr']
+            return pr
+        if self.pr_arg_func is None:
+            pr_arg = pair_values(self.vars['pr_arg'], self.source_list,
+                                 self.target_list, rows, cols, self.positions,
+                                 self.distance_key(block))
+        else:
+            pr_arg = p1_arg if self.pr_arg_func == 'p1_arg' else p0_arg
+        if isinstance(self.vars['pr'], ProbabilityFunction):
+            # Batched protocol
+            pr[:] = self.vars['pr'].probability(pr_arg, p0, p1)
+        else:
+            pr[:] = [self.vars['pr'](*x) for x in zip(pr_arg, p0, p1)]
+        return pr
+
+    def sample_block(self, start, stop, rng):
+        """Generate random connections for a block of source rows.
+        Return forward and backward connections, each as a tuple of arrays
+        (rows, columns, number of synapses, p_arg), the possible connection
+        count, reciprocal connection count and whether pr is out of bounds.
+        Backward connections are from target (rows) to source (columns)."""
+        if self.constant_p is not None and self.rho is not None:
+            return self.sample_block_constant(start, stop, rng)
+        rows, cols = self.block_pairs(start, stop)
+        if start in self.block_cache:
+            p0_arg, p1_arg, p0, p1 = self.block_cache[start]
+        else:
+            p0_arg, p1_arg, p0, p1 = self.calc_pairs(rows, cols, (start, stop))
+        # Check whether at all possible and count
+        forward = p0 > 0
+        backward = p1 > 0
+        if self.recurrent:
+            possible_count = np.count_nonzero(forward)
+        else:
+            possible_count = np.array([np.count_nonzero(forward),
+                                       np.count_nonzero(backward),
+                                       np.count_nonzero(forward & backward)])
+
+        # Make random decision
+        pr = None
+        wrong_pr = False
+        if self.rho is None:
+            pr = self.calc_pr(rows, cols, p0_arg, p1_arg, p0, p1,
+                              (start, stop))
+            valid = forward & backward
+            wrong_pr = np.any((pr[valid] < p0[valid] + p1[valid] - 1) |
+                              (pr[valid] > np.fmin(p0[valid], p1[valid])))
+        forward = bernoulli_mask(p0, rng)
+        backward &= rng.random(rows.size) < self.cond_backward(
+            forward, p0, p1, pr)
+        if self.recurrent:
+            backward &= rows != cols
+        n_recp = np.count_nonzero(forward & backward)
+
+        # Make connection
+        src, trg = self.source_list, self.target_list
+        fwd = (rows[forward], cols[forward])
+        n_forward = pair_values(self.vars['n_syn0'], src, trg, *fwd)
+        bwd = (cols[backward], rows[backward])
+        n_backward = pair_values(self.vars['n_syn1'], trg, src, *bwd)
+        return ((*fwd, n_forward, p0_arg[forward]),
+                (*bwd, n_backward, p1_arg[backward]),
+                possible_count, n_recp, wrong_pr)
+
+    def constant_probability(self):
+        """Return (p0, p1) if they are the same for all pairs, i.e., they are
+        constants or their arguments are constants. Otherwise return None."""
+        ps = []
+        for i in '01':
+            p, p_arg = self.vars['p' + i], self.vars['p' + i + '_arg']
+            if callable(p):
+                if callable(p_arg):
+                    return None
+                p = probability_values(p, [p_arg])[0]
+            ps.append(float(p))
+        return tuple(ps)
+
+    def sample_block_constant(self, start, stop, rng):
+        """Generate random connections for a block of source rows when p0, p1
+        and rho are constant, similar to sample_block(). Connected pairs are
+        drawn by geometric skipping, so the cost scales with the number of
+        connections instead of the number of pairs."""
+        p0, p1 = self.constant_p
+        n = self.block_pair_count(start, stop)
+        forward = bernoulli_indices(p0, n, rng)
+        # Conditional probabilities of backward given forward outcome
+        q1, q0 = np.clip(np.broadcast_to(self.cond_backward(
+            np.array([True, False]), p0, p1, None), 2), 0, 1) if p1 > 0 \
+            else (0., 0.)
+        backward = bernoulli_indices(q0, n, rng)
+        backward = np.union1d(
+            forward[bernoulli_indices(q1, forward.size, rng)],
+            np.setdiff1d(backward, forward, assume_unique=True))
+        if self.recurrent:
+            rows, cols = self.index_pairs(start, stop, backward)
+            backward = backward[rows != cols]
+        n_recp = np.intersect1d(forward, backward, assume_unique=True).size
+        if self.recurrent:
+            possible_count = n if p0 > 0 else 0
+        else:
+            possible_count = n * np.array([p0 > 0, p1 > 0, p0 > 0 and p1 > 0],
+                                          dtype=int)
+
+        # Make connection
+        src, trg = self.source_list, self.target_list
+        positions = self.positions
+        fwd = self.index_pairs(start, stop, forward)
+        n_forward = pair_values(self.vars['n_syn0'], src, trg, *fwd)
+        p0_arg = pair_values(self.vars['p0_arg'], src, trg, *fwd, positions)
+        bwd = self.index_pairs(start, stop, backward)[::-1]
+        n_backward = pair_values(self.vars['n_syn1'], trg, src, *bwd)
+        p1_arg = pair_values(self.vars['p1_arg'], trg, src, *bwd,
+                             positions and positions[::-1])
+        return ((*fwd, n_forward, p0_arg), (*bwd, n_backward, p1_arg),
+                possible_count, n_recp, False)
+
     # *** A sequence of major methods executed during build ***
     def setup_variables(self):
         # If pr_arg is string, use the same value as p0_arg or p1_arg
@@ -794,81 +1998,51 @@ class ReciprocalConnector(AbstractConnector):
             self.vars['pr_arg'] = self.vars[pr_arg_func]
         else:
             pr_arg_func = None
-
-        callable_set = set()
-        # Make constant variables constant functions
-        for name, var in self.vars.items():
-            if callable(var):
-                callable_set.add(name)  # record callable variables
-                setattr(self, name, var)
-            else:
-                setattr(self, name, self.constant_function(var))
-        self.callable_set = callable_set
-
-        # Make callable variables except a few, accept index input instead
-        for name in callable_set - {'p0', 'p1', 'pr'}:
-            var = self.vars[name]
-            setattr(self, name, self.node_2_idx_input(var, '1' in name))
-
-        # Set up function for pr_arg if use value from p0_arg or p1_arg
-        if pr_arg_func is None:
-            self._pr_arg = self.pr_arg  # use specified pr_arg
-        else:
-            self._pr_arg_val = 0.  # storing current value from p_arg
-            p_arg = getattr(self, pr_arg_func)
-            def p_arg_4_pr(*args, **kwargs):
-                val = p_arg(*args, **kwargs)
-                self._pr_arg_val = val
-                return val
-            setattr(self, pr_arg_func, p_arg_4_pr)
-            def pr_arg(self, *arg):
-                return self._pr_arg_val
-            self._pr_arg = types.MethodType(pr_arg, self)
-
-    def cache_variables(self):
-        # Select cacheable attrilbutes
-        cache_set = {'p0', 'p0_arg', 'p1', 'p1_arg'}
-        if self.symmetric_p1:
-            cache_set.remove('p1')
-        if self.symmetric_p1_arg:
-            cache_set.remove('p1_arg')
-        # Output of callable variables will be cached
-        # Constant functions will be called from cache but output not cached
-        for name in cache_set:
-            var = getattr(self, name)
-            self.cache.cache_output(var, name, name in self.callable_set)
-        if self.verbose and len(self.cache.cache_dict):
-            print('Output of %s will be cached.'
-                  % ', '.join(self.cache.cache_dict),flush=True)
-
-    def setup_dist_range_checker(self):
-        # Checker that determines whether to consider a pair for rho estimation
-        if self.dist_range_forward is None and self.dist_range_backward is None:
-            def checker(var):
-                p0, p1 = var[2:]
-                return p0 > 0 and p1 > 0
-        else:
-            def in_range(p_arg, dist_range):
-                return p_arg >= dist_range[0] and p_arg <= dist_range[1]
-            r0, r1 = self.dist_range_forward, self.dist_range_backward
-            if r1 is None:
-                def checker(var):
-                    return in_range(var[0], r0)
-            elif r0 is None:
-                def checker(var):
-                    return in_range(var[1], r1)
-            else:
-                def checker(var):
-                    return in_range(var[0], r0) and in_range(var[1], r1)
-        return checker
+        self.pr_arg_func = pr_arg_func
+
+        self.callable_set = {name for name, var in self.vars.items()
+                             if callable(var)}
+
+    def rho_valid(self, p0_arg, p1_arg, p0, p1):
+        """Mask of pairs considered for rho estimation"""
+        r0, r1 = self.dist_range_forward, self.dist_range_backward
+        if r0 is None and r1 is None:
+            return (p0 > 0) & (p1 > 0)
+        valid = np.ones(p0.shape, dtype=bool)
+        for p_arg, dist_range in ((p0_arg, r0), (p1_arg, r1)):
+            if dist_range is not None:
+                valid &= (p_arg >= dist_range[0]) & (p_arg <= dist_range[1])
+        return valid
+
+    def rho_block(self, start, stop, rng):
+        """Sums over a block of source rows for estimating rho. Return the
+        number of valid pairs, sum of p0*p1 and sum of normalization factors
+        sqrt(p0(1-p0)p1(1-p1)), and the arrays of p0_arg, p1_arg, p0, p1 if
+        they are cached."""
+        rows, cols = self.block_pairs(start, stop)
+        var = self.calc_pairs(rows, cols, (start, stop))
+        valid = self.rho_valid(*var)
+        p0, p1 = var[2][valid], var[3][valid]
+        sums = (np.count_nonzero(valid), np.sum(p0 * p1),
+                np.sum((p0 * (1 - p0) * p1 * (1 - p1)) ** .5))
+        return sums, var if self.cache_block else None
 
     def initialize(self):
         self.setup_variables()
-        self.cache_variables()
-        # Intialize connection matrix and get nubmer of pairs
+        self.constant_p = self.constant_probability()
+        self.block_cache = {}
+        self.cache_block = (self.cache_data and self.estimate_rho
+                            and not self.out_of_core)
+        # Positions for distance functions that can be vectorized
+        self.setup_positions([self.vars[key]
+                              for key in ('p0_arg', 'p1_arg', 'pr_arg')])
+        # Intialize connection stores, backward from target to source
         self.end_stage = 0 if self.recurrent else 1
-        shape = (self.end_stage + 1, self.n_source, self.n_target)
-        self.conn_mat = np.zeros(shape, dtype=np.uint8)  # 1 byte per entry
+        ids = (self.source_ids, self.target_ids)
+        self.conn_store = [
+            ConnectionStore(*x, out_of_core=self.out_of_core,
+                            tmp_dir=self.tmp_dir)
+            for x in (ids, ids[::-1])[:self.end_stage + 1]]
 
     def initial_all_to_all(self):
         """The major part of the algorithm run at beginning of BMTK iterator"""
@@ -876,28 +2050,53 @@ class ReciprocalConnector(AbstractConnector):
             src_str, trg_str = self.get_nodes_info()
             print("\nStart building connection between: \n  "
                   + src_str + "\n  " + trg_str,flush=True)
-        self.initialize()
-        cache = self.cache  # write mode
-
-        # Estimate pr
+        with self.stats.stage('initialize'):
+            self.initialize()
         if self.verbose:
             self.timer = Timer()
+        self.build_connections()
+        if not self.out_of_core:
+            with self.stats.stage('conn_prop'):
+                for stage, store in enumerate(self.conn_store):
+                    store.update_conn_prop(self.conn_prop[stage])
+
+        if self.verbose:
+            self.timer.report('Total time for creating connection matrix')
+            if self.wrong_pr:
+                print("Warning: Value of 'pr' outside the bounds occurred.\n",flush=True)
+            self.connection_number_info()
+        if self.save_report:
+            with self.stats.stage('report'):
+                self.save_connection_report()
+
+    def generate_connections(self):
+        """Estimate rho and generate random connections for all pairs"""
+        # Estimate pr
+        blocks = self.get_row_blocks()
         if self.estimate_rho:
-            dist_range_checker = self.setup_dist_range_checker()
-            p0p1_sum = 0.
-            norm_fac_sum = 0.
-            n = 0
-            # Make sure each cacheable function runs excatly once per iteration
-            for i, j in self.iterate_pairs():
-                var = self.calc_pair(i, j)
-                valid = dist_range_checker(var)
-                if valid:
-                    n += 1
-                    p0, p1 = var[2:]
-                    p0p1_sum += p0 * p1
-                    norm_fac_sum += (p0 * (1 - p0) * p1 * (1 - p1)) ** .5
+            self.stats.start('estimate_rho')
+            if self.constant_p is not None and \
+                    self.dist_range_forward is None and \
+                    self.dist_range_backward is None:
+                # Same probabilities for all pairs
+                p0, p1 = self.constant_p
+                n = self.pair_count() if p0 > 0 and p1 > 0 else 0
+                p0p1_sum = n * p0 * p1
+                norm_fac_sum = n * (p0 * (1 - p0) * p1 * (1 - p1)) ** .5
+            else:
+                n = 0
+                p0p1_sum = 0.
+                norm_fac_sum = 0.
+                outputs = self.run_blocks('rho_block', blocks)
+                for (start, stop), (sums, var) in zip(blocks, outputs):
+                    self.count_block(start, stop)
+                    n += sums[0]
+                    p0p1_sum += sums[1]
+                    norm_fac_sum += sums[2]
+                    if var is not None:
+                        self.block_cache[start] = var
             if norm_fac_sum > 0:
-                rho = (self.pr() * n - p0p1_sum) / norm_fac_sum
+                rho = float((self.vars['pr'] * n - p0p1_sum) / norm_fac_sum)
                 if abs(rho) > 1:
                     print("\nWarning: Estimated value of rho=%.3f "
                           "outside the range [-1, 1]." % rho,flush=True)
@@ -909,6 +2108,7 @@ class ReciprocalConnector(AbstractConnector):
             else:
                 self.rho = 0
 
+            self.stats.stop('estimate_rho')
             if self.verbose:
                 self.timer.report('Time for estimating rho')
 
@@ -916,60 +2116,39 @@ class ReciprocalConnector(AbstractConnector):
         self.setup_conditional_backward_probability()
 
         # Make random connections
-        cache.read_mode()
-        possible_count = 0 if self.recurrent else np.zeros(3)
-        for i, j in self.iterate_pairs():
-            p0_arg, p1_arg, p0, p1 = self.calc_pair(i, j)
-            # Check whether at all possible and count
-            forward = p0 > 0
-            backward = p1 > 0
-            if self.recurrent:
-                possible_count += forward
-            else:
-                possible_count += [forward, backward, forward and backward]
-
-            # Make random decision
-            if forward:
-                forward = decision(p0)
-            if backward:
-                pr = self.pr(self._pr_arg(i, j), p0, p1)
-                backward = decision(self.cond_backward(forward, p0, p1, pr))
-
-            # Make connection
-            if forward:
-                n_forward = self.n_syn0(i, j)
-                self.add_conn_prop(i, j, p0_arg, 0)
-                self.conn_mat[0, i, j] = n_forward
-            if backward:
-                n_backward = self.n_syn1(j, i)
-                if self.recurrent:
-                    if i != j:
-                        self.conn_mat[0, j, i] = n_backward
-                        self.add_conn_prop(j, i, p1_arg, 0)
-                else:
-                    self.conn_mat[1, i, j] = n_backward
-                    self.add_conn_prop(i, j, p1_arg, 1)
-            self.cache.next_it()
-        self.cache.write_mode()  # clear memory
+        self.stats.start('sample')
+        dense = self.constant_p is None or self.rho is None
+        possible_count = 0 if self.recurrent else np.zeros(3, dtype=int)
+        self.n_recp = 0
+        outputs = self.run_blocks('sample_block', blocks)
+        for (start, stop), out in zip(blocks, outputs):
+            if start in self.block_cache:
+                self.stats.count('block_cache_hits')
+            elif dense:
+                self.count_block(start, stop)
+            forward, backward, n_poss, n_recp, wrong_pr = out
+            self.conn_store[0].append(*forward)
+            self.conn_store[self.end_stage].append(*backward)
+            possible_count += n_poss
+            self.n_recp += n_recp
+            self.wrong_pr |= wrong_pr
+        for store in self.conn_store:
+            store.finalize()
         self.possible_count = possible_count
-
-        if self.verbose:
-            self.timer.report('Total time for creating connection matrix')
-            if self.wrong_pr:
-                print("Warning: Value of 'pr' outside the bounds occurred.\n",flush=True)
-            self.connection_number_info()
-        if self.save_report:
-            self.save_connection_report()
+        self.block_cache = {}
+        self.stats.stop('sample')
 
     def make_connection(self):
         """ Assign number of synapses per iteration.
-        Use iterator one_to_all for forward and all_to_one for backward.
+        Use iterator one_to_all for both forward and backward.
         """
-        nsyns = self.conn_mat[self.stage, self.iter_count, :]
+        store = self.conn_store[self.stage]
+        nsyns = store.row(self.iter_count)
         self.iter_count += 1
 
         # Detect end of iteration
-        if self.iter_count == self.n_source:
+        if self.iter_count == store.n_row:
+            self.stats.stop(('forward', 'backward')[self.stage] + '_assignment')
             self.iter_count = 0
             if self.stage == self.end_stage:
                 if self.verbose:
@@ -986,20 +2165,23 @@ class ReciprocalConnector(AbstractConnector):
             if self.verbose:
                 print("Assigning forward connections.",flush=True)
                 self.timer.start()
+            self.stats.start('forward_assignment')
         return self.make_connection()
 
-    def make_backward_connection(self, targets, source, *args, **kwargs):
+    def make_backward_connection(self, source, targets, *args, **kwargs):
         """Function to be called by BMTK iterator for backward connection"""
         if self.iter_count == 0:
             self.stage = 1
             if self.verbose:
                 print("Assigning backward connections.",flush=True)
+            self.stats.start('backward_assignment')
         return self.make_connection()
 
     def free_memory(self):
         """Free up memory after connections are built"""
         # Do not clear self.conn_prop if it will be used by conn.add_properties
-        variables = ('conn_mat', 'source_list', 'target_list',
+        # Keep self.conn_store if it will be used by CorrelatedGapJunction
+        variables = ('source_list', 'target_list', 'positions',
                      'source_ids', 'target_ids')
         for var in variables:
             setattr(self, var, None)
@@ -1019,20 +2201,17 @@ class ReciprocalConnector(AbstractConnector):
         n_pair: pairs of cells
         proportion: of connections in possible and total pairs
         """
-        conn_mat = self.conn_mat.astype(bool)
-        n_conn = np.count_nonzero(conn_mat, axis=(1, 2))
+        n_conn = np.array([np.count_nonzero(store.nsyns)
+                           for store in self.conn_store])
         n_poss = np.array(self.possible_count)
-        n_pair = conn_mat.size / 2
+        n_recp = self.n_recp
         if self.recurrent:
-            n_recp = np.count_nonzero(conn_mat[0] & conn_mat[0].T)
-            if self.autapses:
-                n_recp -= np.count_nonzero(np.diag(conn_mat[0]))
-            n_recp //= 2
             n_conn -= n_recp
             n_poss = n_poss[None]
-            n_pair += (1 if self.autapses else -1) * self.n_source / 2
+            n_pair = self.n_source * (self.n_source +
+                                      (1 if self.autapses else -1)) / 2
         else:
-            n_recp = np.count_nonzero(conn_mat[0] & conn_mat[1])
+            n_pair = self.n_source * self.n_target
         n_conn = np.append(n_conn, n_recp)
         n_pair = int(n_pair)
         fraction = np.array([n_conn / n_poss, n_conn / n_pair])
@@ -1056,29 +2235,15 @@ class ReciprocalConnector(AbstractConnector):
               % arr2str(100 * fraction[1], '%.2f%%'),flush=True)
 
     def save_connection_report(self):
-        """Save connections into a CSV file to be read from later"""
+        """Add connection numbers to the report to be saved to file later"""
         src_str, trg_str = self.get_nodes_info()
         n_conn, n_poss, n_pair, fraction = self.connection_number()
+        directions = ('forward', 'reciprocal') if self.recurrent \
+            else REPORT_DIRECTIONS
+        add_connection_report(self.report_name, src_str, trg_str,
+                              'reciprocal', n_pair, directions,
+                              n_conn, n_poss, fraction)
 
-        # Extract the population name from source_str and target_str
-        data = {
-            "Source": [src_str],
-            "Target": [trg_str],
-            "Percent connectionivity within possible connections": [fraction[0]*100],
-            "Percent connectionivity within all connections": [fraction[1]*100]
-        }
-        df = pd.DataFrame(data)
-        
-        # Append the data to the CSV file
-        try:
-            # Check if the file exists by trying to read it
-            existing_df = pd.read_csv(self.report_name)
-            # If no exception is raised, append without header
-            df.to_csv(self.report_name, mode='a', header=False, index=False)
-        except FileNotFoundError:
-            # If the file does not exist, write with header
-            df.to_csv(self.report_name, mode='w', header=True, index=False)
-            
 
 class UnidirectionConnector(AbstractConnector):
     """
@@ -1095,6 +2260,14 @@ class UnidirectionConnector(AbstractConnector):
             can be a constant or a (deterministic or random) function whose
             input arguments are two node objects in BMTK like p_arg.
         verbose: Whether show verbose information in console.
+        seed, n_workers, block_size: Seed for the random number generator,
+            number of processes and number of source cells in each block for
+            generating connections in parallel. See ReciprocalConnector.
+        out_of_core, tmp_dir: Whether to spill generated connections to
+            memory-mapped files on disk and the directory for the files.
+            See ReciprocalConnector.
+        cache_dir: Directory for caching the generated connections.
+            See ReciprocalConnector.
 
     Returns:
         An object that works with BMTK to build edges in a network.
@@ -1109,25 +2282,38 @@ class UnidirectionConnector(AbstractConnector):
             Example: {sid0: {tid0: p_arg0, tid1: p_arg1, ...},
                       sid1: {...}, sid2: {...}, ... }
             This is useful in similar manner as in ReciprocalConnector.
+        conn_store: ConnectionStore object, an array-backed version of
+            conn_prop including the number of synapses.
     """
 
-    def __init__(self, p=1., p_arg=None, n_syn=1, verbose=True,save_report=True,report_name=None):
+    def __init__(self, p=1., p_arg=None, n_syn=1, verbose=True,save_report=True,report_name=None,
+                 seed=None, n_workers=1, block_size=None, out_of_core=False,
+                 tmp_dir=None, cache_dir=None):
         args = locals()
         var_set = ('p', 'p_arg', 'n_syn')
         self.vars = {key: args[key] for key in var_set}
 
         self.verbose = verbose
         self.save_report = save_report
+        self.seed = np.random.SeedSequence(seed).entropy
+        self.n_workers = n_workers
+        self.block_size = block_size
+        self.out_of_core = out_of_core
+        self.tmp_dir = tmp_dir
+        self.setup_cache(cache_dir, seed)
+
         if report_name is None:
             report_name = globals().get('report_name', 'default_report.csv')
         self.report_name = report_name
 
         self.conn_prop = {}
+        self.conn_store = None
         self.iter_count = 0
 
     # *** Two methods executed during bmtk edge creation net.add_edges() ***
     def setup_nodes(self, source=None, target=None):
         """Must run this before building connections"""
+        self.stats.start('setup_nodes')
         # Update node pools
         self.source = source
         self.target = target
@@ -1138,23 +2324,22 @@ class UnidirectionConnector(AbstractConnector):
             src_str, trg_str = self.get_nodes_info()
             raise ValueError(f"{trg_str} nodes do not exists")
         self.n_pair = len(self.source) * len(self.target)
+        self.register()
+        self.stats.stop('setup_nodes')
 
     def edge_params(self):
         """Create the arguments for BMTK add_edges() method"""
         params = {'source': self.source, 'target': self.target,
-                  'iterator': 'one_to_one',
+                  'iterator': 'one_to_all',
                   'connection_rule': self.make_connection}
         return params
 
     # *** Methods executed during bmtk network.build() ***
     # *** Helper functions ***
-    def add_conn_prop(self, sid, tid, prop):
-        """Store p0_arg and p1_arg for a connected pair"""
-        trg_dict = self.conn_prop.setdefault(sid, {})
-        trg_dict[tid] = prop
-
     def get_conn_prop(self, sid, tid):
         """Get stored value given node ids in a connection"""
+        if self.out_of_core:
+            return self.conn_store.get_prop(sid, tid)
         return self.conn_prop[sid][tid]
 
     def setup_variables(self):
@@ -1165,45 +2350,146 @@ class UnidirectionConnector(AbstractConnector):
             else:
                 setattr(self, name, self.constant_function(var))
 
+    def p_arg_function(self):
+        """Function (or constant) giving the argument of p for a pair"""
+        return self.vars['p_arg']
+
     def initialize(self):
         self.setup_variables()
+        self.source_list = list(self.source)
+        self.target_list = list(self.target)
+        self.n_source = len(self.source_list)
+        self.n_target = len(self.target_list)
+        source_ids = np.array([s.node_id for s in self.source_list])
+        target_ids = np.array([t.node_id for t in self.target_list])
+        self.source_ids = source_ids
+        self.conn_store = ConnectionStore(source_ids, target_ids,
+                                          out_of_core=self.out_of_core,
+                                          tmp_dir=self.tmp_dir)
+        # Positions for distance functions that can be vectorized
+        self.setup_positions([self.p_arg_function()])
+        self.constant_p = self.constant_probability()
         self.n_conn = 0
         self.n_poss = 0
         if self.verbose:
             self.timer = Timer()
 
-    def make_connection(self, source, target, *args, **kwargs):
-        """Assign number of synapses per iteration using one_to_one iterator"""
+    def block_pairs(self, start, stop):
+        """Indices of source and target for pairs in a block of source rows"""
+        return rect_block(start, stop, self.n_target)
+
+    def estimate(self, n_sample=10000, seed=None):
+        """
+        Dry run estimation of the connections before building the network.
+        Sample n_sample random pairs, evaluate their probabilities, and
+        extrapolate to all pairs. Return a dictionary of estimates, similar
+        to ReciprocalConnector.estimate().
+        """
+        rng = np.random.default_rng(seed)
+        with self.dry_run():
+            self.initialize()
+            timer = Timer()
+            rows, cols = self.sample_pairs(n_sample, rng)
+            _, p = self.pair_probability(rows, cols)
+            n_syn = pair_values(self.vars['n_syn'], self.source_list,
+                                self.target_list, rows, cols)
+            time_per_pair = timer.end() / timer.scale / rows.size
+            n_pair = self.pair_count()
+            scale = n_pair / rows.size
+            std = 0. if scale == 1 else n_pair * np.std(p) / rows.size ** .5
+            return self.estimate_summary(
+                n_pair, rows.size, np.sum(p) * scale, std,
+                np.sum(p * n_syn) * scale, p, time_per_pair)
+
+    def pair_probability(self, rows, cols, block=None):
+        """Calculate p_arg and probability for pairs of node indices.
+        block: (start, stop) of source rows if the pairs are a whole block
+        from block_pairs(), for caching distances."""
+        p_arg = pair_values(self.p_arg_function(), self.source_list,
+                            self.target_list, rows, cols, self.positions,
+                            self.distance_key(block))
+        return p_arg, probability_values(self.vars['p'], p_arg)
+
+    def sample_block(self, start, stop, rng):
+        """Generate random connections for a block of source rows.
+        Return connections as a tuple of arrays (rows, columns, number of
+        synapses, p_arg) and the number of possible connections."""
+        if self.constant_p is not None:
+            # Draw connected pairs only by geometric skipping
+            n = self.block_pair_count(start, stop)
+            idx = bernoulli_indices(self.constant_p, n, rng)
+            rows, cols = self.index_pairs(start, stop, idx)
+            p_arg = pair_values(self.p_arg_function(), self.source_list,
+                                self.target_list, rows, cols, self.positions)
+            n_poss = n if self.constant_p > 0 else 0
+        else:
+            rows, cols = self.block_pairs(start, stop)
+            p_arg, p = self.pair_probability(rows, cols, (start, stop))
+            conn = bernoulli_mask(p, rng)
+            rows, cols, p_arg = rows[conn], cols[conn], p_arg[conn]
+            n_poss = np.count_nonzero(p > 0)
+        nsyns = pair_values(self.vars['n_syn'], self.source_list,
+                            self.target_list, rows, cols)
+        return (rows, cols, nsyns, p_arg), n_poss
+
+    def constant_probability(self):
+        """Return p if it is the same for all pairs, i.e., it is a constant or
+        its argument is a constant. Otherwise return None."""
+        p, p_arg = self.vars['p'], self.p_arg_function()
+        if callable(p):
+            if callable(p_arg):
+                return None
+            p = probability_values(p, [p_arg])[0]
+        return float(p)
+
+    CACHE_ATTRS = ('n_poss', )
+
+    def generate_connections(self):
+        """Generate connections for all pairs in blocks of source rows"""
+        self.stats.start('sample')
+        blocks = self.get_row_blocks()
+        outputs = self.run_blocks('sample_block', blocks)
+        for (start, stop), (conn, n_poss) in zip(blocks, outputs):
+            if self.constant_p is None:
+                self.count_block(start, stop)
+            self.conn_store.append(*conn)
+            self.n_poss += n_poss
+        self.conn_store.finalize()
+        self.stats.stop('sample')
+
+    def initial_all_to_all(self):
+        """Generate connections, or load them from the cache"""
+        self.build_connections()
+        self.n_conn = len(self.conn_store)
+        if not self.out_of_core:
+            with self.stats.stage('conn_prop'):
+                self.conn_store.update_conn_prop(self.conn_prop)
+
+    def make_connection(self, source, targets, *args, **kwargs):
+        """Assign number of synapses per iteration using one_to_all iterator"""
         # Initialize in the first iteration
         if self.iter_count == 0:
-            self.initialize()
+            with self.stats.stage('initialize'):
+                self.initialize()
             if self.verbose:
                 src_str, trg_str = self.get_nodes_info()
                 print("\nStart building connection \n  from "
                       + src_str + "\n  to " + trg_str,flush=True)
+            self.initial_all_to_all()
+            self.stats.start('assignment')
 
-        # Make random connections
-
-        p_arg = self.p_arg(source, target)
-        p = self.p(p_arg)
-        possible = p > 0
-        self.n_poss += possible
-        if possible and decision(p):
-            nsyns = self.n_syn(source, target)
-            self.add_conn_prop(source.node_id, target.node_id, p_arg)
-            self.n_conn += 1
-        else:
-            nsyns = 0
-
+        nsyns = self.conn_store.row(self.iter_count)
         self.iter_count += 1
 
         # Detect end of iteration
-        if self.iter_count == self.n_pair:
+        if self.iter_count == self.n_source:
+            self.stats.stop('assignment')
             if self.verbose:
                 self.connection_number_info()
                 self.timer.report('Done! \nTime for building connections')
             if self.save_report:
-                self.save_connection_report()
+                with self.stats.stage('report'):
+                    self.save_connection_report()
 
         return nsyns
 
@@ -1224,31 +2510,14 @@ class UnidirectionConnector(AbstractConnector):
         print("Fraction of connected pairs in all pairs: %.2f%%\n"
               % (100. * self.n_conn / self.n_pair),flush=True)
     
-    def save_connection_report(self):
-        """Save connections into a CSV file to be read from later"""
+    def save_connection_report(self, connection_type='unidirection'):
+        """Add connection numbers to the report to be saved to file later"""
         src_str, trg_str = self.get_nodes_info()
-        
-        possible_fraction = (100. * self.n_conn / self.n_poss)
-        all_fraction = (100. * self.n_conn / self.n_pair)
-
-        # Extract the population name from source_str and target_str
-        data = {
-            "Source": [src_str],
-            "Target": [trg_str],
-            "Percent connectionivity within possible connections": [possible_fraction],
-            "Percent connectionivity within all connections": [all_fraction]
-        }
-        df = pd.DataFrame(data)
-        
-        # Append the data to the CSV file
-        try:
-            # Check if the file exists by trying to read it
-            existing_df = pd.read_csv(self.report_name)
-            # If no exception is raised, append without header
-            df.to_csv(self.report_name, mode='a', header=False, index=False)
-        except FileNotFoundError:
-            # If the file does not exist, write with header
-            df.to_csv(self.report_name, mode='w', header=True, index=False)
+        fraction = [self.n_conn / self.n_poss if self.n_poss else 0.,
+                    self.n_conn / self.n_pair]
+        add_connection_report(self.report_name, src_str, trg_str,
+                              connection_type, self.n_pair, ('forward', ),
+                              [self.n_conn], self.n_poss, fraction)
 
 
 class GapJunction(UnidirectionConnector):
@@ -1272,8 +2541,14 @@ class GapJunction(UnidirectionConnector):
         Similar to `UnidirectionConnector`.
     """
 
-    def __init__(self, p=1., p_arg=None, verbose=True,save_report=True,report_name=None):
-        super().__init__(p=p, p_arg=p_arg, verbose=verbose,save_report=save_report,report_name=None)
+    def __init__(self, p=1., p_arg=None, verbose=True,save_report=True,report_name=None,
+                 seed=None, n_workers=1, block_size=None, out_of_core=False,
+                 tmp_dir=None, cache_dir=None):
+        super().__init__(p=p, p_arg=p_arg, verbose=verbose,save_report=save_report,
+                         report_name=report_name, seed=seed,
+                         n_workers=n_workers, block_size=block_size,
+                         out_of_core=out_of_core, tmp_dir=tmp_dir,
+                         cache_dir=cache_dir)
 
 
     def setup_nodes(self, source=None, target=None):
@@ -1284,39 +2559,62 @@ class GapJunction(UnidirectionConnector):
                              f"gap junction. Nodes are {src_str} and {trg_str}")
         self.n_source = len(self.source)
 
-    def make_connection(self, source, target, *args, **kwargs):
-        """Assign gap junction per iteration using one_to_one iterator"""
+    def edge_params(self):
+        """Create the arguments for BMTK add_edges() method"""
+        params = {'source': self.source, 'target': self.target,
+                  'iterator': 'one_to_all',
+                  'connection_rule': self.make_connection}
+        return params
+
+    def triangle_offset(self):
+        return 1
+
+    def block_pairs(self, start, stop):
+        """Indices of pairs in the upper triangle in a block of source rows"""
+        return triu_block(start, stop, self.n_source)
+
+    def initial_all_to_all(self):
+        """Sample gap junctions for all pairs in the upper triangle"""
+        super().initial_all_to_all()
+        # Gap junctions are symmetric
+        if not self.out_of_core:
+            with self.stats.stage('conn_prop'):
+                self.conn_store.update_conn_prop(self.conn_prop, reverse=True)
+
+    def get_conn_prop(self, sid, tid):
+        """Get stored value given node ids in a connection"""
+        if self.out_of_core:
+            try:
+                return self.conn_store.get_prop(sid, tid)
+            except KeyError:
+                return self.conn_store.get_prop(tid, sid)
+        return self.conn_prop[sid][tid]
+
+    def make_connection(self, source, targets, *args, **kwargs):
+        """Assign gap junctions per iteration using one_to_all iterator"""
         # Initialize in the first iteration
         if self.iter_count == 0:
-            self.initialize()
+            with self.stats.stage('initialize'):
+                self.initialize()
             if self.verbose:
                 src_str, _ = self.get_nodes_info()
                 print("\nStart building gap junction \n  in " + src_str,flush=True)
+            self.initial_all_to_all()
+            self.stats.start('assignment')
 
-        # Consider each pair only once
-        nsyns = 0
-        i, j = divmod(self.iter_count, self.n_source)
-        if i < j:
-            p_arg = self.p_arg(source, target)
-            p = self.p(p_arg)
-            possible = p > 0
-            self.n_poss += possible
-            if possible and decision(p):
-                nsyns = 1
-                sid, tid = source.node_id, target.node_id
-                self.add_conn_prop(sid, tid, p_arg)
-                self.add_conn_prop(tid, sid, p_arg)
-                self.n_conn += 1
-
+        # Each pair is only connected once from the upper triangle
+        nsyns = self.conn_store.row(self.iter_count)
         self.iter_count += 1
 
         # Detect end of iteration
-        if self.iter_count == self.n_pair:
+        if self.iter_count == self.n_source:
+            self.stats.stop('assignment')
             if self.verbose:
                 self.connection_number_info()
                 self.timer.report('Done! \nTime for building connections')
             if self.save_report:
-                self.save_connection_report()
+                with self.stats.stage('report'):
+                    self.save_connection_report()
         return nsyns
 
     def connection_number_info(self):
@@ -1326,30 +2624,7 @@ class GapJunction(UnidirectionConnector):
         self.n_pair = n_pair
 
     def save_connection_report(self):
-        """Save connections into a CSV file to be read from later"""
-        src_str, trg_str = self.get_nodes_info()
-        n_pair = self.n_pair
-        fraction_0 = self.n_conn / self.n_poss if self.n_poss else 0.
-        fraction_1 = self.n_conn / self.n_pair
-
-        # Convert fraction to percentage and prepare data for the DataFrame
-        data = {
-            "Source": [src_str+"Gap"],
-            "Target": [trg_str+"Gap"],
-            "Percent connectionivity within possible connections": [fraction_0*100],
-            "Percent connectionivity within all connections": [fraction_1*100]
-        }
-        df = pd.DataFrame(data)
-        
-        # Append the data to the CSV file
-        try:
-            # Check if the file exists by trying to read it
-            existing_df = pd.read_csv(self.report_name)
-            # If no exception is raised, append without header
-            df.to_csv(self.report_name, mode='a', header=False, index=False)
-        except FileNotFoundError:
-            # If the file does not exist, write with header
-            df.to_csv(self.report_name, mode='w', header=True, index=False)
+        super().save_connection_report(connection_type='gap')
 
 
 class CorrelatedGapJunction(GapJunction):
@@ -1368,9 +2643,11 @@ class CorrelatedGapJunction(GapJunction):
             function, similar to p0_arg, p1_arg in ReciprocalConnector.
         connector: Connector object used to generate the chemical synapses of
             within this population, which contains the connection information
-            in its attribute `conn_prop`. So this connector should have
+            in its attribute `conn_store`. So this connector should have
             generated the chemical synapses before generating the gap junction.
         verbose: Whether show verbose information in console.
+        save_report, report_name: Whether to save the connection report when
+            finished and the path of the report file, like GapJunction.
 
     Returns:
         An object that works with BMTK to build edges in a network.
@@ -1380,73 +2657,316 @@ class CorrelatedGapJunction(GapJunction):
     """
 
     def __init__(self, p_non=1., p_uni=1., p_rec=1., p_arg=None,
-                 connector=None, verbose=True):
-        super().__init__(p=p_non, p_arg=p_arg, verbose=verbose)
+                 connector=None, verbose=True, save_report=True,
+                 report_name=None, seed=None, n_workers=1, block_size=None,
+                 out_of_core=False, tmp_dir=None, cache_dir=None):
+        super().__init__(p=p_non, p_arg=p_arg, verbose=verbose,
+                         save_report=save_report, report_name=report_name,
+                         seed=seed,
+                         n_workers=n_workers, block_size=block_size,
+                         out_of_core=out_of_core, tmp_dir=tmp_dir,
+                         cache_dir=cache_dir)
         self.vars['p_non'] = self.vars.pop('p')
         self.vars['p_uni'] = p_uni
         self.vars['p_rec'] = p_rec
         self.connector = connector
-        conn_prop = connector.conn_prop
-        if isinstance(conn_prop, list):
-            conn_prop = conn_prop[0]
-        self.ref_conn_prop = conn_prop
-
-    def conn_exist(self, sid, tid):
-        trg_dict = self.ref_conn_prop.get(sid)
-        if trg_dict is not None and tid in trg_dict:
-            return True, trg_dict[tid]
-        else:
-            return False, None
+        self.has_p_arg = p_arg is not None
 
-    def connection_type(self, sid, tid):
-        conn0, prop0 = self.conn_exist(sid, tid)
-        conn1, prop1 = self.conn_exist(tid, sid)
-        return conn0 + conn1, prop0 if conn0 else prop1
+    def p_arg_function(self):
+        """p_arg, or that of the reference connector if not given"""
+        if self.has_p_arg:
+            return self.vars['p_arg']
+        var = self.connector.vars
+        return var.get('p_arg', var.get('p0_arg', None))
 
     def initialize(self):
-        self.has_p_arg = self.vars['p_arg'] is not None
-        if not self.has_p_arg:
-            var = self.connector.vars
-            self.vars['p_arg'] = var.get('p_arg', var.get('p0_arg', None))
         super().initialize()
-        self.ps = [self.p_non, self.p_uni, self.p_rec]
+        self.ps = [self.vars[key] for key in ('p_non', 'p_uni', 'p_rec')]
+        conn_store = self.connector.conn_store
+        if isinstance(conn_store, list):
+            conn_store = conn_store[0] if conn_store else None
+        if conn_store is None or not conn_store.finalized:
+            raise ValueError("Connections of the reference connector must be "
+                             "generated before the gap junctions.")
+        self.ref_conn_store = conn_store
+
+    def constant_probability(self):
+        """Probabilities depend on the chemical synapses"""
+        return None
+
+    def cache_params(self):
+        """Include the chemical synapses of the reference connector"""
+        params = super().cache_params()
+        store = self.ref_conn_store
+        params['reference'] = (store.source_ids, store.target_ids,
+                               store.keys, store.nsyns)
+        params['p_arg'] = self.p_arg_function()
+        return params
 
-    def make_connection(self, source, target, *args, **kwargs):
-        """Assign gap junction per iteration using one_to_one iterator"""
-        # Initialize in the first iteration
-        if self.iter_count == 0:
-            self.initialize()
-            if self.verbose:
-                src_str, _ = self.get_nodes_info()
-                print("\nStart building gap junction \n  in " + src_str,flush=True)
+    def pair_probability(self, rows, cols, block=None):
+        """Calculate p_arg and probability for pairs of node indices given
+        the type of chemical synaptic connections between them"""
+        sids, tids = self.source_ids[rows], self.source_ids[cols]
+        conn0, prop0 = self.ref_conn_store.lookup(sids, tids)
+        conn1, prop1 = self.ref_conn_store.lookup(tids, sids)
+        conn_type = conn0.astype(int) + conn1
+        p_arg = np.where(conn0, prop0, prop1)
+        calc = np.ones(rows.shape, dtype=bool) if self.has_p_arg \
+            else conn_type == 0
+        if np.any(calc):
+            if block is not None and self.positions_key is not None:
+                # Distances of the whole block may be cached
+                val = pair_values(self.p_arg_function(), self.source_list,
+                                  self.source_list, rows, cols, self.positions,
+                                  self.distance_key(block))[calc]
+            else:
+                val = pair_values(self.p_arg_function(), self.source_list,
+                                  self.source_list, rows[calc], cols[calc],
+                                  self.positions)
+            p_arg = p_arg.astype(np.result_type(p_arg, val))
+            p_arg[calc] = val
+        p = np.zeros(rows.shape)
+        for i, p_func in enumerate(self.ps):
+            idx = conn_type == i
+            p[idx] = probability_values(p_func, p_arg[idx])
+        return p_arg, p
+
+
+class FixedDegreeConnector(UnidirectionConnector):
+    """
+    Object for building connections in bmtk network model where each target
+    cell receives a fixed number of connections from the source population
+    (fixed in-degree), or each source cell makes a fixed number of connections
+    to the target population (fixed out-degree). The partners of each cell are
+    drawn at random without replacement, optionally weighted by a function of
+    distance.
 
-        # Consider each pair only once
-        nsyns = 0
-        i, j = divmod(self.iter_count, self.n_source)
-        if i < j:
-            sid, tid = source.node_id, target.node_id
-            conn_type, p_arg = self.connection_type(sid, tid)
-            if self.has_p_arg or not conn_type:
-                p_arg = self.p_arg(source, target)
-            p = self.ps[conn_type](p_arg)
-            possible = p > 0
-            self.n_poss += possible
-            if possible and decision(p):
-                nsyns = 1
-                self.add_conn_prop(sid, tid, p_arg)
-                self.add_conn_prop(tid, sid, p_arg)
-                self.n_conn += 1
+    Parameters:
+        k: Number of connections of each cell. It can be an integer, an array
+            of integers for each cell in the population the degree is fixed
+            for, or a (deterministic or random) function whose input argument
+            is a node object in BMTK and returns an integer, e.g., drawn from
+            some distribution. When a cell has fewer possible partners than
+            k, it connects to all of them.
+        direction: 'in' for fixed in-degree of target cells, or 'out' for
+            fixed out-degree of source cells.
+        p, p_arg: Relative weight of drawing each partner and its input
+            argument when it is a function, similar to p0, p0_arg in
+            ReciprocalConnector. It can be a constant or a deterministic
+            function whose value must be non-negative. Pairs with zero weight
+            are never connected. When p is constant, partners are drawn
+            uniformly. If p_arg is not specified and p is distance dependent
+            or max_dist is specified, spherical_dist is used.
+        max_dist: Maximum distance between a cell and its possible partners.
+            If not specified and p is a DistantDependentProbability, use its
+            max_dist. When p_arg is spherical_dist or cylindrical_dist_z,
+            possible partners are found with a KD-tree instead of evaluating
+            all pairs.
+        n_syn: Number of synapses in each connection. It can be a constant or
+            a (deterministic or random) function whose input arguments are two
+            node objects in BMTK like p_arg.
+        autapses: Whether a cell can connect to itself when the source and
+            target are the same population.
+        verbose: Whether show verbose information in console.
+        seed, n_workers, block_size: Seed for the random number generator,
+            number of processes and number of cells in each block for
+            generating connections in parallel. Here blocks are of the cells
+            the degree is fixed for. See ReciprocalConnector.
+        out_of_core, tmp_dir: Whether to spill generated connections to
+            memory-mapped files on disk and the directory for the files.
+            See ReciprocalConnector.
+        cache_dir: Directory for caching the generated connections.
+            See ReciprocalConnector.
 
-        self.iter_count += 1
+    Returns:
+        An object that works with BMTK to build edges in a network.
 
-        # Detect end of iteration
-        if self.iter_count == self.n_pair:
-            if self.verbose:
-                self.connection_number_info()
-                self.timer.report('Done! \nTime for building connections')
-            if self.save_report:
-                self.save_connection_report()
-        return nsyns
+    Important attributes:
+        Similar to `UnidirectionConnector`.
+        degree: Array of the required number of connections of each cell.
+        n_short: Number of cells that have fewer possible partners than the
+            required number of connections.
+
+    Algorithm:
+        For a block of cells, the possible partners within max_dist of each
+        cell are queried from a KD-tree of the positions of the other
+        population. Partners are drawn by weighted random sampling without
+        replacement (Efraimidis and Spirakis, 2006). Each candidate pair gets
+        a random key u^(1/w), where u is uniform in (0, 1) and w is the
+        weight, and the k candidates with the largest keys are selected for
+        each cell. This is vectorized over all candidates in the block by
+        sorting the keys within the cells.
+    """
+
+    def __init__(self, k=1, direction='in', p=1., p_arg=None, max_dist=None,
+                 n_syn=1, autapses=False, verbose=True, save_report=True,
+                 report_name=None, seed=None, n_workers=1, block_size=None,
+                 out_of_core=False, tmp_dir=None, cache_dir=None):
+        if direction not in ('in', 'out'):
+            raise ValueError("direction must be 'in' or 'out'")
+        if max_dist is None and isinstance(p, DistantDependentProbability):
+            max_dist = p.max_dist
+        if max_dist is not None and not np.isfinite(max_dist):
+            max_dist = None
+        if p_arg is None and (max_dist is not None
+                              or isinstance(p, DistantDependentProbability)):
+            p_arg = spherical_dist
+        super().__init__(p=p, p_arg=p_arg, n_syn=n_syn, verbose=verbose,
+                         save_report=save_report, report_name=report_name,
+                         seed=seed, n_workers=n_workers,
+                         block_size=block_size, out_of_core=out_of_core,
+                         tmp_dir=tmp_dir, cache_dir=cache_dir)
+        self.vars['k'] = k
+        self.direction = direction
+        self.max_dist = max_dist
+        self.autapses = autapses
+
+    def initialize(self):
+        super().initialize()
+        self.recurrent = is_same_pop(self.source, self.target)
+        if self.direction == 'in':
+            draw_list, self.n_draw, self.n_other = \
+                self.target_list, self.n_target, self.n_source
+        else:
+            draw_list, self.n_draw, self.n_other = \
+                self.source_list, self.n_source, self.n_target
+        k = self.vars['k']
+        if callable(k):
+            k = [k(node) for node in draw_list]
+        self.degree = np.broadcast_to(np.asarray(k, dtype=int),
+                                      (self.n_draw, )).copy()
+        if np.any(self.degree < 0):
+            raise ValueError("Number of connections k must be non-negative")
+        # KD-tree of the positions of the other population
+        self.tree = None
+        axes = DIST_FUNC_AXES.get(self.p_arg_function())
+        if self.max_dist is not None and axes is not None:
+            # Positions are (source, target). Draw targets for in-degree.
+            other_pos, draw_pos = self.positions
+            if self.direction == 'out':
+                draw_pos, other_pos = other_pos, draw_pos
+            self.draw_pos = draw_pos[:, axes]
+            self.tree = cKDTree(other_pos[:, axes])
+        self.n_short = 0
+
+    def get_row_blocks(self):
+        """Split the cells the degree is fixed for into blocks such that each
+        block has about BLOCK_PAIRS candidate pairs if not specified"""
+        size = self.block_size or max(BLOCK_PAIRS // max(self.n_other, 1), 1)
+        return [(i, min(i + size, self.n_draw))
+                for i in range(0, self.n_draw, size)]
+
+    def candidate_pairs(self, draw):
+        """Possible partners of cells given their indices. Return arrays of
+        the index of the cell and its partner, source and target indices,
+        p_arg, and weight of each candidate pair with positive weight, and
+        the number of candidate pairs evaluated."""
+        if self.tree is None:
+            owner = np.repeat(draw, self.n_other)
+            other = np.tile(np.arange(self.n_other), draw.size)
+        else:
+            nbrs = self.tree.query_ball_point(self.draw_pos[draw],
+                                              self.max_dist)
+            counts = np.array([len(nb) for nb in nbrs], dtype=int)
+            owner = np.repeat(draw, counts)
+            other = np.array([j for nb in nbrs for j in nb], dtype=int)
+        rows, cols = (other, owner) if self.direction == 'in' \
+            else (owner, other)
+        if self.recurrent and not self.autapses:
+            keep = rows != cols
+            owner, rows, cols = owner[keep], rows[keep], cols[keep]
+        p_arg, w = self.pair_probability(rows, cols)
+        valid = w > 0
+        if self.max_dist is not None:
+            valid &= p_arg <= self.max_dist
+        return (owner[valid], rows[valid], cols[valid], p_arg[valid],
+                w[valid], w.size)
+
+    def sample_block(self, start, stop, rng):
+        """Draw partners for a block of cells the degree is fixed for.
+        Return connections as a tuple of arrays (rows, columns, number of
+        synapses, p_arg), the number of possible connections, the number of
+        cells that have fewer possible partners than required and the number
+        of candidate pairs evaluated."""
+        owner, rows, cols, p_arg, w, n_eval = self.candidate_pairs(
+            np.arange(start, stop))
+        n_poss = owner.size
+        n_cand = np.bincount(owner - start, minlength=stop - start)
+        n_short = np.count_nonzero(n_cand < self.degree[start:stop])
+        # Weighted sampling without replacement by the largest keys
+        # log(u) / w within each cell. Candidates are grouped by cell.
+        keys = np.log(rng.random(n_poss)) / w
+        order = np.lexsort((-keys, owner))
+        sorted_owner = owner[order]
+        rank = np.arange(n_poss) - np.searchsorted(sorted_owner, sorted_owner)
+        conn = order[rank < self.degree[sorted_owner]]
+        rows, cols, p_arg = rows[conn], cols[conn], p_arg[conn]
+        nsyns = pair_values(self.vars['n_syn'], self.source_list,
+                            self.target_list, rows, cols)
+        return (rows, cols, nsyns, p_arg), n_poss, n_short, n_eval
+
+    CACHE_ATTRS = ('n_poss', 'n_short')
+
+    def cache_params(self):
+        params = super().cache_params()
+        for key in ('direction', 'max_dist', 'autapses'):
+            params[key] = getattr(self, key)
+        return params
+
+    def generate_connections(self):
+        """Draw partners for all cells in blocks"""
+        self.stats.start('sample')
+        blocks = self.get_row_blocks()
+        outputs = self.run_blocks('sample_block', blocks)
+        for conn, n_poss, n_short, n_eval in outputs:
+            self.stats.count('pairs_evaluated', n_eval)
+            self.stats.peak('block_pairs', n_eval)
+            self.conn_store.append(*conn)
+            self.n_poss += n_poss
+            self.n_short += n_short
+        self.conn_store.finalize()
+        self.stats.stop('sample')
+
+    def estimate(self, n_sample=10000, seed=None):
+        """
+        Dry run estimation of the connections before building the network.
+        Find the possible partners of random cells with about n_sample
+        candidate pairs in total, and extrapolate to all cells. Return a
+        dictionary of estimates, similar to ReciprocalConnector.estimate().
+        """
+        rng = np.random.default_rng(seed)
+        with self.dry_run():
+            self.initialize()
+            timer = Timer()
+            n_pair = self.pair_count()
+            n_cell = min(max(n_sample * self.n_draw // max(n_pair, 1), 1),
+                         self.n_draw)
+            draw = np.sort(rng.choice(self.n_draw, size=n_cell, replace=False))
+            owner, rows, cols, _, _, _ = self.candidate_pairs(draw)
+            n_cand = np.bincount(owner, minlength=self.n_draw)[draw]
+            n_conn = np.minimum(n_cand, self.degree[draw])
+            n_syn = pair_values(self.vars['n_syn'], self.source_list,
+                                self.target_list, rows, cols)
+            n_syn = np.mean(n_syn) if n_syn.size else 0.
+            # Fraction of possible partners connected for each sampled cell
+            p = n_conn / np.fmax(n_cand, 1)
+            time_per_pair = timer.end() / timer.scale / n_cell \
+                * self.n_draw / max(n_pair, 1)
+            scale = self.n_draw / n_cell
+            std = 0. if scale == 1 else self.n_draw * np.std(n_conn) / n_cell ** .5
+            return self.estimate_summary(
+                n_pair, n_cell * self.n_other, np.sum(n_conn) * scale, std,
+                np.sum(n_conn) * scale * n_syn, p, time_per_pair)
+
+    def connection_number_info(self):
+        """Print connection numbers after connections built"""
+        super().connection_number_info()
+        name = 'target' if self.direction == 'in' else 'source'
+        print("Number of %s cells with fewer possible partners than "
+              "required: %d\n" % (name, self.n_short), flush=True)
+
+    def save_connection_report(self):
+        super().save_connection_report(connection_type='fixed_degree')
 
 
 class OneToOneSequentialConnector(AbstractConnector):
@@ -1501,6 +3021,7 @@ class OneToOneSequentialConnector(AbstractConnector):
     # *** Two methods executed during bmtk edge creation net.add_edges() ***
     def setup_nodes(self, source=None, target=None):
         """Must run this before building connections"""
+        self.stats.start('setup_nodes')
         # Update node pools
         if self.partition_source:
             source, target = target, source
@@ -1530,6 +3051,8 @@ class OneToOneSequentialConnector(AbstractConnector):
         if self.verbose and self.idx_range[-1] == self.n_source:
             print("All " + ("source" if self.partition_source else "target")
                   + " population partitions are filled.",flush=True)
+        self.register()
+        self.stats.stop('setup_nodes')
 
     def edge_params(self, target_pop_idx=-1):
         """Create the arguments for BMTK add_edges() method"""
@@ -1565,10 +3088,18 @@ class OneToOneSequentialConnector(AbstractConnector):
                 self.target_count += 1
                 self.timer_part = Timer()
 
-        # Make connection
-        nsyns = np.zeros(self.n_source, dtype=int)
-        nsyns[self.iter_count] = self.n_syn
+        # Make connection. Reuse one buffer and clear the previous connection,
+        # since BMTK reads the values before the next iteration.
+        if self.iter_count == 0:
+            self.stats.start('assignment')
+            self.nsyns = np.zeros(self.n_source, dtype=int)
+        else:
+            self.nsyns[self.iter_count - 1] = 0
+        self.nsyns[self.iter_count] = self.n_syn
         self.iter_count += 1
+        if self.iter_count == self.idx_range[-1]:
+            self.stats.stop('assignment')
+            self.stats.count('connections', self.iter_count)
 
         # Detect end of iteration
         if self.verbose:
@@ -1578,7 +3109,7 @@ class OneToOneSequentialConnector(AbstractConnector):
             if self.iter_count == self.n_source:
                 # Very end
                 self.timer.report('Done! \nTime for building connections')
-        return nsyns
+        return self.nsyns
 
     # *** Helper functions for verbose ***
     def get_nodes_info(self, target_pop_idx=-1):
@@ -1658,3 +3189,132 @@ def syn_dist_delay_feng_section_PN(source, target, p=0.9,
 def syn_uniform_delay_section(source, target, low=DELAY_LOWBOUND,
                               high=DELAY_UPBOUND, **kwargs):
     return rng.uniform(low, high)
+
+
+# Array versions of the edge property functions above. They compute values for
+# all edges of a projection at once given the array of connection properties
+# (p_arg, usually distance) of the edges, which is read from the connector.
+def syn_const_delay_array(conn_prop, dist=100, min_delay=SYN_MIN_DELAY,
+                          velocity=SYN_VELOCITY, fluc_stdev=FLUC_STDEV,
+                          delay_bound=(DELAY_LOWBOUND, DELAY_UPBOUND)):
+    """Array version of syn_const_delay(). conn_prop is only used for the
+    number of edges."""
+    n = np.size(conn_prop)
+    delay = dist / velocity + min_delay + fluc_stdev * rng.normal(size=n)
+    return np.clip(delay, *delay_bound)
+
+
+def syn_dist_delay_feng_array(conn_prop, min_delay=SYN_MIN_DELAY,
+                              velocity=SYN_VELOCITY, fluc_stdev=FLUC_STDEV,
+                              delay_bound=(DELAY_LOWBOUND, DELAY_UPBOUND)):
+    """Array version of syn_dist_delay_feng(). conn_prop is the distance."""
+    dist = np.asarray(conn_prop, dtype=float)
+    delay = dist / velocity + min_delay + fluc_stdev * rng.normal(size=dist.shape)
+    return np.clip(delay, *delay_bound)
+
+
+def syn_section_PN_array(conn_prop, p=0.9, sec_id=(1, 2), sec_x=(0.4, 0.6),
+                         **kwargs):
+    """Array version of syn_section_PN(). Return arrays of sec_id, sec_x."""
+    syn_loc = (~decision(p, np.size(conn_prop))).astype(int)
+    return np.asarray(sec_id)[syn_loc], np.asarray(sec_x)[syn_loc]
+
+
+def syn_const_delay_feng_section_PN_array(conn_prop, p=0.9, sec_id=(1, 2),
+                                          sec_x=(0.4, 0.6), **kwargs):
+    """Array version of syn_const_delay_feng_section_PN()"""
+    delay = syn_const_delay_array(conn_prop, **kwargs)
+    s_id, s_x = syn_section_PN_array(conn_prop, p=p, sec_id=sec_id, sec_x=sec_x)
+    return delay, s_id, s_x
+
+
+def syn_dist_delay_feng_section_PN_array(conn_prop, p=0.9, sec_id=(1, 2),
+                                         sec_x=(0.4, 0.6), **kwargs):
+    """Array version of syn_dist_delay_feng_section_PN()"""
+    delay = syn_dist_delay_feng_array(conn_prop, **kwargs)
+    s_id, s_x = syn_section_PN_array(conn_prop, p=p, sec_id=sec_id, sec_x=sec_x)
+    return delay, s_id, s_x
+
+
+class EdgePropertyRule(object):
+    """
+    Rule for BMTK add_properties() that assigns edge properties computed by an
+    array function for all edges of a connection at once.
+
+    The rule must be created right after the edge_params() call of the
+    connector for the connection it is added to. When BMTK calls the rule for
+    the first edge, the array function is evaluated on the connection
+    properties stored in the connector, repeated for each synapse, in the same
+    order that BMTK iterates the edges. Each call then returns the next value.
+
+    Parameters:
+        func: Array function whose first argument is the array of connection
+            properties of all edges, e.g., syn_dist_delay_feng_array(). It
+            returns an array of values, or a tuple of arrays for multiple
+            properties.
+        connector: Connector object that stores the connections in its
+            attribute `conn_store`, e.g., ReciprocalConnector,
+            UnidirectionConnector.
+        **kwargs: Additional keyword arguments for func.
+    """
+
+    def __init__(self, func, connector, **kwargs):
+        self.func = func
+        self.connector = connector
+        self.kwargs = kwargs
+        # Stage of ReciprocalConnector whose edge_params() was called last
+        self.stage = max(getattr(connector, 'stage', 1) - 1, 0)
+        self.values = None
+
+    def get_store(self):
+        conn_store = self.connector.conn_store
+        if conn_store is None:
+            raise ValueError("Connector has no stored connections.")
+        if isinstance(conn_store, list):
+            conn_store = conn_store[self.stage]
+        return conn_store
+
+    def compute(self):
+        """Evaluate the array function for all edges"""
+        store = self.get_store()
+        nsyns = np.asarray(store.nsyns, dtype=int)
+        self.source_ids = np.repeat(store.source_ids[store.rows], nsyns)
+        self.target_ids = np.repeat(store.target_ids[store.cols], nsyns)
+        values = self.func(np.repeat(store.props, nsyns), **self.kwargs)
+        self.multiple = isinstance(values, tuple)
+        self.values = values if self.multiple else (values, )
+        self.index = 0
+
+    def __call__(self, source, target):
+        if self.values is None:
+            self.compute()
+        i = self.index
+        if (source.node_id != self.source_ids[i]
+                or target.node_id != self.target_ids[i]):
+            raise ValueError("Edge order does not match the connector. "
+                             "Create the rule right after edge_params().")
+        self.index += 1
+        if self.multiple:
+            return tuple(val[i] for val in self.values)
+        return self.values[0][i]
+
+
+def add_edge_properties(conn, connector, names, func, dtypes=None, **kwargs):
+    """
+    Add edge properties computed by an array function to a BMTK connection.
+    It should be called right after the connection is added with the
+    connector's edge_params(). For example,
+        conn = net.add_edges(**connector.edge_params(), **edge_params)
+        add_edge_properties(conn, connector, ['delay', 'sec_id', 'sec_x'],
+                            syn_dist_delay_feng_section_PN_array,
+                            dtypes=[float, np.int32, float], p=0.9)
+    conn: ConnectionMap object returned by BMTK add_edges().
+    connector: Connector object that generates the connection.
+    names, dtypes: Property names and data types as in add_properties().
+    func: Array function, e.g., syn_dist_delay_feng_array().
+    **kwargs: Additional keyword arguments for func.
+    Return the EdgePropertyRule object.
+    """
+    rule = EdgePropertyRule(func, connector, **kwargs)
+    conn.add_properties(names, rule=rule, dtypes=dtypes)
+    return rule
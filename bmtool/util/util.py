@@ -1,7 +1,13 @@
 import argparse
 from argparse import RawTextHelpFormatter,SUPPRESS
+import functools
 import glob, json, os, re, sys
 import math
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import uuid
 import numpy as np
 from numpy import genfromtxt
 import h5py
@@ -37,19 +43,317 @@ if __name__ == '__main__':
     verify_parse(parser)
     
 
+class GidTable(Mapping):
+    """
+    Read-only mapping from gid to the (begin, end) range of its columns in
+    the data tables of a report, backed by the arrays of the /mapping group.
+    Gids are looked up by binary search, for single gids or arrays of gids.
+    """
+    def __init__(self, gids, index_pointer):
+        self.gids = np.asarray(gids)
+        index_pointer = np.asarray(index_pointer)
+        self.begins = index_pointer[:-1]
+        self.ends = index_pointer[1:]
+        self._order = np.argsort(self.gids, kind='stable')
+        self._sorted_gids = self.gids[self._order]
+
+    def index(self, gids):
+        """Positions of gids in the mapping, -1 for gids not in the report"""
+        gids = np.asarray(gids)
+        if self.gids.size == 0:
+            return np.full(gids.shape, -1, dtype=int)
+        pos = np.searchsorted(self._sorted_gids, gids)
+        idx = self._order[np.fmin(pos, self.gids.size - 1)]
+        return np.where(self.gids[idx] == gids, idx, -1)
+
+    def __getitem__(self, gid):
+        idx = self.index(gid)
+        if idx.ndim or idx < 0:
+            raise KeyError(gid)
+        return self.begins[idx], self.ends[idx]
+
+    def __iter__(self):
+        return iter(self.gids.tolist())
+
+    def __len__(self):
+        return self.gids.size
+
+    def __contains__(self, gid):
+        return np.ndim(gid) == 0 and self.index(gid) >= 0
+
+
+# Suffix of the sidecar files of spikes sorted by time next to spike files
+SORTED_SPIKES_SUFFIX = '.sorted'
+
+
+def expand_files(files):
+    """
+    List of file paths from a path, a glob pattern or a list of them.
+    Glob patterns are expanded in sorted order, skipping sidecar files of
+    sorted spikes. Paths without a match are kept as is.
+    """
+    if isinstance(files, (str, os.PathLike)):
+        files = [files]
+    paths = []
+    for f in files:
+        matches = sorted(glob.glob(str(f))) if glob.has_magic(str(f)) else []
+        matches = [m for m in matches if not m.endswith(SORTED_SPIKES_SUFFIX)]
+        paths.extend(matches or [f])
+    return paths
+
+
+def map_files(func, files, n_workers=1):
+    """
+    Apply func(file) to each file and return the list of results in order.
+    Files are processed in a pool of n_workers forked processes if
+    n_workers > 1, so reading and decompressing separate files, e.g., the
+    partial outputs of MPI ranks, runs in parallel. func must be picklable.
+    """
+    n_workers = min(n_workers or 1, len(files))
+    if n_workers > 1:
+        if 'fork' in multiprocessing.get_all_start_methods():
+            ctx = multiprocessing.get_context('fork')
+            with ProcessPoolExecutor(n_workers, mp_context=ctx) as pool:
+                return list(pool.map(func, files))
+        print("\nWarning: Process fork is not supported on this platform. "
+              "Reading files in a single process.\n", flush=True)
+    return [func(f) for f in files]
+
+
+# Arrays of the mapping of reports with one entry per column
+REPORT_COLUMN_ARRAYS = ('element_id', 'element_pos', 'src_ids', 'trg_ids')
+
+
+def _read_report_layout(path, h5_root='/'):
+    """Data datasets (name, shape, dtype and attributes) and mapping arrays of
+    a report file"""
+    datasets = {}
+    with h5py.File(path, 'r') as f:
+        root = f[h5_root]
+        for name, obj in root.items():
+            if isinstance(obj, h5py.Group) and name != 'mapping' and 'data' in obj:
+                obj = obj['data']
+            if not isinstance(obj, h5py.Dataset) or obj.ndim != 2:
+                continue
+            datasets[obj.name[len(root.name):].lstrip('/')] = (obj.shape, obj.dtype, dict(obj.attrs))
+        mapping = {name: ds[()] for name, ds in root['mapping'].items()
+                   if isinstance(ds, h5py.Dataset)}
+    return os.path.abspath(path), datasets, mapping
+
+
+def merge_report_files(files, h5_root='/', n_workers=1):
+    """
+    Present partial report files, e.g., written by separate MPI ranks, as one
+    report without concatenating them on disk. Returns an in-memory HDF5 file
+    with the merged mapping, where the data table of each variable is a
+    virtual dataset joining the columns of the files in order. The mappings
+    of the files are read in parallel with n_workers processes.
+    """
+    layouts = map_files(functools.partial(_read_report_layout, h5_root=h5_root), files, n_workers)
+    names = [name for name in layouts[0][1] if all(name in l[1] for l in layouts)]
+    mappings = [l[2] for l in layouts]
+    if any(not np.array_equal(m['time'], mappings[0]['time']) for m in mappings):
+        raise Exception('Time of the report files {} do not match.'.format(files))
+
+    merged = h5py.File('merged-report-{}.h5'.format(uuid.uuid4().hex), 'w',
+                       driver='core', backing_store=False)
+    for name in names:
+        shapes = [l[1][name][0] for l in layouts]
+        if len({shape[0] for shape in shapes}) > 1:
+            raise Exception('Number of time steps of {} in report files {} do not match.'.format(name, files))
+        _, dtype, attrs = layouts[0][1][name]
+        vds = h5py.VirtualLayout(shape=(shapes[0][0], sum(shape[1] for shape in shapes)), dtype=dtype)
+        begin = 0
+        for (path, _, _), shape in zip(layouts, shapes):
+            vds[:, begin:begin + shape[1]] = h5py.VirtualSource(
+                path, h5_root.rstrip('/') + '/' + name, shape=shape)
+            begin += shape[1]
+        merged.create_virtual_dataset(name, vds).attrs.update(attrs)
+
+    mapping = merged.create_group('mapping')
+    offsets = np.cumsum([0] + [m['index_pointer'][-1] for m in mappings])
+    mapping['gids'] = np.concatenate([m['gids'] for m in mappings])
+    mapping['index_pointer'] = np.concatenate(
+        [m['index_pointer'][:-1] + offset for m, offset in zip(mappings, offsets)] + [offsets[-1:]])
+    for name, values in mappings[0].items():
+        if name in REPORT_COLUMN_ARRAYS and all(name in m for m in mappings):
+            mapping[name] = np.concatenate([m[name] for m in mappings])
+        elif name not in mapping:
+            mapping[name] = values
+    # Source files of virtual datasets are opened with the intent of the
+    # file using them. Reopen read-only so the partial files are not locked
+    # for writing while the report is read.
+    merged.flush()
+    image = merged.id.get_file_image()
+    merged.close()
+    return h5py.File(h5py.h5f.open_file_image(image))
+
+
+class ChunkCache(object):
+    """
+    LRU cache of decompressed chunks of report datasets.
+
+    Chunks are keyed by the variable name and the position of the chunk in
+    the chunk grid of its dataset. The least recently used chunks are
+    discarded when the memory limit is exceeded.
+
+    Parameters:
+        max_bytes: Memory limit of the cached arrays. 0 disables the cache.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.clear()
+
+    def clear(self):
+        self._chunks = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Get cached array or None if not cached"""
+        chunk = self._chunks.get(key)
+        if chunk is None:
+            self.misses += 1
+        else:
+            self._chunks.move_to_end(key)
+            self.hits += 1
+        return chunk
+
+    def put(self, key, chunk):
+        """Cache a read-only array if it fits in the memory limit"""
+        if chunk.nbytes > self.max_bytes:
+            return
+        chunk.flags.writeable = False
+        old = self._chunks.pop(key, None)
+        if old is not None:
+            self.nbytes -= old.nbytes
+        self._chunks[key] = chunk
+        self.nbytes += chunk.nbytes
+        while self.nbytes > self.max_bytes:
+            _, old = self._chunks.popitem(last=False)
+            self.nbytes -= old.nbytes
+
+    def info(self):
+        """Dictionary of the cache statistics"""
+        return {'hits': self.hits, 'misses': self.misses,
+                'n_chunks': len(self._chunks), 'nbytes': self.nbytes,
+                'max_bytes': self.max_bytes}
+
+
+class MinMaxPyramid(object):
+    """
+    Min/max decimation pyramid of the data table of a report variable.
+
+    Level k holds the minimum and maximum of every column over consecutive
+    bins of base * factor**k time steps. Drawing the envelope of a level
+    looks the same as drawing the full trace when a bin is no wider than a
+    pixel, with a number of points independent of the simulation length.
+    The pyramid is built in one streaming pass over blocks of time steps.
+
+    Parameters:
+        bin_sizes: List of bin sizes (time steps) of the levels, increasing.
+        mins, maxs: Lists of arrays (bins x columns) of the levels.
+    """
+    BASE = 16
+    FACTOR = 4
+    MIN_BINS = 256
+
+    def __init__(self, bin_sizes, mins, maxs):
+        self.bin_sizes = list(bin_sizes)
+        self.mins = list(mins)
+        self.maxs = list(maxs)
+
+    @classmethod
+    def build(cls, ds, base=BASE, factor=FACTOR, min_bins=MIN_BINS, block_mb=64):
+        """
+        Build the pyramid of a dataset (time steps x columns) reading blocks
+        of about block_mb MB of whole bins. Coarser levels are added until a
+        level has no more than min_bins bins.
+        """
+        n_steps, n_columns = ds.shape
+        step_bytes = max(n_columns * ds.dtype.itemsize, 1)
+        block = max(int(block_mb * 2 ** 20 // step_bytes) // base, 1) * base
+        mins, maxs = [], []
+        for t0 in range(0, n_steps, block):
+            data = ds[t0:t0 + block]
+            bins = np.arange(0, data.shape[0], base)
+            mins.append(np.minimum.reduceat(data, bins, axis=0))
+            maxs.append(np.maximum.reduceat(data, bins, axis=0))
+        empty = np.empty((0, n_columns), dtype=ds.dtype)
+        pyramid = cls([base], [np.concatenate(mins) if mins else empty],
+                      [np.concatenate(maxs) if maxs else empty])
+        while pyramid.mins[-1].shape[0] > min_bins:
+            bins = np.arange(0, pyramid.mins[-1].shape[0], factor)
+            pyramid.bin_sizes.append(pyramid.bin_sizes[-1] * factor)
+            pyramid.mins.append(np.minimum.reduceat(pyramid.mins[-1], bins, axis=0))
+            pyramid.maxs.append(np.maximum.reduceat(pyramid.maxs[-1], bins, axis=0))
+        return pyramid
+
+    def level(self, bin_size):
+        """Index of the coarsest level with bins no larger than bin_size, or
+        -1 if bin_size is smaller than the bins of all levels"""
+        return int(np.searchsorted(self.bin_sizes, bin_size, side='right')) - 1
+
+    def save(self, path, **attrs):
+        """Write the levels to a sidecar HDF5 file with attributes attrs"""
+        with h5py.File(path, 'w') as f:
+            f.attrs.update(attrs)
+            for k, bin_size in enumerate(self.bin_sizes):
+                grp = f.create_group('level_{}'.format(k))
+                grp.attrs['bin_size'] = bin_size
+                grp.create_dataset('min', data=self.mins[k])
+                grp.create_dataset('max', data=self.maxs[k])
+
+    @classmethod
+    def load(cls, path, **attrs):
+        """Read the levels from a sidecar file. Return None if the file does
+        not exist or its attributes do not match attrs."""
+        if not os.path.isfile(path):
+            return None
+        with h5py.File(path, 'r') as f:
+            if not all(np.array_equal(f.attrs.get(key), value) for key, value in attrs.items()):
+                return None
+            grps = sorted(f.values(), key=lambda grp: grp.attrs['bin_size'])
+            return cls([grp.attrs['bin_size'] for grp in grps],
+                       [grp['min'][()] for grp in grps],
+                       [grp['max'][()] for grp in grps])
+
+
 class CellVarsFile(object):
     VAR_UNKNOWN = 'Unknown'
     UNITS_UNKNOWN = 'NA'
-
-    def __init__(self, filename, mode='r', **params):
-        
+    # Default memory limit (MB) of the chunk cache
+    CACHE_MB = 64
+    # Chunk shape used for caching datasets stored without chunks
+    CONTIGUOUS_CHUNKS = (4096, 16)
+    # Reads larger than this fraction of the cache limit bypass the cache
+    CACHE_READ_FRACTION = 0.5
+
+    def __init__(self, filename, mode='r', cache_mb=CACHE_MB, n_workers=1, **params):
+        """
+        filename: Path of the report file, or a glob pattern or list of partial
+            report files (e.g., one per MPI rank) to read as one report.
+        cache_mb: Memory limit in MB of the LRU cache of decompressed chunks,
+            which serves repeated and overlapping reads. 0 disables the cache.
+        n_workers: Number of processes reading the mappings of partial files.
+        """
         import h5py
-        self._h5_handle = h5py.File(filename, 'r')
-        self._h5_root = self._h5_handle[params['h5_root']] if 'h5_root' in params else self._h5_handle['/']
+        self._files = expand_files(filename)
+        self._pyramids = {}
+        self._chunk_cache = ChunkCache(int(cache_mb * 2 ** 20)) if cache_mb else None
+        if len(self._files) == 1:
+            self._h5_handle = h5py.File(self._files[0], 'r')
+            self._h5_root = self._h5_handle[params['h5_root']] if 'h5_root' in params else self._h5_handle['/']
+        else:
+            self._h5_handle = merge_report_files(self._files, params.get('h5_root', '/'), n_workers)
+            self._h5_root = self._h5_handle['/']
         self._var_data = {}
         self._var_units = {}
 
         self._mapping = None
+        self._element_ids = None
 
         # Look for variabl and mapping groups
         for var_name in self._h5_root.keys():
@@ -77,14 +381,12 @@ class CellVarsFile(object):
                     self._var_units[var_name] = self._find_units(hf_grp['data'])
 
         # create map between gids and tables
-        self._gid2data_table = {}
         if self._mapping is None:
             raise Exception('could not find /mapping group')
         else:
-            gids_ds = self._mapping['gids']
-            index_pointer_ds = self._mapping['index_pointer']
-            for indx, gid in enumerate(gids_ds):
-                self._gid2data_table[gid] = (index_pointer_ds[indx], index_pointer_ds[indx+1])  # slice(index_pointer_ds[indx], index_pointer_ds[indx+1])
+            # Read the whole arrays at once instead of element by element
+            self._gid2data_table = GidTable(self._mapping['gids'][()],
+                                            self._mapping['index_pointer'][()])
 
             time_ds = self._mapping['time']
             self._t_start = time_ds[0]
@@ -98,7 +400,7 @@ class CellVarsFile(object):
 
     @property
     def gids(self):
-        return list(self._gid2data_table.keys())
+        return self._gid2data_table.gids.tolist()
 
     @property
     def t_start(self):
@@ -120,6 +422,15 @@ class CellVarsFile(object):
     def h5(self):
         return self._h5_root
 
+    def h5_dataset(self, var_name=VAR_UNKNOWN):
+        """HDF5 dataset of the data table (time steps x columns) of a variable"""
+        return self._var_data[var_name]
+
+    @property
+    def gid_table(self):
+        """Mapping (GidTable) of gids to their range of columns in the data tables"""
+        return self._gid2data_table
+
     def _find_units(self, data_set):
         return data_set.attrs.get('units', CellVarsFile.UNITS_UNKNOWN)
 
@@ -132,25 +443,213 @@ class CellVarsFile(object):
 
     def compartment_ids(self, gid):
         bounds = self._gid2data_table[gid]
-        return self._mapping['element_id'][bounds[0]:bounds[1]]
+        return self.element_ids[bounds[0]:bounds[1]]
 
     def compartment_positions(self, gid):
         bounds = self._gid2data_table[gid]
         return self._mapping['element_pos'][bounds[0]:bounds[1]]
 
-    def data(self, gid, var_name=VAR_UNKNOWN,time_window=None, compartments='origin'):
+    @property
+    def chunk_cache(self):
+        """Chunk cache (ChunkCache), or None if caching is disabled"""
+        return self._chunk_cache
+
+    def _read_block(self, var_name, time_slice, begin, end):
+        """
+        Read columns begin:end of a data table over a slice of time steps.
+        With the chunk cache enabled, the block is assembled from cached
+        chunks if they are all cached. Otherwise, the chunk-aligned block
+        covering it is read with one HDF5 call and its chunks are cached.
+        Blocks larger than CACHE_READ_FRACTION of the cache limit are read
+        directly, since caching them would evict the whole cache. Strided
+        slices are read directly as well, so only the selected steps are read.
+        """
+        ds = self._var_data[var_name]
+        t0, t1, step = time_slice.indices(ds.shape[0])
+        cache = self._chunk_cache
+        if cache is None or step != 1 or t1 <= t0 or end <= begin:
+            return ds[t0:t1:step, begin:end]
+        ct, cc = ds.chunks or self.CONTIGUOUS_CHUNKS
+        rows = range(t0 // ct, (t1 - 1) // ct + 1)
+        cols = range(begin // cc, (end - 1) // cc + 1)
+        T0, C0 = rows[0] * ct, cols[0] * cc
+        T1 = min(rows[-1] * ct + ct, ds.shape[0])
+        C1 = min(cols[-1] * cc + cc, ds.shape[1])
+        nbytes = (T1 - T0) * (C1 - C0) * ds.dtype.itemsize
+        if nbytes > self.CACHE_READ_FRACTION * cache.max_bytes:
+            return ds[t0:t1, begin:end]
+        keys = [(var_name, i, j) for i in rows for j in cols]
+        chunks = [cache.get(key) for key in keys]
+        if any(chunk is None for chunk in chunks):
+            block = ds[T0:T1, C0:C1]
+            for key in keys:
+                i, j = key[1] * ct - T0, key[2] * cc - C0
+                cache.put(key, block[i:i + ct, j:j + cc].copy())
+            return block[t0 - T0:t1 - T0, begin - C0:end - C0]
+        data = np.empty((t1 - t0, end - begin), dtype=ds.dtype)
+        for (_, i, j), chunk in zip(keys, chunks):
+            ta, tb = max(t0, i * ct), min(t1, i * ct + ct)
+            ca, cb = max(begin, j * cc), min(end, j * cc + cc)
+            data[ta - t0:tb - t0, ca - begin:cb - begin] = \
+                chunk[ta - i * ct:tb - i * ct, ca - j * cc:cb - j * cc]
+        return data
+
+    @property
+    def element_ids(self):
+        """Element ids of all columns of the data tables (read once)"""
+        if self._element_ids is None:
+            self._element_ids = self._mapping['element_id'][()]
+        return self._element_ids
+
+    def _time_index(self, t):
+        """Index of the time step at time t, tolerating float rounding"""
+        return int(np.floor((t - self.t_start) / self.dt + 1e-6))
+
+    def _time_slice(self, time_window=None):
+        """Slice of time steps in a time window [begin, end]"""
+        if time_window is None:
+            return slice(0, self._n_steps)
+        if len(time_window) != 2:
+            raise Exception('Invalid time_window, expecting tuple [being, end].')
+
+        window_beg = min(max(self._time_index(time_window[0]), 0), self._n_steps)
+        window_end = min(max(self._time_index(time_window[1]), window_beg), self._n_steps)
+        return slice(window_beg, window_end)
+
+    def _select_columns(self, gids, compartments='origin'):
+        """
+        Columns of the data tables of gids given the compartments to select.
+        Returns an array of columns, in the order of gids, and an index pointer
+        such that columns of gids[i] are in range index[i]:index[i+1]. Gids not
+        in the report have no columns.
+        """
+        table = self._gid2data_table
+        idx = table.index(np.asarray(gids, dtype=table.gids.dtype).ravel())
+        found = idx >= 0
+        begins = np.where(found, table.begins[idx], 0)
+        ends = np.where(found, table.ends[idx], 0)
+        if compartments == 'origin':
+            # The first (and possibly only) compartment of each gid
+            ends = np.where(found, begins + 1, 0)
+        counts = ends - begins
+        index = np.concatenate(([0], np.cumsum(counts)))
+        columns = np.repeat(begins - index[:-1], counts) + np.arange(index[-1])
+        if compartments not in ('origin', 'all'):
+            # Compartments with corresponding element ids
+            mask = np.isin(self.element_ids[columns], np.atleast_1d(compartments))
+            columns = columns[mask]
+            index = np.concatenate(([0], np.cumsum(mask)))[index]
+        return columns, index
+
+    def read_columns(self, var_name, time_slice, columns):
+        """
+        Read columns of a data table over a slice of time steps. The sorted
+        unique columns are coalesced into runs, where consecutive columns are
+        adjacent or in the same chunk of the dataset, and each run is read with
+        one HDF5 call. Returns array of shape (time steps, columns).
+        """
+        ds = self._var_data[var_name]
+        columns, inverse = np.unique(columns, return_inverse=True)
+        n_steps = len(range(*time_slice.indices(ds.shape[0])))
+        data = np.empty((n_steps, columns.size), dtype=ds.dtype)
+        if columns.size:
+            chunk = ds.chunks[1] if ds.chunks else 1
+            split = np.flatnonzero((np.diff(columns) > 1) &
+                                   (columns[1:] // chunk != columns[:-1] // chunk)) + 1
+            starts = np.concatenate(([0], split))
+            stops = np.concatenate((split, [columns.size]))
+            for i, j in zip(starts, stops):
+                begin = columns[i]
+                run = self._read_block(var_name, time_slice, begin, columns[j - 1] + 1)
+                data[:, i:j] = run[:, columns[i:j] - begin]
+        return data[:, inverse.ravel()]
+
+    def data_many(self, gids, var_name=VAR_UNKNOWN, time_window=None, compartments='origin'):
+        """
+        Read data of multiple gids at once.
+        gids: list of gids.
+        compartments: 'origin' for the first compartment of each gid, 'all' for
+            all compartments, or element ids of the compartments to select.
+        Returns an array of shape (time steps, selected columns), where columns
+        are in the order of gids, and an index pointer array such that columns
+        of gids[i] are data[:, index[i]:index[i+1]]. Gids not in the report
+        have no columns.
+        """
         if var_name not in self.variables:
             raise Exception('Unknown variable {}'.format(var_name))
+        columns, index = self._select_columns(gids, compartments)
+        data = self.read_columns(var_name, self._time_slice(time_window), columns)
+        return data, index
 
-        if time_window is None:
-            time_slice = slice(0, self._n_steps)
+    def pyramid(self, var_name=VAR_UNKNOWN, pyramid_file=None):
+        """
+        Min/max decimation pyramid (MinMaxPyramid) of a variable, built on
+        first use in a streaming pass and kept in memory.
+        pyramid_file: Path of a sidecar HDF5 file. The pyramid is read from it
+            if it was built from the same report file, otherwise it is built
+            and written to it.
+        """
+        if var_name not in self.variables:
+            raise Exception('Unknown variable {}'.format(var_name))
+        pyramid = self._pyramids.get(var_name)
+        if pyramid is None:
+            ds = self._var_data[var_name]
+            attrs = {'variable': var_name, 'shape': ds.shape,
+                     'source_mtime': max(os.path.getmtime(f) for f in self._files)}
+            if pyramid_file is not None:
+                pyramid = MinMaxPyramid.load(pyramid_file, **attrs)
+            if pyramid is None:
+                pyramid = MinMaxPyramid.build(ds)
+                if pyramid_file is not None:
+                    pyramid.save(pyramid_file, **attrs)
+            self._pyramids[var_name] = pyramid
+        return pyramid
+
+    def envelope(self, gids, var_name=VAR_UNKNOWN, time_window=None, max_points=1000,
+                 compartments='origin', pyramid_file=None):
+        """
+        Min/max envelope of data of multiple gids over a time window, with
+        between max_points and a few times max_points time bins, taken from
+        the level of the pyramid matching the window. Short windows and
+        windows finer than the pyramid are read and decimated directly.
+        Returns arrays of time of the bins, minimums and maximums, both of
+        shape (time bins, columns), and the index pointer of the columns of
+        gids (see data_many). If the window has no more than max_points time
+        steps, data is returned as is, with minimums and maximums the same.
+        """
+        if var_name not in self.variables:
+            raise Exception('Unknown variable {}'.format(var_name))
+        time_slice = self._time_slice(time_window)
+        columns, index = self._select_columns(gids, compartments)
+        n_steps = time_slice.stop - time_slice.start
+        time_trace = self.time_trace
+        if n_steps <= max_points:
+            data = self.read_columns(var_name, time_slice, columns)
+            return time_trace[time_slice], data, data, index
+        bin_size = n_steps // max_points
+        pyramid = self.pyramid(var_name, pyramid_file)
+        level = pyramid.level(bin_size)
+        if level < 0:
+            data = self.read_columns(var_name, time_slice, columns)
+            bins = np.arange(0, n_steps, bin_size)
+            mins = np.minimum.reduceat(data, bins, axis=0)
+            maxs = np.maximum.reduceat(data, bins, axis=0)
+            starts = time_slice.start + bins
         else:
-            if len(time_window) != 2:
-                raise Exception('Invalid time_window, expecting tuple [being, end].')
+            bin_size = pyramid.bin_sizes[level]
+            b0 = time_slice.start // bin_size
+            b1 = -(-time_slice.stop // bin_size)
+            mins = pyramid.mins[level][b0:b1, columns]
+            maxs = pyramid.maxs[level][b0:b1, columns]
+            starts = np.arange(b0, b0 + mins.shape[0]) * bin_size
+        time = time_trace[np.minimum(starts + bin_size // 2, time_trace.size - 1)]
+        return time, mins, maxs, index
+
+    def data(self, gid, var_name=VAR_UNKNOWN,time_window=None, compartments='origin'):
+        if var_name not in self.variables:
+            raise Exception('Unknown variable {}'.format(var_name))
 
-            window_beg = max(int((time_window[0] - self.t_start)/self.dt), 0)
-            window_end = min(int((time_window[1] - self.t_start)/self.dt), self._n_steps/self.dt)
-            time_slice = slice(window_beg, window_end)
+        time_slice = self._time_slice(time_window)
 
         multi_compartments = True
         if compartments == 'origin' or self.n_compartments(gid) == 1:
@@ -162,12 +661,16 @@ class CellVarsFile(object):
             gid_slice = slice(self._gid2data_table[gid][0], self._gid2data_table[gid][1])
         else:
             # return all compartments with corresponding element id
-            compartment_list = list(compartments) if isinstance(compartments, (long, int)) else compartments
-            begin = self._gid2data_table[gid][0]
-            end = self._gid2data_table[gid][1]
-            gid_slice = [i for i in range(begin, end) if self._mapping[i] in compartment_list]
-
-        data = np.array(self._var_data[var_name][time_slice, gid_slice])
+            begin, end = self._gid2data_table[gid]
+            mask = np.isin(self.element_ids[begin:end], np.atleast_1d(compartments))
+            gid_slice = begin + np.flatnonzero(mask)
+
+        if isinstance(gid_slice, slice):
+            data = self._read_block(var_name, time_slice, gid_slice.start, gid_slice.stop)
+        elif isinstance(gid_slice, np.ndarray):
+            data = self.read_columns(var_name, time_slice, gid_slice)
+        else:
+            data = self._read_block(var_name, time_slice, gid_slice, gid_slice + 1)[:, 0]
         return data.T if multi_compartments else data
     
 def load_config(config_file):
@@ -1061,43 +1564,37 @@ def connection_divergence_average_old(config=None, nodes=None, edges=None,popula
 class EdgeVarsFile(CellVarsFile):
     def __init__(self, filename, mode='r', **params):
         super().__init__(filename, mode, **params)
-        self._var_src_ids = []
-        self._var_trg_ids = []
-        for var_name in self._h5_root['mapping'].keys():
-            if var_name == 'src_ids':
-                self._var_src_ids = list(self._h5_root['mapping']['src_ids'])
-            if var_name == 'trg_ids':
-                self._var_trg_ids = list(self._h5_root['mapping']['trg_ids'])
+        mapping = self._h5_root['mapping']
+        # Read the whole arrays at once instead of element by element
+        self._var_src_ids = mapping['src_ids'][()] if 'src_ids' in mapping else np.array([], dtype=int)
+        self._var_trg_ids = mapping['trg_ids'][()] if 'trg_ids' in mapping else np.array([], dtype=int)
     def sources(self,target_gid=None):
-        if target_gid:
+        if target_gid is not None:
             tb = self._gid2data_table[target_gid]
-            return self._h5_root['mapping']['src_ids'][tb[0]:tb[1]]
+            return self._var_src_ids[tb[0]:tb[1]]
         else:
-            return self._var_src_ids
+            return self._var_src_ids.tolist()
     def targets(self):
-        return self._var_trg_ids
+        return self._var_trg_ids.tolist()
     def data(self,gid,var_name=CellVarsFile.VAR_UNKNOWN,time_window=None,compartments='origin',sources=None):
         d = super().data(gid,var_name,time_window,compartments)
         if not sources:
             return d
         else:
-            if type(sources) is int:
-                sources = [sources]
-            d_new = None
-            for dl, s in zip(d, self.sources()):
-                if s in sources:
-                    if d_new is None:
-                        d_new = np.array([dl])
-                    else:
-                        d_new = np.append(d_new, [dl],axis=0)
-            if d_new is None:
-                d_new = np.array([])            
-            return d_new
+            # Sources of the rows returned for this gid
+            if compartments != 'origin' and self.n_compartments(gid) == 1:
+                compartments = 'origin'
+            columns, _ = self._select_columns([gid], compartments)
+            mask = np.isin(self._var_src_ids[columns], sources)
+            return d.reshape(columns.size, -1)[mask]
 
 
 def get_synapse_vars(config,report,var_name,target_gids,source_gids=None,compartments='all',var_report=None,time=None,time_compare=None):
     """
     Ex: data, sources = get_synapse_vars('9999_simulation_config.json', 'syn_report', 'W_ampa', 31)
+    The rows of all target gids are fetched with batched reads. Returns arrays
+    of data (synapses x time steps, or a single column if time is given),
+    source gids and target gids of the synapses.
     """
     if not var_report:
         cfg = load_config(config)
@@ -1105,50 +1602,27 @@ def get_synapse_vars(config,report,var_name,target_gids,source_gids=None,compart
         report_file = report # Same difference
         var_report = EdgeVarsFile(os.path.join(cfg['output']['output_dir'],report_file+'.h5'))
 
-    if type(target_gids) is int:
-        target_gids = [target_gids]
-    
-    data_ret = None
-    sources_ret = None
-    targets_ret = None
-    
-    for target_gid in target_gids:
-        if not var_report._gid2data_table.get(target_gid):#This cell was not reported
-            continue
-        data = var_report.data(gid=target_gid, var_name=var_name, compartments=compartments)
-        if(len(data.shape)==1):
-            data = data.reshape(1,-1)
-
-        if time is not None and time_compare is not None:
-            data = np.array(data[:,time_compare] - data[:,time]).reshape(-1,1)
-        elif time is not None:
-            data = np.delete(data,np.s_[time+1:],1)
-            data = np.delete(data,np.s_[:time],1)
-
-        sources = var_report.sources(target_gid=target_gid)
-        if source_gids:
-            if type(source_gids) is int:
-                source_gids = [source_gids]
-            data = [d for d,s in zip(data,sources) if s in source_gids]
-            sources = [s for s in sources if s in source_gids]
-            
-        targets = np.zeros(len(sources))
-        targets.fill(target_gid)
+    if var_name not in var_report.variables:
+        raise Exception('Unknown variable {}'.format(var_name))
 
-        if data_ret is None or data_ret is not None and len(data_ret)==0:
-            data_ret = data
-        else:
-            data_ret = np.append(data_ret, data,axis=0)
-        if sources_ret is None or sources_ret is not None and len(sources_ret)==0:
-            sources_ret = sources
-        else:
-            sources_ret = np.append(sources_ret, sources,axis=0)
-        if targets_ret is None or targets_ret is not None and len(targets_ret)==0:
-            targets_ret = targets
-        else:
-            targets_ret = np.append(targets_ret, targets,axis=0)
+    target_gids = np.atleast_1d(target_gids)
+    columns, index = var_report._select_columns(target_gids, compartments)
+    targets = np.repeat(target_gids, np.diff(index)).astype(float)
+    sources = var_report._var_src_ids[columns]
 
-    return np.array(data_ret), np.array(sources_ret), np.array(targets_ret)
+    if source_gids:
+        mask = np.isin(sources, source_gids)
+        columns, sources, targets = columns[mask], sources[mask], targets[mask]
+
+    if time is not None and time_compare is not None:
+        data = (var_report.read_columns(var_name, slice(time_compare, time_compare + 1), columns)
+                - var_report.read_columns(var_name, slice(time, time + 1), columns))
+    elif time is not None:
+        data = var_report.read_columns(var_name, slice(time, time + 1), columns)
+    else:
+        data = var_report.read_columns(var_name, var_report._time_slice(), columns)
+
+    return data.T, sources, targets
 
 
 def tk_email_input(title="Send Model Files (with simplified GUI)",prompt="Enter your email address. (CHECK YOUR SPAM FOLDER)"):
@@ -1274,6 +1748,26 @@ def load_I_clamp_from_config(fp):
                 raise Exception('No information found about this current clamp.')
     return ICLAMPS
 
+def spikes_in_window(spikes_df, t_start=None, t_stop=None, include_start=True):
+    """
+    Spikes of a DataFrame with timestamps in the time window t_start <= t < t_stop
+    (t_start < t if include_start is False). DataFrames sorted by timestamps,
+    e.g., from load_spikes_to_df, are sliced with a binary search instead of
+    masking every row.
+    """
+    timestamps = spikes_df['timestamps']
+    if timestamps.is_monotonic_increasing:
+        values = timestamps.values
+        begin = 0 if t_start is None else np.searchsorted(values, t_start, 'left' if include_start else 'right')
+        end = values.size if t_stop is None else np.searchsorted(values, t_stop, 'left')
+        return spikes_df.iloc[begin:end]
+    mask = np.ones(len(spikes_df), dtype=bool)
+    if t_start is not None:
+        mask &= (timestamps >= t_start).values if include_start else (timestamps > t_start).values
+    if t_stop is not None:
+        mask &= (timestamps < t_stop).values
+    return spikes_df[mask]
+
 def load_inspikes_from_paths(inspike_paths):
     # Get info from .h5 files
     if inspike_paths.endswith('.h5'):
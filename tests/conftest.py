@@ -0,0 +1,144 @@
+"""
+Shared helpers of the tests. Node pools and report files are synthesized
+like in benchmarks/bench_connectors.py, so no BMTK network needs to be built.
+"""
+import h5py
+import numpy as np
+import pytest
+
+
+class Node(dict):
+    """Node object with node_id attribute and properties like BMTK nodes"""
+
+    def __init__(self, node_id, **properties):
+        super().__init__(node_id=node_id, **properties)
+        self.node_id = node_id
+
+
+class NodePool(object):
+    """Minimal stand-in of BMTK NodePool used by the connectors"""
+
+    def __init__(self, nodes, name):
+        self.nodes = nodes
+        self.network_name = 'test'
+        self.filter_str = "pop_name=='%s'" % name
+        self._NodePool__properties = {'pop_name': name}
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+def make_pool(n, name='A', first_id=0, seed=0, size=300.):
+    """Node pool of n cells at random positions in a cube"""
+    positions = size * np.random.default_rng(seed).random((n, 3))
+    nodes = [Node(first_id + i, positions=positions[i], pop_name=name)
+             for i in range(n)]
+    return NodePool(nodes, name)
+
+
+def run_rule(params):
+    """Call the connection rule for all nodes like the BMTK iterators, which
+    read the values returned before the next call. Return the matrix of
+    number of synapses, rows for params['source']."""
+    rule = params['connection_rule']
+    sources = list(params['source'])
+    targets = list(params['target'])
+    if params['iterator'] == 'one_to_all':
+        nsyns = [np.array(rule(source, targets)) for source in sources]
+    else:
+        nsyns = np.transpose([np.array(rule(sources, target))
+                              for target in targets])
+    return np.asarray(nsyns, dtype=int).reshape(len(sources), len(targets))
+
+
+@pytest.fixture
+def pools():
+    """Source and target node pools"""
+    return make_pool(40, 'A', 0, seed=1), make_pool(30, 'B', 40, seed=2)
+
+
+def cell_report(path, n=60, steps=1000, dt=0.1, chunks=(128, 16), seed=0):
+    """Write a cell report of n cells with 1 to 7 compartments in random gid
+    order, with variables 'v' and 'cai'. Return gids, index pointer, data."""
+    rng = np.random.default_rng(seed)
+    gids = rng.permutation(np.arange(1000, 1000 + n))
+    ip = np.concatenate(([0], np.cumsum(rng.integers(1, 8, size=n))))
+    element_ids = np.concatenate([np.arange(k) for k in np.diff(ip)])
+    data = rng.standard_normal((steps, ip[-1])).cumsum(axis=0)
+    with h5py.File(path, 'w') as f:
+        mapping = f.create_group('mapping')
+        mapping['gids'] = gids
+        mapping['index_pointer'] = ip
+        mapping['element_id'] = element_ids
+        mapping['element_pos'] = rng.random(ip[-1])
+        mapping['time'] = [0., steps * dt, dt]
+        f.create_dataset('v/data', data=data, chunks=chunks)
+        f['v/data'].attrs['units'] = 'mV'
+        f.create_dataset('cai/data', data=1e-3 * data, chunks=chunks)
+    return gids, ip, data
+
+
+def edge_report(path, n=20, steps=200, dt=0.1, seed=0):
+    """Write a synapse report of n target cells including gid 0 with source
+    ids in [100, 120). Return gids, index pointer, source ids, data."""
+    rng = np.random.default_rng(seed)
+    gids = np.arange(n)
+    ip = np.concatenate(([0], np.cumsum(rng.integers(1, 10, size=n))))
+    src_ids = rng.integers(100, 120, size=ip[-1])
+    data = rng.random((steps, ip[-1]))
+    with h5py.File(path, 'w') as f:
+        mapping = f.create_group('mapping')
+        mapping['gids'] = gids
+        mapping['index_pointer'] = ip
+        mapping['element_id'] = np.zeros(ip[-1], dtype=int)
+        mapping['element_pos'] = np.zeros(ip[-1])
+        mapping['time'] = [0., steps * dt, dt]
+        mapping['src_ids'] = src_ids
+        mapping['trg_ids'] = np.repeat(gids, np.diff(ip))
+        f.create_dataset('W_ampa/data', data=data, chunks=(64, 16))
+    return gids, ip, src_ids, data
+
+
+def split_report(path, n, prefix):
+    """Split a report into n partial files by cells like MPI ranks write.
+    Return the paths of the partial files."""
+    paths = []
+    with h5py.File(path, 'r') as f:
+        mapping = f['mapping']
+        gids, ip = mapping['gids'][()], mapping['index_pointer'][()]
+        for rank, idx in enumerate(np.array_split(np.arange(gids.size), n)):
+            c0, c1 = ip[idx[0]], ip[idx[-1] + 1]
+            paths.append('%s%d.h5' % (prefix, rank))
+            with h5py.File(paths[-1], 'w') as part:
+                part_map = part.create_group('mapping')
+                part_map['gids'] = gids[idx]
+                part_map['index_pointer'] = ip[idx[0]:idx[-1] + 2] - c0
+                part_map['time'] = mapping['time'][()]
+                for key in ('element_id', 'element_pos', 'src_ids',
+                            'trg_ids'):
+                    if key in mapping:
+                        part_map[key] = mapping[key][c0:c1]
+                for key, grp in f.items():
+                    if key != 'mapping':
+                        ds = part.create_dataset(
+                            key + '/data', data=grp['data'][:, c0:c1],
+                            chunks=True)
+                        ds.attrs.update(grp['data'].attrs)
+    return paths
+
+
+@pytest.fixture
+def cell_report_file(tmp_path):
+    """Path of a cell report and its gids, index pointer and data"""
+    path = str(tmp_path / 'v_report.h5')
+    return (path, ) + cell_report(path)
+
+
+@pytest.fixture
+def edge_report_file(tmp_path):
+    """Path of a synapse report and its gids, index pointer, sources, data"""
+    path = str(tmp_path / 'syn_report.h5')
+    return (path, ) + edge_report(path)
@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import cell_report
+from bmtool.analysis import reports
+
+
+def cell_nodes(gids):
+    """Node table with populations by gid"""
+    pop_name = np.where(np.asarray(gids) % 3 == 0, 'PV', 'PN')
+    return pd.DataFrame({'pop_name': pop_name}, index=pd.Index(gids, name='node_id'))
+
+
+# Population statistics
+def test_population_stats_match_direct_computation(cell_report_file):
+    path, gids, ip, data = cell_report_file
+    nodes = cell_nodes(gids)
+    stats = reports.population_stats(path, 'v', nodes=nodes, time_window=(10., 60.),
+                                      quantiles=[0.1, 0.5, 0.9], quantile_sample=10 ** 4,
+                                      block_mb=0.01)
+    columns = np.repeat(nodes.loc[gids, 'pop_name'].to_numpy(), np.diff(ip))
+    window = data[100:600]
+    assert stats['time'].values[0] == pytest.approx(10.)
+    assert list(stats['group'].values) == ['PN', 'PV']
+    for group in ('PN', 'PV'):
+        values = window[:, columns == group]
+        s = stats.sel(group=group)
+        assert s['count'].item() == values.shape[1]
+        assert np.allclose(s['mean'], values.mean(axis=1))
+        assert np.allclose(s['std'], values.std(axis=1))
+        assert np.array_equal(s['min'], values.min(axis=1))
+        assert np.array_equal(s['max'], values.max(axis=1))
+        # Quantiles are exact when the groups are smaller than the sample
+        assert np.allclose(s['quantiles'], np.quantile(values, [0.1, 0.5, 0.9], axis=1))
+
+
+def test_population_stats_sampled_quantiles(cell_report_file):
+    path, gids, ip, data = cell_report_file
+    nodes = cell_nodes(gids)
+    stats = reports.population_stats(path, 'v', nodes=nodes, quantiles=[0., 0.5, 1.],
+                                      quantile_sample=20, block_mb=0.01, seed=1)
+    again = reports.population_stats(path, 'v', nodes=nodes, quantiles=[0., 0.5, 1.],
+                                     quantile_sample=20, block_mb=1, seed=1)
+    # The sample does not depend on the blocks read
+    assert np.array_equal(stats['quantiles'], again['quantiles'])
+    columns = np.repeat(nodes.loc[gids, 'pop_name'].to_numpy(), np.diff(ip))
+    for group in ('PN', 'PV'):
+        s = stats.sel(group=group)
+        values = data[:, columns == group]
+        # Each time step of the sample is a subset of 20 elements of the group
+        q0, q1 = s['quantiles'].sel(quantile=0.), s['quantiles'].sel(quantile=1.)
+        assert np.all(q0 >= s['min']) and np.all(q1 <= s['max'])
+        rank = (values < q1.values[:, None]).sum(axis=1)
+        assert np.all(rank >= 19)
+
+
+# Lazy xarray views of reports
+def test_lazy_report_matches_direct_reads(cell_report_file):
+    path, gids, ip, data = cell_report_file
+    view = reports.load_report_to_xarray(path, 'v')
+    assert view.shape == data.shape and view.attrs['units'] == 'mV'
+    assert np.array_equal(view['gid'], np.repeat(gids, np.diff(ip)))
+    assert np.allclose(view['time'], 0.1 * np.arange(data.shape[0]))
+    assert np.array_equal(view.values, data)
+
+    # Selections read only the selected steps and elements
+    columns = [ip[5], 0, ip[5] + 1, 40]
+    steps = [7, 3, 500, 501]
+    assert np.array_equal(view.isel(time=slice(100, 300), element=columns), data[100:300, columns])
+    assert np.array_equal(view.isel(time=steps, element=slice(10, 30)), data[steps, 10:30])
+    assert view.isel(time=42, element=ip[3]).item() == data[42, ip[3]]
+    selected = view.where(view['gid'] == gids[5], drop=True)
+    assert np.array_equal(selected, data[:, ip[5]:ip[6]])
+    cai = reports.load_report_to_xarray(reports.open_report(path), 'cai')
+    assert np.array_equal(cai.isel(time=slice(0, 10)), 1e-3 * data[:10])
+
+    # Streaming by blocks of time steps
+    blocks = list(reports.iter_time_blocks(view.isel(element=columns), block_steps=128))
+    assert [block.sizes['time'] for block in blocks] == [128] * 7 + [104]
+    assert np.array_equal(np.concatenate(blocks), data[:, columns])
+
+
+def test_lazy_report_reads_only_selected_steps(tmp_path):
+    path = str(tmp_path / 'long_report.h5')
+    gids, ip, data = cell_report(path, n=10, steps=20000)
+    report = reports.open_report(path)
+    rows = []
+    read_block = report._read_block
+
+    def counted_read_block(*args):
+        block = read_block(*args)
+        rows.append(block.shape[0])
+        return block
+    report._read_block = counted_read_block
+    view = reports.load_report_to_xarray(report, 'v')
+
+    columns = [ip[2], 0, 5]
+    strided = view.isel(time=slice(None, None, 1000), element=columns)
+    assert np.array_equal(strided.values, data[::1000, columns])
+    assert sum(rows) == 20
+    rows.clear()
+    assert np.array_equal(view.isel(time=[19999, 0]).values, data[[19999, 0]])
+    assert sum(rows) == 2
+    # Steps in the same chunk are read as one range, then put in order
+    rows.clear()
+    steps = [9, 5000, 5, 9, 19998]
+    assert np.array_equal(view.isel(time=steps, element=columns).values, data[steps][:, columns])
+    assert sorted(rows) == [1, 1, 5]
+    assert np.array_equal(view.isel(time=slice(30, 10, -3)).values, data[30:10:-3])
+    assert view.isel(time=-1, element=ip[4]).item() == data[-1, ip[4]]
+
+
+def test_chunked_report_reductions(cell_report_file):
+    pytest.importorskip('dask')
+    path, gids, ip, data = cell_report_file
+    chunked = reports.load_report_to_xarray(path, 'v', chunks=True)
+    assert np.allclose(chunked.mean('time').values, data.mean(axis=0))
+
+
+def test_lazy_synapse_report_matches_direct_reads(edge_report_file):
+    path, gids, ip, src_ids, data = edge_report_file
+    view = reports.load_report_to_xarray(path)
+    assert view.name == 'W_ampa'
+    assert np.array_equal(view['source_id'], src_ids)
+    assert np.array_equal(view['gid'], np.repeat(gids, np.diff(ip)))
+    selected = view.isel(time=slice(50, 60)).where(view['source_id'] == 105, drop=True)
+    assert np.array_equal(selected, data[50:60, src_ids == 105])
@@ -0,0 +1,39 @@
+import importlib.util
+import json
+import os
+
+import pytest
+
+BENCH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                     'benchmarks', 'bench_connectors.py')
+
+
+@pytest.fixture
+def bench():
+    spec = importlib.util.spec_from_file_location('bench_connectors', BENCH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_benchmark_records(bench, tmp_path, capsys):
+    output = str(tmp_path / 'bench.json')
+    argv = ['--sizes', '60', '--repeat', '1', '--no-memory', '--density', '1e-5',
+            '--k', '5', '--output', output]
+    out = bench.main(argv)
+    with open(output) as f:
+        assert json.load(f)['results'] == json.loads(json.dumps(out['results']))
+    records = {(r['connector'], r['probability']): r for r in out['results']}
+    # Every connector with each applicable probability function
+    assert set(records) == {(name, prob) for name in bench.CONNECTORS
+                            for prob in bench.PROBABILITIES
+                            if (prob != 'nrr' or name == 'reciprocal')
+                            and (prob == 'uniform' or name != 'one_to_one')}
+    assert records[('one_to_one', 'uniform')]['n_conn'] == 60
+    assert records[('fixed_degree', 'uniform')]['n_conn'] <= 60 * 5
+    for record in out['results']:
+        assert record['n_conn'] >= 0 and record['time'] > 0
+        assert record['stages']
+
+    bench.main(argv[:-2] + ['--connectors', 'gap', '--compare', output])
+    assert 'gap' in capsys.readouterr().out.splitlines()[-1]
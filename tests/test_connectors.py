@@ -0,0 +1,585 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from bmtool import connectors as conn
+from conftest import make_pool, run_rule
+
+
+def gaussian():
+    return conn.GaussianDropoff(stdev=100., max_dist=300., pmax=0.3)
+
+
+# Estimation (dry run)
+def test_estimate_has_no_side_effects(pools):
+    connector = conn.UnidirectionConnector(
+        p=gaussian(), p_arg=conn.spherical_dist, verbose=False,
+        save_report=False, seed=1)
+    connector.setup_nodes(*pools)
+    state = dict(connector.__dict__)
+    vars_ = dict(connector.vars)
+    est = connector.estimate(n_sample=500, seed=0)
+    assert est['n_pair'] == 40 * 30
+    assert connector.vars == vars_
+    assert connector.__dict__.keys() == state.keys()
+    assert all(connector.__dict__[k] is v for k, v in state.items())
+
+    # Built connections are the same as without estimating
+    built = run_rule(connector.edge_params())
+    fresh = conn.UnidirectionConnector(
+        p=gaussian(), p_arg=conn.spherical_dist, verbose=False,
+        save_report=False, seed=1)
+    fresh.setup_nodes(*pools)
+    assert np.array_equal(built, run_rule(fresh.edge_params()))
+
+
+def test_estimate_after_build_is_refused(pools):
+    connector = conn.UnidirectionConnector(
+        p=0.2, verbose=False, save_report=False, seed=1)
+    connector.setup_nodes(*pools)
+    built = run_rule(connector.edge_params())
+    with pytest.raises(ValueError, match="already built"):
+        connector.estimate(n_sample=100)
+    df = conn.estimate_connectors([connector], n_sample=100, verbose=False)
+    assert conn.connector_name(connector) not in df.index
+    # Connections built are kept
+    assert connector.conn_store.finalized
+    assert len(connector.conn_store) == np.count_nonzero(built)
+
+    # Node lists are freed after building reciprocal connections
+    connector = conn.ReciprocalConnector(
+        p0=0.2, verbose=False, save_report=False, seed=1)
+    connector.setup_nodes(*pools)
+    forward, backward = connector.edge_params(), connector.edge_params()
+    run_rule(forward)
+    run_rule(backward)
+    assert connector.source_list is None
+    with pytest.raises(ValueError, match="already built"):
+        connector.estimate(n_sample=100)
+
+
+def test_estimate_matches_expected_count(pools):
+    connector = conn.ReciprocalConnector(
+        p0=0.1, pr=0.05, verbose=False, save_report=False, seed=1)
+    connector.setup_nodes(pools[0], pools[0])
+    est = connector.estimate(n_sample=100000, seed=0)
+    n_pair = 40 * 39 // 2
+    assert est['n_pair'] == n_pair
+    assert est['n_conn'] == pytest.approx(2 * 0.1 * n_pair, rel=0.05)
+    assert est['n_recp'] == pytest.approx(0.05 * n_pair, rel=0.1)
+
+
+def test_correlated_gap_junction_initialize_is_idempotent():
+    pool = make_pool(40, 'A', seed=3)
+    reference = conn.ReciprocalConnector(
+        p0=0.2, pr=0.1, p0_arg=conn.spherical_dist, verbose=False,
+        save_report=False, seed=1)
+    reference.setup_nodes(pool, pool)
+    run_rule(reference.edge_params())
+
+    def correlated(**kwargs):
+        connector = conn.CorrelatedGapJunction(
+            p_non=0.1, p_uni=0.3, p_rec=0.6, connector=reference,
+            verbose=False, save_report=False, seed=2, **kwargs)
+        connector.setup_nodes(pool, pool)
+        return connector
+
+    connector = correlated()
+    assert not connector.has_p_arg
+    assert connector.p_arg_function() is conn.spherical_dist
+    connector.estimate(n_sample=200, seed=0)
+    connector.initialize()
+    assert not connector.has_p_arg
+    assert connector.vars['p_arg'] is None
+    token = connector.cache_params()['p_arg']
+    assert token is conn.spherical_dist
+
+    # Estimating does not change the connections built
+    built = run_rule(connector.edge_params())
+    assert np.array_equal(built, run_rule(correlated().edge_params()))
+    assert correlated(p_arg=conn.spherical_dist).has_p_arg
+
+
+# Connection reports
+def test_report_written_when_connector_finishes(pools, tmp_path):
+    assert conn.report_name == 'conn.csv'
+    csv_path, h5_path = str(tmp_path / 'conn.csv'), str(tmp_path / 'conn.h5')
+    built = {}
+    for path in (csv_path, h5_path):
+        connector = conn.UnidirectionConnector(
+            p=0.2, verbose=False, report_name=path, seed=1)
+        connector.setup_nodes(*pools)
+        built[path] = run_rule(connector.edge_params())
+        assert os.path.exists(path)
+    assert np.array_equal(built[csv_path], built[h5_path])
+    n_conn = np.count_nonzero(built[h5_path])
+
+    df = conn.read_connection_report(h5_path)
+    assert df['connection_type'].tolist() == ['unidirection']
+    assert df['n_pair'].tolist() == [40 * 30]
+    assert df['n_conn_forward'].tolist() == [n_conn]
+    assert df['percent_all_forward'][0] == pytest.approx(
+        100. * n_conn / (40 * 30))
+    assert conn.report_percentages(df) == [[df['percent_possible_forward'][0]]]
+
+    # Legacy CSV report has the same columns as before
+    legacy = conn.read_connection_report(csv_path)
+    assert legacy.columns.tolist() == [
+        "Source", "Target",
+        "Percent connectionivity within possible connections",
+        "Percent connectionivity within all connections"]
+    assert legacy.iloc[0, 0] == df['source'][0]
+    assert legacy.iloc[0, 3] == pytest.approx(df['percent_all_forward'][0])
+
+
+def test_correlated_gap_junction_report(tmp_path):
+    pool = make_pool(30, 'A', seed=3)
+    reference = conn.ReciprocalConnector(
+        p0=0.2, verbose=False, save_report=False, seed=1)
+    reference.setup_nodes(pool, pool)
+    run_rule(reference.edge_params())
+    path = str(tmp_path / 'gap.h5')
+    connector = conn.CorrelatedGapJunction(
+        p_non=0.1, p_uni=0.3, p_rec=0.6, connector=reference, verbose=False,
+        report_name=path, seed=2)
+    connector.setup_nodes(pool, pool)
+    built = run_rule(connector.edge_params())
+    df = conn.read_connection_report(path)
+    assert df['connection_type'].tolist() == ['gap']
+    assert df['n_conn_forward'].tolist() == [np.count_nonzero(built)]
+    assert not np.any(np.tril(built))
+
+
+def pair_distances(pool):
+    """Matrix of spherical distances between the nodes of a pool"""
+    positions = np.array([node['positions'] for node in pool])
+    return np.linalg.norm(positions[:, None] - positions, axis=-1)
+
+
+# Gap junctions over the upper triangle
+def test_gap_junction_deterministic_probability():
+    pool = make_pool(50, 'A', seed=4)
+    p = conn.UniformInRange(p=1., max_dist=150.)
+    connector = conn.GapJunction(p=p, p_arg=conn.spherical_dist,
+                                 verbose=False, save_report=False, seed=1)
+    connector.setup_nodes(pool, pool)
+    built = run_rule(connector.edge_params())
+    dist = pair_distances(pool)
+    # Each pair within range is connected once like the pairwise loop
+    assert np.array_equal(built, np.triu(dist <= 150., k=1))
+    for i, j in zip(*np.nonzero(built)):
+        assert connector.get_conn_prop(i, j) == pytest.approx(dist[i, j])
+        assert connector.get_conn_prop(j, i) == pytest.approx(dist[i, j])
+
+
+def test_correlated_gap_junction_follows_chemical_synapses():
+    pool = make_pool(50, 'A', seed=4)
+    reference = conn.ReciprocalConnector(
+        p0=0.3, pr=0.15, verbose=False, save_report=False, seed=1)
+    reference.setup_nodes(pool, pool)
+    # Both directions are built in one stage for a recurrent population
+    chem = run_rule(reference.edge_params()) > 0
+    n_chem = chem.astype(int) + chem.T
+    for n, ps in enumerate(([1., 0., 0.], [0., 1., 0.], [0., 0., 1.])):
+        connector = conn.CorrelatedGapJunction(
+            *ps, connector=reference, verbose=False, save_report=False,
+            seed=2)
+        connector.setup_nodes(pool, pool)
+        built = run_rule(connector.edge_params())
+        assert np.array_equal(built > 0, np.triu(n_chem == n, k=1))
+
+
+# Deterministic parallel generation
+def build_reciprocal(pools, **kwargs):
+    """Forward and backward connections of a ReciprocalConnector"""
+    connector = conn.ReciprocalConnector(
+        p0=gaussian(), p0_arg=conn.spherical_dist, p1=0.1,
+        pr=conn.NormalizedReciprocalRate(NRR=2.), pr_arg='p0_arg',
+        verbose=False, save_report=False, **kwargs)
+    connector.setup_nodes(*pools)
+    forward, backward = connector.edge_params(), connector.edge_params()
+    return run_rule(forward), run_rule(backward), connector
+
+
+def test_connections_independent_of_workers(pools):
+    forward, backward, connector = build_reciprocal(pools, block_size=7)
+    assert forward.any() and backward.any()
+    parallel = build_reciprocal(pools, block_size=7, n_workers=3,
+                                seed=connector.seed)
+    assert np.array_equal(parallel[0], forward)
+    assert np.array_equal(parallel[1], backward)
+    again = build_reciprocal(pools, block_size=7, seed=connector.seed)
+    assert np.array_equal(again[0], forward)
+    other = build_reciprocal(pools, block_size=7, seed=connector.seed + 1)
+    assert not np.array_equal(other[0], forward)
+
+    gap = []
+    for n_workers in (1, 2):
+        connector = conn.GapJunction(
+            p=gaussian(), p_arg=conn.spherical_dist, verbose=False,
+            save_report=False, seed=3, n_workers=n_workers, block_size=5)
+        connector.setup_nodes(pools[0], pools[0])
+        gap.append(run_rule(connector.edge_params()))
+    assert np.array_equal(*gap)
+
+
+# Out-of-core generation
+def test_out_of_core_same_as_in_memory(pools, tmp_path):
+    built, connectors = [], []
+    for out_of_core in (False, True):
+        connector = conn.UnidirectionConnector(
+            p=gaussian(), p_arg=conn.spherical_dist, verbose=False,
+            save_report=False, seed=1, block_size=4, out_of_core=out_of_core,
+            tmp_dir=str(tmp_path))
+        connector.setup_nodes(*pools)
+        built.append(run_rule(connector.edge_params()))
+        connectors.append(connector)
+    assert np.array_equal(*built)
+    in_memory, out_of_core = connectors
+    assert out_of_core.conn_prop == {}
+    for sid, props in in_memory.conn_prop.items():
+        for tid, prop in props.items():
+            assert out_of_core.get_conn_prop(sid, tid) == prop
+    with pytest.raises(KeyError):
+        out_of_core.get_conn_prop(0, 0)
+
+    forward, backward, _ = build_reciprocal(pools, seed=1, block_size=4)
+    spilled = build_reciprocal(pools, seed=1, block_size=4, out_of_core=True,
+                               tmp_dir=str(tmp_path))
+    assert np.array_equal(spilled[0], forward)
+    assert np.array_equal(spilled[1], backward)
+
+
+# Estimation of rho
+def pairwise_rho(pools, p0, p1, pr, dist_range=None):
+    """rho estimated by the loop over pairs of the former implementation"""
+    p0p1_sum = norm_fac_sum = 0.
+    n = 0
+    for source in pools[0]:
+        for target in pools[1]:
+            dist = conn.spherical_dist(source, target)
+            q0, q1 = p0(dist), p1(dist)
+            valid = q0 > 0 and q1 > 0 if dist_range is None \
+                else dist_range[0] <= dist <= dist_range[1]
+            if valid:
+                n += 1
+                p0p1_sum += q0 * q1
+                norm_fac_sum += (q0 * (1 - q0) * q1 * (1 - q1)) ** .5
+    return (pr * n - p0p1_sum) / norm_fac_sum
+
+
+@pytest.mark.parametrize('dist_range', [None, (50., 250.)])
+def test_estimated_rho_matches_pairwise(pools, dist_range):
+    p0 = gaussian()
+    p1 = conn.GaussianDropoff(stdev=150., max_dist=350., pmax=0.2)
+    connector = conn.ReciprocalConnector(
+        p0=p0, p0_arg=conn.spherical_dist, p1=p1, p1_arg=conn.spherical_dist,
+        pr=0.03, dist_range_forward=dist_range, verbose=False,
+        save_report=False, seed=1, block_size=6)
+    connector.setup_nodes(*pools)
+    forward, backward = connector.edge_params(), connector.edge_params()
+    run_rule(forward)
+    run_rule(backward)
+    expected = pairwise_rho(pools, p0, p1, 0.03, dist_range)
+    assert -1 < expected < 1
+    assert connector.rho == pytest.approx(expected)
+
+
+# Array edge-property functions
+def test_edge_property_rule_matches_scalar_functions(pools):
+    connector = conn.UnidirectionConnector(
+        p=gaussian(), p_arg=conn.spherical_dist, n_syn=2, verbose=False,
+        save_report=False, seed=1)
+    connector.setup_nodes(*pools)
+    params = connector.edge_params()
+    rule = conn.EdgePropertyRule(conn.syn_dist_delay_feng_section_PN_array,
+                                 connector, p=1., fluc_stdev=0.)
+    built = run_rule(params)
+    sources, targets = list(pools[0]), list(pools[1])
+    n_edges = 0
+    # Edges in the order BMTK iterates them, one per synapse
+    for i, j in zip(*np.nonzero(built)):
+        for _ in range(built[i, j]):
+            delay, sec_id, sec_x = rule(sources[i], targets[j])
+            expected = conn.syn_dist_delay_feng_section_PN(
+                sources[i], targets[j], p=1., fluc_stdev=0.,
+                connector=connector)
+            assert delay == pytest.approx(expected[0])
+            assert (sec_id, sec_x) == expected[1:]
+            n_edges += 1
+    assert n_edges == 2 * np.count_nonzero(built) > 0
+    with pytest.raises(ValueError, match="order"):
+        rule = conn.EdgePropertyRule(conn.syn_dist_delay_feng_array, connector)
+        rule(targets[0], sources[0])
+
+    conn_prop = np.linspace(0., 500., 11)
+    delay = conn.syn_dist_delay_feng_array(conn_prop, fluc_stdev=0.)
+    assert np.allclose(delay, [conn.syn_dist_delay_feng(
+        sources[0], targets[0], fluc_stdev=0., connector=Dist(d))
+        for d in conn_prop])
+    sec_id, sec_x = conn.syn_section_PN_array(conn_prop, p=0.)
+    assert np.all(sec_id == 2) and np.all(sec_x == 0.6)
+
+
+class Dist(object):
+    """Stand-in connector returning a fixed distance for any pair"""
+
+    def __init__(self, dist):
+        self.dist = dist
+
+    def get_conn_prop(self, sid, tid):
+        return self.dist
+
+
+# Shared distance cache
+def test_pair_values_match_scalar_distances():
+    pool = list(make_pool(20, 'A', seed=5))
+    rows, cols = np.triu_indices(20, k=1)
+    conn.distance_cache.clear()
+    for func in (conn.spherical_dist, conn.cylindrical_dist_z):
+        expected = conn.pair_values(lambda s, t: func(s, t), pool, pool,
+                                    rows, cols)
+        key = (conn.positions_key(conn.node_positions(pool)), 'test')
+        for _ in range(2):
+            dist = conn.pair_values(func, pool, pool, rows, cols,
+                                    cache_key=key)
+            assert np.allclose(dist, expected)
+        assert not dist.flags.writeable
+    assert conn.distance_cache.hits == 2 and conn.distance_cache.misses == 2
+    conn.distance_cache.clear()
+
+
+def test_distance_cache_shared_across_connectors():
+    pool = make_pool(60, 'A', seed=6)
+    built = []
+    for max_bytes in (conn.DIST_CACHE_BYTES, 0):
+        conn.distance_cache.clear()
+        conn.distance_cache.max_bytes = max_bytes
+        reference = conn.ReciprocalConnector(
+            p0=gaussian(), p0_arg=conn.spherical_dist, pr=0.05,
+            verbose=False, save_report=False, seed=1, block_size=8)
+        reference.setup_nodes(pool, pool)
+        chem = run_rule(reference.edge_params())
+        connector = conn.CorrelatedGapJunction(
+            p_non=gaussian(), p_uni=0.5, p_rec=0.9, connector=reference,
+            verbose=False, save_report=False, seed=2, block_size=8)
+        connector.setup_nodes(pool, pool)
+        built.append((chem, run_rule(connector.edge_params())))
+        if max_bytes:
+            assert conn.distance_cache.hits > 0
+        else:
+            assert conn.distance_cache.nbytes == 0
+    conn.distance_cache.max_bytes = conn.DIST_CACHE_BYTES
+    assert np.array_equal(built[0][0], built[1][0])
+    assert np.array_equal(built[0][1], built[1][1])
+
+
+# Sparse Bernoulli sampling
+@pytest.mark.parametrize('p', [0.003, 0.05, 0.2, 0.6])
+def test_bernoulli_indices_distribution(p):
+    rng = np.random.default_rng(0)
+    n, trials = 1000, 2000
+    counts = np.zeros(n)
+    totals = []
+    for _ in range(trials):
+        idx = conn.bernoulli_indices(p, n, rng)
+        assert np.all(np.diff(idx) > 0) and (idx.size == 0 or
+                                             0 <= idx[0] and idx[-1] < n)
+        counts[idx] += 1
+        totals.append(idx.size)
+    # Same distribution as independent decisions for each index
+    mean, var = n * p, n * p * (1 - p)
+    assert np.mean(totals) == pytest.approx(mean, abs=4 * (var / trials) ** .5)
+    assert np.var(totals) == pytest.approx(var, rel=0.15)
+    bins = counts.reshape(10, -1).sum(axis=1)
+    expected = trials * p * n / 10
+    assert np.sum((bins - expected) ** 2 / expected) < 30  # chi2, 9 dof
+
+    p_array = np.where(np.arange(n) % 2, p, 0.)
+    mask = conn.bernoulli_mask(p_array, rng)
+    assert not mask[::2].any()
+    assert conn.bernoulli_mask(np.zeros(5), rng).sum() == 0
+
+
+def test_upper_triangle_blocks():
+    n = 13
+    rows, cols = np.concatenate(
+        [conn.triu_block(i, min(i + 4, n), n) for i in range(0, n, 4)], axis=1)
+    expected = np.triu_indices(n, k=1)
+    assert np.array_equal(rows, expected[0])
+    assert np.array_equal(cols, expected[1])
+    idx = np.array([0, 5, 11, 20])
+    r, c = conn.triu_index_pairs(0, n, n, idx)
+    assert np.array_equal(r, expected[0][idx])
+    assert np.array_equal(c, expected[1][idx])
+
+
+# Fixed degree
+def test_fixed_in_degree(pools):
+    connector = conn.FixedDegreeConnector(
+        k=5, direction='in', verbose=False, save_report=False, seed=1)
+    connector.setup_nodes(*pools)
+    built = run_rule(connector.edge_params())
+    assert np.all(built.sum(axis=0) == 5) and built.max() == 1
+
+    # Recurrent without autapses, k an array per cell
+    pool = make_pool(30, 'A', seed=7)
+    k = np.arange(30) % 4
+    connector = conn.FixedDegreeConnector(
+        k=k, direction='in', verbose=False, save_report=False, seed=1)
+    connector.setup_nodes(pool, pool)
+    built = run_rule(connector.edge_params())
+    assert np.array_equal(built.sum(axis=0), k)
+    assert not np.any(np.diag(built))
+
+
+def test_fixed_out_degree_within_distance(pools):
+    p = conn.UniformInRange(p=1., min_dist=20., max_dist=120.)
+    connector = conn.FixedDegreeConnector(
+        k=4, direction='out', p=p, verbose=False, save_report=False, seed=1,
+        block_size=7)
+    connector.setup_nodes(*pools)
+    built = run_rule(connector.edge_params())
+    sources = np.array([node['positions'] for node in pools[0]])
+    targets = np.array([node['positions'] for node in pools[1]])
+    dist = np.linalg.norm(sources[:, None] - targets, axis=-1)
+    possible = (dist >= 20.) & (dist <= 120.)
+    assert not np.any(built[~possible])
+    expected = np.fmin(possible.sum(axis=1), 4)
+    assert np.array_equal(built.sum(axis=1), expected)
+    assert connector.n_short == np.count_nonzero(possible.sum(axis=1) < 4)
+
+    # Same connections with a different number of workers
+    parallel = conn.FixedDegreeConnector(
+        k=4, direction='out', p=p, verbose=False, save_report=False, seed=1,
+        block_size=7, n_workers=2)
+    parallel.setup_nodes(*pools)
+    assert np.array_equal(run_rule(parallel.edge_params()), built)
+
+    # In-degree of the target cells
+    connector = conn.FixedDegreeConnector(
+        k=4, direction='in', p=p, verbose=False, save_report=False, seed=1)
+    connector.setup_nodes(*pools)
+    built = run_rule(connector.edge_params())
+    assert not np.any(built[~possible])
+    assert np.array_equal(built.sum(axis=0),
+                          np.fmin(possible.sum(axis=0), 4))
+
+
+# One to one sequential
+@pytest.mark.parametrize('partition_source', [False, True])
+def test_one_to_one_sequential(partition_source):
+    pool = make_pool(30, 'A', seed=8)
+    parts = [make_pool(n, 'B%d' % i, 100 + 10 * i, seed=i)
+             for i, n in enumerate((10, 12, 8))]
+    connector = conn.OneToOneSequentialConnector(
+        n_syn=2, partition_source=partition_source, verbose=False)
+    params = []
+    for i, part in enumerate(parts):
+        if partition_source:
+            connector.setup_nodes(source=part, target=pool if i == 0 else None)
+        else:
+            connector.setup_nodes(source=pool if i == 0 else None, target=part)
+        params.append(connector.edge_params())
+    built = [run_rule(p) for p in params]
+    if partition_source:
+        built = [b.T for b in built]
+    # Each cell of the single population connects to one cell of the parts
+    assert np.array_equal(np.hstack(built), 2 * np.eye(30, dtype=int))
+    assert connector.stats.counters['connections'] == 30
+
+
+# Persistent connection cache
+def test_connection_cache(pools, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    forward, backward, connector = build_reciprocal(
+        pools, seed=1, cache_dir=cache_dir)
+    assert connector.stats.counters['loaded_from_cache'] == 0
+    assert len(os.listdir(cache_dir)) == 1
+    cached = build_reciprocal(pools, seed=1, cache_dir=cache_dir)
+    assert cached[2].stats.counters['loaded_from_cache'] == 1
+    assert np.array_equal(cached[0], forward)
+    assert np.array_equal(cached[1], backward)
+    assert cached[2].rho == connector.rho
+    assert cached[2].conn_prop == connector.conn_prop
+
+    # A different seed or parameters are not loaded from the cache
+    other = build_reciprocal(pools, seed=2, cache_dir=cache_dir)
+    assert other[2].stats.counters['loaded_from_cache'] == 0
+    assert len(os.listdir(cache_dir)) == 2
+    connector = conn.UnidirectionConnector(
+        p=0.3, verbose=False, save_report=False, seed=1, cache_dir=cache_dir)
+    connector.setup_nodes(*pools)
+    run_rule(connector.edge_params())
+    assert connector.stats.counters['loaded_from_cache'] == 0
+    assert len(os.listdir(cache_dir)) == 3
+
+    # Caching is disabled without a seed
+    connector = conn.UnidirectionConnector(
+        p=0.3, verbose=False, save_report=False, cache_dir=cache_dir)
+    connector.setup_nodes(*pools)
+    run_rule(connector.edge_params())
+    assert len(os.listdir(cache_dir)) == 3
+
+
+# Instrumentation
+def test_connector_stats(pools, tmp_path):
+    connector = conn.UnidirectionConnector(
+        p=gaussian(), p_arg=conn.spherical_dist, verbose=False,
+        save_report=False, seed=1, block_size=8)
+    connector.setup_nodes(*pools)
+    built = run_rule(connector.edge_params())
+    forward, backward, reciprocal = build_reciprocal(pools, seed=1)
+    stats = connector.stats.to_dict()
+    assert stats['counters']['connections'] == np.count_nonzero(built)
+    assert stats['counters']['pairs_evaluated'] == 40 * 30
+    assert stats['peaks']['block_pairs'] == 8 * 30
+    assert {'initialize', 'sample', 'assignment'} <= set(stats['stages'])
+    assert stats['total_time'] == pytest.approx(sum(stats['stages'].values()))
+    assert reciprocal.stats.counters['connections'] == \
+        np.count_nonzero(forward) + np.count_nonzero(backward)
+
+    path = str(tmp_path / 'stats.json')
+    record = conn.connector_stats([connector, reciprocal], path=path)
+    with open(path) as f:
+        assert json.load(f) == json.loads(json.dumps(record))
+    names = [r['name'] for r in record['connectors']]
+    assert names == [conn.connector_name(connector),
+                     conn.connector_name(reciprocal)]
+    assert record['total']['counters']['connections'] == \
+        stats['counters']['connections'] \
+        + reciprocal.stats.counters['connections']
+
+
+# Batched probability functions
+def test_batched_probability_matches_scalar_calls():
+    dist = np.linspace(0., 400., 41)
+    p0, p1 = np.linspace(0.05, 0.5, 41), 0.2
+    g = gaussian()
+    uniform = conn.UniformInRange(p=0.1, min_dist=50., max_dist=300.)
+    for func in (g, uniform):
+        assert np.allclose(conn.probability_values(func, dist),
+                           [func(d) for d in dist])
+    nrr = conn.NormalizedReciprocalRate(NRR=lambda d: 1. + d / 400.)
+    assert np.allclose(nrr.probability(dist, p0, p1),
+                       [nrr(d, q0, p1) for d, q0 in zip(dist, p0)])
+    lam = conn.probability_values(lambda d: g(d), dist.reshape(1, -1))
+    assert lam.shape == (1, 41) and np.allclose(lam[0], g.masked_probability(dist))
+
+
+def test_batched_and_scalar_functions_build_same_connections(pools):
+    g = gaussian()
+    nrr = conn.NormalizedReciprocalRate(NRR=2.)
+    built = []
+    for p0, pr in ((g, nrr), (lambda d: g(d), lambda d, p0, p1: nrr(d, p0, p1))):
+        connector = conn.ReciprocalConnector(
+            p0=p0, p0_arg=conn.spherical_dist, p1=0.1, pr=pr, pr_arg='p0_arg',
+            verbose=False, save_report=False, seed=3)
+        connector.setup_nodes(*pools)
+        forward, backward = connector.edge_params(), connector.edge_params()
+        built.append((run_rule(forward), run_rule(backward)))
+    assert built[0][0].any() and built[0][1].any()
+    assert np.array_equal(built[0][0], built[1][0])
+    assert np.array_equal(built[0][1], built[1][1])
@@ -0,0 +1,108 @@
+import os
+
+import h5py
+import numpy as np
+
+from bmtool.analysis import spikes
+from bmtool.util.util import expand_files, spikes_in_window
+
+
+def spike_file(path, node_ids, timestamps, sorting=None, on='group'):
+    """Write spikes of population 'cortex' with a SONATA sorting attribute
+    on the population group or on its node_ids dataset"""
+    with h5py.File(path, 'w') as f:
+        grp = f.create_group('spikes/cortex')
+        grp.create_dataset('node_ids', data=node_ids)
+        grp.create_dataset('timestamps', data=timestamps)
+        if sorting is not None:
+            obj = grp if on == 'group' else grp['node_ids']
+            dtype = h5py.enum_dtype({'none': 0, 'by_id': 1, 'by_time': 2}, basetype='u1')
+            obj.attrs.create('sorting', sorting, dtype=dtype)
+    return path
+
+
+def random_spikes(n, seed):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 100, size=n), np.round(rng.uniform(0, 1000, size=n), 1)
+
+
+def sorted_pairs(df):
+    """Array of (timestamp, node id) of spikes sorted by time, then by id"""
+    pairs = df[['timestamps', 'node_ids']].to_numpy(dtype=float)
+    return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+
+def test_sorting_attribute_on_group_or_node_ids(tmp_path):
+    node_ids, timestamps = random_spikes(5000, 0)
+    order = np.argsort(timestamps, kind='stable')
+    mask = (timestamps >= 200) & (timestamps < 300)
+    expected = np.sort(timestamps[mask])
+    for on in ('group', 'node_ids'):
+        path = spike_file(str(tmp_path / ('sorted_%s.h5' % on)), node_ids[order],
+                          timestamps[order], sorting=2, on=on)
+        with h5py.File(path, 'r') as f:
+            assert spikes._is_sorted_by_time(f['spikes/cortex'])
+        ids, ts, by_time = spikes._read_spikes(path, 'cortex', 200, 300)
+        assert by_time
+        assert np.array_equal(ts, expected)
+        assert np.array_equal(ids, node_ids[order][(timestamps[order] >= 200)
+                                                   & (timestamps[order] < 300)])
+    path = spike_file(str(tmp_path / 'by_id.h5'), node_ids, timestamps, sorting=1, on='node_ids')
+    with h5py.File(path, 'r') as f:
+        assert not spikes._is_sorted_by_time(f['spikes/cortex'])
+
+
+def test_sorted_sidecar_not_matched_by_glob(tmp_path):
+    paths = []
+    parts = [random_spikes(3000, seed) for seed in range(3)]
+    for rank, (node_ids, timestamps) in enumerate(parts):
+        paths.append(spike_file(str(tmp_path / ('spikes_%d.h5' % rank)), node_ids, timestamps))
+    pattern = str(tmp_path / 'spikes*')
+    all_ts = np.concatenate([p[1] for p in parts])
+    expected = np.sort(all_ts[(all_ts >= 100) & (all_ts < 400)])
+    for _ in range(2):
+        df = spikes.load_spikes_to_df(pattern, 'cortex', t_start=100, t_stop=400, cache_sorted=True)
+        assert np.array_equal(df['timestamps'].values, expected)
+        assert expand_files(pattern) == paths
+    assert all(os.path.exists(path + '.sorted') for path in paths)
+
+    # Same as masking all spikes loaded without the sorted copies
+    full = spikes.load_spikes_to_df(pattern, 'cortex')
+    window = spikes_in_window(full, 100, 400)
+    assert np.array_equal(df['timestamps'].values, window['timestamps'].values)
+    assert len(full) == all_ts.size
+
+
+def test_sorted_sidecar_rewritten_when_spikes_change(tmp_path):
+    path = str(tmp_path / 'spikes.h5')
+    node_ids, timestamps = random_spikes(1000, 0)
+    spike_file(path, node_ids, timestamps)
+    first = spikes.load_spikes_to_df(path, 'cortex', t_start=0, t_stop=500, cache_sorted=True)
+    node_ids, timestamps = random_spikes(2000, 1)
+    spike_file(path, node_ids, timestamps)
+    mtime = os.path.getmtime(path) + 10
+    os.utime(path, (mtime, mtime))
+    second = spikes.load_spikes_to_df(path, 'cortex', t_start=0, t_stop=500, cache_sorted=True)
+    assert len(second) == np.count_nonzero(timestamps < 500)
+    assert len(second) != len(first)
+
+
+def test_partial_spike_files_merged(tmp_path):
+    parts = [random_spikes(2000, seed) for seed in range(3)]
+    for rank, (node_ids, timestamps) in enumerate(parts):
+        spike_file(str(tmp_path / ('rank_%d.h5' % rank)), node_ids, timestamps)
+    # A rank without spikes of the population is skipped
+    with h5py.File(str(tmp_path / 'rank_3.h5'), 'w') as f:
+        f.create_group('spikes/thalamus')
+    node_ids = np.concatenate([p[0] for p in parts])
+    timestamps = np.concatenate([p[1] for p in parts])
+    expected = np.lexsort((node_ids, timestamps))
+    for n_workers in (1, 2):
+        df = spikes.load_spikes_to_df(str(tmp_path / 'rank_*.h5'), 'cortex', n_workers=n_workers)
+        assert np.all(np.diff(df['timestamps'].values) >= 0)
+        # Spikes at the same time may be in any order
+        assert np.array_equal(sorted_pairs(df), np.column_stack((timestamps, node_ids))[expected])
+    single = spike_file(str(tmp_path / 'all.h5'), node_ids, timestamps)
+    window = spikes.load_spikes_to_df(single, 'cortex', t_start=250, t_stop=750)
+    merged = spikes.load_spikes_to_df(str(tmp_path / 'rank_*.h5'), 'cortex', t_start=250, t_stop=750)
+    assert np.array_equal(sorted_pairs(window), sorted_pairs(merged))
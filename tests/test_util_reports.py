@@ -0,0 +1,216 @@
+import numpy as np
+import pytest
+
+from conftest import cell_report, split_report
+from bmtool.util.util import CellVarsFile, EdgeVarsFile, GidTable, get_synapse_vars
+
+
+# Gid mapping
+def test_gid_table_matches_mapping(cell_report_file):
+    path, gids, ip, data = cell_report_file
+    table = CellVarsFile(path).gid_table
+    # Dictionary built element by element like the former implementation
+    expected = {gid: (ip[i], ip[i + 1]) for i, gid in enumerate(gids)}
+    assert dict(table) == expected
+    assert list(table) == gids.tolist() and len(table) == gids.size
+    query = np.array([gids[5], 1, gids[0], gids[-1], 99999])
+    assert np.array_equal(table.index(query), [5, -1, 0, gids.size - 1, -1])
+    assert gids[3] in table and 1 not in table and list(gids[:2]) not in table
+    with pytest.raises(KeyError):
+        table[1]
+    assert len(GidTable([], [0])) == 0
+    assert np.array_equal(GidTable([], [0]).index([1, 2]), [-1, -1])
+
+
+# Chunk cache
+def test_chunk_cache_serves_repeated_reads(cell_report_file):
+    path, gids, ip, data = cell_report_file
+    report = CellVarsFile(path, cache_mb=1)
+    window = slice(100, 300)
+    first = report.read_columns('v', window, [3, 20, 21])
+    info = report.chunk_cache.info()
+    assert info['misses'] > 0 and info['hits'] == 0
+    second = report.read_columns('v', window, [21, 3])
+    assert np.array_equal(first, data[window][:, [3, 20, 21]])
+    assert np.array_equal(second, data[window][:, [21, 3]])
+    assert report.chunk_cache.info()['hits'] > 0
+    assert report.chunk_cache.info()['misses'] == info['misses']
+
+
+def test_chunk_cache_bypassed_by_oversized_reads(cell_report_file):
+    path, gids, ip, data = cell_report_file
+    report = CellVarsFile(path, cache_mb=1)
+    cache = report.chunk_cache
+    assert data.nbytes > cache.max_bytes
+    small = report.read_columns('v', slice(0, 100), [0])
+    info = cache.info()
+    columns = np.arange(data.shape[1])
+    full = report.read_columns('v', slice(None), columns)
+    assert np.array_equal(full, data)
+    # The large read neither counted nor evicted the cached chunks
+    assert cache.info() == info
+    assert np.array_equal(report.read_columns('v', slice(0, 100), [0]), small)
+    assert cache.info()['hits'] == info['hits'] + 1
+
+    uncached = CellVarsFile(path, cache_mb=0)
+    assert uncached.chunk_cache is None
+    assert np.array_equal(uncached.read_columns('v', slice(None), columns),
+                          data)
+
+
+# Batched multi-gid reads
+def test_data_many_matches_single_reads(cell_report_file):
+    path, gids, ip, data = cell_report_file
+    report = CellVarsFile(path)
+    query = [gids[7], gids[2], 1, gids[30], gids[2]]
+    for compartments in ('origin', 'all'):
+        values, index = report.data_many(query, 'v', time_window=(5., 50.),
+                                         compartments=compartments)
+        assert index.size == len(query) + 1 and values.shape[0] == 450
+        assert index[3] == index[2]  # gid not in the report
+        for k, gid in enumerate(query):
+            if gid == 1:
+                continue
+            single = report.data(gid, 'v', time_window=(5., 50.),
+                                 compartments=compartments)
+            i = list(gids).index(gid)
+            begin = ip[i]
+            end = begin + 1 if compartments == 'origin' else ip[i + 1]
+            expected = data[50:500, begin:end]
+            assert np.array_equal(values[:, index[k]:index[k + 1]], expected)
+            # Single compartments are 1D, multiple ones (compartments, time)
+            single = single[:, None] if single.ndim == 1 else single.T
+            assert np.array_equal(single, expected)
+    values, index = report.data_many([], 'cai')
+    assert values.shape == (1000, 0) and np.array_equal(index, [0])
+
+
+# Compartment selection and time windows
+def test_compartments_and_time_windows(cell_report_file):
+    path, gids, ip, data = cell_report_file
+    report = CellVarsFile(path)
+    i = int(np.argmax(np.diff(ip)))  # gid with most compartments
+    gid, begin, end = gids[i], ip[i], ip[i + 1]
+    assert end - begin > 2
+    elements = report.compartment_ids(gid)
+    assert np.array_equal(elements, np.arange(end - begin))
+    selected = report.data(gid, 'v', compartments=[0, 2, 99])
+    assert np.array_equal(selected, data[:, [begin, begin + 2]].T)
+    assert np.array_equal(report.data(gid, 'v', compartments=1),
+                          data[:, [begin + 1]].T)
+    values, index = report.data_many([gid, gids[0]], 'v', compartments=[1, 2])
+    columns = [begin + 1, begin + 2] + [ip[0] + e for e in (1, 2) if ip[0] + e < ip[1]]
+    assert np.array_equal(values, data[:, columns])
+
+    # Window bounds on time steps despite float rounding, clipped to the end
+    assert np.array_equal(report.data(gid, 'v', time_window=(0.3, 0.7)),
+                          data[3:7, begin])
+    assert np.array_equal(report.data(gid, 'v', time_window=(99.5, 200.)),
+                          data[995:, begin])
+    assert report.data(gid, 'v', time_window=(150., 200.)).size == 0
+    with pytest.raises(Exception):
+        report.data(gid, 'v', time_window=(0., 1., 2.))
+
+
+# Source filtering of synapse reports
+def test_synapse_source_filtering(edge_report_file):
+    path, gids, ip, src_ids, data = edge_report_file
+    report = EdgeVarsFile(path)
+    sources = [100, 105, 111, 119]
+    assert report.sources() == src_ids.tolist()
+    assert np.array_equal(report.sources(0), src_ids[ip[0]:ip[1]])
+    for gid in gids:
+        columns = np.arange(ip[gid], ip[gid + 1])
+        columns = columns[np.isin(src_ids[columns], sources)]
+        filtered = report.data(gid, 'W_ampa', compartments='all', sources=sources)
+        assert np.array_equal(filtered, data[:, columns].T)
+
+    targets = [0, 7, 3]
+    values, syn_sources, syn_targets = get_synapse_vars(
+        None, None, 'W_ampa', targets, source_gids=sources, var_report=report)
+    columns = np.concatenate([np.arange(ip[g], ip[g + 1]) for g in targets])
+    expected_targets = np.concatenate([[g] * (ip[g + 1] - ip[g]) for g in targets])
+    mask = np.isin(src_ids[columns], sources)
+    assert np.array_equal(values, data[:, columns[mask]].T)
+    assert np.array_equal(syn_sources, src_ids[columns[mask]])
+    assert np.array_equal(syn_targets, expected_targets[mask])
+
+    values, _, _ = get_synapse_vars(None, None, 'W_ampa', targets, var_report=report,
+                                    time=10, time_compare=50)
+    assert np.allclose(values[:, 0], data[50, columns] - data[10, columns])
+
+
+# Min/max pyramid and envelopes
+def test_envelope_matches_direct_decimation(tmp_path):
+    path = str(tmp_path / 'long_report.h5')
+    gids, ip, data = cell_report(path, n=20, steps=20000)
+    report = CellVarsFile(path)
+    pyramid_file = str(tmp_path / 'v_report.pyramid.h5')
+    pyramid = report.pyramid('v', pyramid_file)
+    for bin_size, mins, maxs in zip(pyramid.bin_sizes, pyramid.mins, pyramid.maxs):
+        bins = np.arange(0, data.shape[0], bin_size)
+        assert np.array_equal(mins, np.minimum.reduceat(data, bins, axis=0))
+        assert np.array_equal(maxs, np.maximum.reduceat(data, bins, axis=0))
+
+    # The sidecar is reused by a new reader and matches the built pyramid
+    loaded = CellVarsFile(path).pyramid('v', pyramid_file)
+    assert loaded.bin_sizes == pyramid.bin_sizes
+    assert all(np.array_equal(a, b) for a, b in zip(loaded.maxs, pyramid.maxs))
+
+    select = [gids[4], gids[0], 1]
+    columns = ip[[4, 0]]
+    time_trace = report.time_trace
+    # Window aligned to the bins of a level
+    time, mins, maxs, index = report.envelope(select, 'v', time_window=(0., 1024.),
+                                              max_points=100)
+    bin_size = pyramid.bin_sizes[pyramid.level(10240 // 100)]
+    bins = np.arange(0, 10240, bin_size)
+    assert np.array_equal(index, [0, 1, 2, 2])
+    assert np.array_equal(mins, np.minimum.reduceat(data[:10240, columns], bins, axis=0))
+    assert np.array_equal(maxs, np.maximum.reduceat(data[:10240, columns], bins, axis=0))
+    assert np.array_equal(time, time_trace[bins + bin_size // 2])
+
+    # Windows finer than the pyramid are decimated directly
+    time, mins, maxs, _ = report.envelope(select, 'v', time_window=(10., 30.),
+                                          max_points=20)
+    direct = data[100:300, columns]
+    bins = np.arange(0, 200, 10)
+    assert np.array_equal(mins, np.minimum.reduceat(direct, bins, axis=0))
+    assert np.array_equal(maxs, np.maximum.reduceat(direct, bins, axis=0))
+
+    # Short windows are returned as is
+    time, mins, maxs, _ = report.envelope(select, 'v', time_window=(10., 15.))
+    assert np.array_equal(mins, data[100:150, columns]) and mins is maxs
+
+
+# Partial report files
+def test_partial_reports_read_as_full_report(tmp_path, cell_report_file):
+    path, gids, ip, data = cell_report_file
+    paths = split_report(path, 3, str(tmp_path / 'v_rank'))
+    full = CellVarsFile(path)
+    merged = CellVarsFile(str(tmp_path / 'v_rank*.h5'))
+    assert dict(merged.gid_table) == dict(full.gid_table)
+    assert np.array_equal(merged.element_ids, full.element_ids)
+    assert np.array_equal(merged.h5_dataset('v')[()], data)
+    # Files in another order, with columns of gids in that order. The files
+    # are read by forked workers while the first merged report is open.
+    for merged in (merged, CellVarsFile(paths[::-1], n_workers=2)):
+        assert sorted(merged.gid_table) == sorted(gids) and merged.units('v') == 'mV'
+        values, index = merged.data_many(gids[::7], 'cai', time_window=(5., 25.),
+                                         compartments='all')
+        expected, expected_index = full.data_many(gids[::7], 'cai', time_window=(5., 25.),
+                                                  compartments='all')
+        assert np.array_equal(values, expected) and np.array_equal(index, expected_index)
+        assert np.array_equal(merged.data(gids[-1], 'v'), data[:, ip[-2]])
+
+
+def test_partial_synapse_reports_read_as_full_report(tmp_path, edge_report_file):
+    path, gids, ip, src_ids, data = edge_report_file
+    split_report(path, 4, str(tmp_path / 'syn_rank'))
+    merged = EdgeVarsFile(str(tmp_path / 'syn_rank*.h5'))
+    assert merged.sources() == src_ids.tolist()
+    for gid in (0, 9, 19):
+        columns = np.arange(ip[gid], ip[gid + 1])
+        columns = columns[src_ids[columns] < 110]
+        assert np.array_equal(merged.data(gid, 'W_ampa', compartments='all',
+                                          sources=range(100, 110)), data[:, columns].T)